@@ -0,0 +1,151 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import gzip
+import json
+import os
+import tempfile
+import zlib
+
+from ahc_tools import ingest
+
+# zlib window bits producing and reading the gzip format.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class ArchiveError(Exception):
+    """The facts archive or its index is missing or invalid."""
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+def _compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, _GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ArchiveWriter(object):
+    """Write the facts of nodes to a facts archive.
+
+    The archive is a gzip file of JSON lines, one {"uuid", "facts"} record
+    per node. Each record is compressed as its own gzip member, so the whole
+    file still reads as a single gzip stream (e.g. with zcat), while the
+    index, a '<uuid> <offset> <length>' line per record in <path>.idx,
+    allows decompressing a single record. Both files are only put in place
+    when the writer is closed without error.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, self._tmp_path = tempfile.mkstemp(dir=directory)
+        self._file = os.fdopen(fd, 'wb')
+        fd, self._tmp_index_path = tempfile.mkstemp(dir=directory)
+        self._index = os.fdopen(fd, 'w')
+
+    def add(self, uuid, facts):
+        record = json.dumps({'uuid': uuid, 'facts': list(facts)},
+                            sort_keys=True) + '\n'
+        member = _compress(record.encode('utf-8'))
+        self._index.write('%s %d %d\n' % (uuid, self._file.tell(),
+                                          len(member)))
+        self._file.write(member)
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+        self._index.close()
+        os.rename(self._tmp_path, self.path)
+        os.rename(self._tmp_index_path, index_path(self.path))
+
+    def abort(self):
+        self._file.close()
+        self._index.close()
+        os.unlink(self._tmp_path)
+        os.unlink(self._tmp_index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class ArchiveReader(object):
+    """Read the facts of nodes from a facts archive."""
+
+    def __init__(self, path):
+        self.path = path
+        self._index = None
+
+    @property
+    def index(self):
+        """The (offset, length) of each record, keyed by uuid."""
+        if self._index is None:
+            index = collections.OrderedDict()
+            try:
+                with open(index_path(self.path)) as index_file:
+                    for line in index_file:
+                        uuid, offset, length = line.split()
+                        index[uuid] = (int(offset), int(length))
+            except (IOError, ValueError) as e:
+                raise ArchiveError('Unable to read the index of the facts '
+                                   'archive %s: %s' % (self.path, e))
+            self._index = index
+        return self._index
+
+    def uuids(self):
+        return list(self.index)
+
+    def get(self, uuid):
+        """Return the facts of a node, only decompressing its record."""
+        try:
+            offset, length = self.index[uuid]
+        except KeyError:
+            raise ArchiveError('Node %s is not in the facts archive %s' %
+                               (uuid, self.path))
+        with open(self.path, 'rb') as archive:
+            archive.seek(offset)
+            member = archive.read(length)
+        try:
+            record = json.loads(
+                zlib.decompress(member, _GZIP_WBITS).decode('utf-8'))
+        except (zlib.error, ValueError) as e:
+            raise ArchiveError('Corrupted record for node %s in the facts '
+                               'archive %s: %s' % (uuid, self.path, e))
+        return _decode(record)
+
+    def __iter__(self):
+        """Yield the (uuid, facts) of all the nodes, in archive order.
+
+        This streams the archive and does not need the index.
+        """
+        try:
+            with gzip.open(self.path, 'rb') as archive:
+                for line in archive:
+                    record = json.loads(line.decode('utf-8'))
+                    yield record['uuid'], _decode(record)
+        except (IOError, OSError, ValueError) as e:
+            raise ArchiveError('Unable to read the facts archive %s: %s' %
+                               (self.path, e))
+
+
+def _decode(record):
+    return ingest.Facts(tuple(fact) for fact in record['facts'])
@@ -0,0 +1,140 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from oslo_config import cfg
+
+from ahc_tools import exc
+from ahc_tools import stats
+
+CONF = cfg.CONF
+
+LOG = logging.getLogger('ahc_tools.common.keystone')
+
+KEYSTONE_OPTS = [
+    cfg.StrOpt('auth_cache_dir',
+               default='~/.cache/ahc-tools',
+               help='Directory where the Keystone tokens and service '
+                    'catalogs are cached between runs, readable by the '
+                    'current user only. Set it to an empty value to '
+                    'authenticate on every run.'),
+    cfg.StrOpt('default_domain_id',
+               default='default',
+               help='Domain of the users and projects, when authenticating '
+                    'with the Keystone v3 API.'),
+]
+
+# Seconds a cached token must still be valid for to be reused.
+MIN_TOKEN_LIFE = 300
+
+
+def list_opts():
+    return [
+        ('keystone', KEYSTONE_OPTS)
+    ]
+
+
+CONF.register_opts(KEYSTONE_OPTS, group='keystone')
+
+# Sessions keyed by the cache id of their credentials, so the Ironic and
+# Swift clients share a token when they use the same credentials.
+_SESSIONS = {}
+_LOCK = threading.Lock()
+
+
+def get_session(auth_url, username, password, tenant_name):
+    """Return an authenticated keystoneauth session for the credentials.
+
+    The token and service catalog are read from the auth cache when it
+    holds a token valid for at least MIN_TOKEN_LIFE seconds, otherwise the
+    session authenticates and the cache is updated.
+
+    :raises: exc.MissingCredentialsError, if a credential is empty.
+    """
+    from keystoneauth1 import identity
+    from keystoneauth1 import session
+
+    if not (auth_url and username and password):
+        raise exc.MissingCredentialsError()
+    auth = identity.Password(
+        auth_url=auth_url,
+        username=username,
+        password=password,
+        project_name=tenant_name,
+        default_domain_id=CONF.keystone.default_domain_id)
+    cache_id = auth.get_cache_id()
+    with _LOCK:
+        if cache_id in _SESSIONS:
+            return _SESSIONS[cache_id]
+        sess = session.Session(auth=auth)
+        if _load_auth_state(auth, cache_id):
+            stats.incr('keystone.cache.hits')
+        else:
+            stats.incr('keystone.cache.misses')
+            with stats.timer('keystone.authenticate'):
+                auth.get_access(sess)
+            _save_auth_state(auth, cache_id)
+        _SESSIONS[cache_id] = sess
+        return sess
+
+
+def _cache_path(cache_id):
+    cache_dir = CONF.keystone.auth_cache_dir
+    if not cache_dir:
+        return None
+    # The cache id is base64, which may contain '/'.
+    name = hashlib.sha256(cache_id.encode('utf-8')).hexdigest() + '.json'
+    return os.path.join(os.path.expanduser(cache_dir), name)
+
+
+def _load_auth_state(auth, cache_id):
+    """Install the cached auth state, returns whether it is usable."""
+    path = _cache_path(cache_id)
+    if not path:
+        return False
+    try:
+        with open(path) as cache_file:
+            auth.set_auth_state(cache_file.read())
+    except (IOError, OSError):
+        return False
+    except (ValueError, KeyError, TypeError) as e:
+        LOG.warning('Ignoring the corrupted auth cache %s: %s' % (path, e))
+        auth.set_auth_state(None)
+        return False
+    if auth.auth_ref.will_expire_soon(MIN_TOKEN_LIFE):
+        auth.set_auth_state(None)
+        return False
+    return True
+
+
+def _save_auth_state(auth, cache_id):
+    """Write the auth state to the cache, only readable by its owner."""
+    path = _cache_path(cache_id)
+    if not path:
+        return
+    cache_dir = os.path.dirname(path)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        # mkstemp creates the file with mode 0600.
+        with os.fdopen(fd, 'w') as cache_file:
+            cache_file.write(auth.get_auth_state())
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        LOG.warning('Unable to write the auth cache %s: %s' % (path, e))
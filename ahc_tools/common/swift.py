@@ -13,11 +13,12 @@
 
 # Mostly copied from ironic/common/swift.py
 
+import zlib
+
 from oslo_config import cfg
-from swiftclient import client as swift_client
-from swiftclient import exceptions as swift_exceptions
 
 from ahc_tools import exc
+from ahc_tools import stats
 
 CONF = cfg.CONF
 
@@ -50,9 +51,57 @@ SWIFT_OPTS = [
     cfg.StrOpt('os_auth_url',
                default='',
                help='Keystone authentication URL'),
+    cfg.IntOpt('max_concurrency',
+               default=16,
+               help='Maximum number of concurrent downloads from Swift. The '
+                    'actual number adapts to the latency and errors of '
+                    'Swift, up to this value.'),
+    cfg.FloatOpt('latency_target',
+                 default=1.0,
+                 help='Number of seconds above which a Swift download is '
+                      'considered slow, reducing the number of concurrent '
+                      'downloads.'),
+    cfg.FloatOpt('idle_timeout',
+                 default=60.0,
+                 help='Number of seconds to wait for Swift to accept a '
+                      'connection or to send more data, before the request '
+                      'is retried or fails. This is not a limit on the '
+                      'duration of a request: a download sending data more '
+                      'often is never interrupted, and one which is retried '
+                      'may take up to (max_retries + 1) times this value '
+                      'plus the delays between the retries. Use '
+                      'request_timeout and run_budget to bound the time '
+                      'spent downloading. Set it to 0 to wait forever.'),
+    cfg.FloatOpt('request_timeout',
+                 default=0.0,
+                 help='Number of seconds a Swift download may take, from '
+                      'its request to the end of the object, retries '
+                      'included, before it fails. It is checked each time '
+                      'a chunk of 64 KiB of the object is received. Set it '
+                      'to 0 for no limit.'),
+    cfg.FloatOpt('run_budget',
+                 default=0.0,
+                 help='Number of seconds after the first download of a run, '
+                      'or of a batch of nodes in watch mode, past which the '
+                      'remaining downloads fail instead of being attempted, '
+                      'and the running ones fail at their next chunk of '
+                      'data. Set it to 0 for no limit.'),
+    cfg.IntOpt('hedge_percentile',
+               default=0,
+               help='Latency percentile of the previous downloads past '
+                    'which a second request for the same object is sent, '
+                    'the first response being used, e.g. 95. Set it to 0 '
+                    'to never send a second request.'),
 ]
 
 
+# Size of the chunks objects are downloaded and decompressed by.
+CHUNK_SIZE = 64 * 1024
+
+# Metadata kept when an object is replaced by its compressed version.
+_KEPT_HEADERS = ('content-type', 'x-delete-at')
+
+
 def list_opts():
     return [
         ('swift', SWIFT_OPTS)
@@ -69,7 +118,10 @@ class SwiftAPI(object):
                  tenant_name=CONF.swift.tenant_name,
                  key=CONF.swift.password,
                  auth_url=CONF.swift.os_auth_url,
-                 auth_version=CONF.swift.os_auth_version):
+                 auth_version=CONF.swift.os_auth_version,
+                 session=None,
+                 idle_timeout=None,
+                 retries=None):
         """Constructor for creating a SwiftAPI object.
 
         :param user: the name of the user for Swift account
@@ -77,30 +129,191 @@ class SwiftAPI(object):
         :param key: the 'password' or key to authenticate with
         :param auth_url: the url for authentication
         :param auth_version: the version of api to use for authentication
+        :param session: a keystoneauth session to get the token and the
+            Swift endpoint from, instead of authenticating with the other
+            parameters
+        :param idle_timeout: the number of seconds to wait for Swift to
+            accept a connection or to send more data, forever if None
+        :param retries: the number of times to retry a request, the
+            [swift] max_retries option if None
         """
+        from swiftclient import client as swift_client
+
+        if retries is None:
+            retries = CONF.swift.max_retries
         os_options = {'endpoint_type': 'internal'}
-        params = {'retries': CONF.swift.max_retries,
-                  'user': user,
-                  'tenant_name': tenant_name,
-                  'key': key,
-                  'authurl': auth_url,
-                  'auth_version': auth_version,
-                  'os_options': os_options}
+        if session is not None:
+            params = {'retries': retries,
+                      'session': session,
+                      'os_options': os_options}
+        else:
+            params = {'retries': retries,
+                      'user': user,
+                      'tenant_name': tenant_name,
+                      'key': key,
+                      'authurl': auth_url,
+                      'auth_version': auth_version,
+                      'os_options': os_options}
+        if idle_timeout:
+            params['timeout'] = idle_timeout
 
         self.connection = swift_client.Connection(**params)
 
-    def get_object(self, object_name, container=CONF.swift.container):
+    def get_object(self, object_name, container=CONF.swift.container,
+                   check=None):
         """Downloads a given object from Swift.
 
+        Objects stored compressed with gzip or zlib, as told by their
+        Content-Encoding or by their first bytes, are decompressed while
+        they are downloaded.
+
         :param object_name: The name of the object in Swift
         :param container: The name of the container for the object.
-        :param headers: the headers for the object to pass to Swift
+        :param check: a function called each time a chunk of the object
+            is received, which may raise exc.SwiftDownloadError to stop
+            the download.
         :returns: Swift object
         :raises: exc.SwiftDownloadFailed, if the Swift operation fails.
         """
+        from swiftclient import exceptions as swift_exceptions
+
         try:
-            _, obj = self.connection.get_object(container, object_name)
+            headers, body = self.connection.get_object(
+                container, object_name, resp_chunk_size=CHUNK_SIZE)
+            return _decode_body(headers, body, check)
         except swift_exceptions.ClientException as e:
-            raise exc.SwiftDownloadError(e.msg, object_name)
+            raise exc.SwiftDownloadError(e.msg, object_name,
+                                         http_status=e.http_status)
+        except _timeout_errors() as e:
+            stats.incr('swift.timeouts')
+            raise exc.SwiftDownloadError('Timed out: %s' % e, object_name)
+        except zlib.error as e:
+            raise exc.SwiftDownloadError('Invalid compressed data: %s' % e,
+                                         object_name)
+
+    def list_objects(self, container=CONF.swift.container, prefix=None):
+        """Return the names of the objects of a container.
+
+        :raises: exc.SwiftDownloadFailed, if the Swift operation fails.
+        """
+        from swiftclient import exceptions as swift_exceptions
+
+        try:
+            _, objects = self.connection.get_container(
+                container, prefix=prefix, full_listing=True)
+        except swift_exceptions.ClientException as e:
+            raise exc.SwiftDownloadError(e.msg, container,
+                                         http_status=e.http_status)
+        return [obj['name'] for obj in objects]
+
+    def compress_object(self, object_name, container=CONF.swift.container):
+        """Replace an object by its gzip compressed version.
+
+        The content type and expiration of the object are kept. Objects
+        already compressed, or which don't get smaller, are left alone.
+
+        :returns: a (stored size, compressed size) tuple, the compressed
+            size being None when the object was left alone.
+        :raises: exc.SwiftDownloadFailed, if the Swift operation fails.
+        """
+        from swiftclient import exceptions as swift_exceptions
+
+        try:
+            headers, body = self.connection.get_object(container,
+                                                       object_name)
+            if _compression(headers, body) is not None:
+                return len(body), None
+            compressed = _gzip(body)
+            if len(compressed) >= len(body):
+                return len(body), None
+            new_headers = dict((name, headers[name])
+                               for name in headers
+                               if name in _KEPT_HEADERS or
+                               name.startswith('x-object-meta-'))
+            new_headers['content-encoding'] = 'gzip'
+            self.connection.put_object(container, object_name, compressed,
+                                       headers=new_headers)
+        except swift_exceptions.ClientException as e:
+            raise exc.SwiftDownloadError(e.msg, object_name,
+                                         http_status=e.http_status)
+        return len(body), len(compressed)
+
+
+def _timeout_errors():
+    """Exceptions raised by swiftclient when a request times out."""
+    import socket
+
+    from requests import exceptions as requests_exceptions
+    # Older requests releases vendor their own copy of urllib3.
+    from requests.packages.urllib3 import exceptions as urllib3_exceptions
+
+    return (socket.timeout, requests_exceptions.Timeout,
+            urllib3_exceptions.TimeoutError)
+
+
+def _compression(headers, head):
+    """Return the zlib wbits to decompress an object with, or None."""
+    encoding = headers.get('content-encoding', '').lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return 16 + zlib.MAX_WBITS
+    if encoding == 'deflate':
+        return zlib.MAX_WBITS
+    head = bytearray(head[:2])
+    if head[:2] == bytearray(b'\x1f\x8b'):
+        return 16 + zlib.MAX_WBITS
+    # A zlib header: deflate method, and a checksum multiple of 31.
+    if (len(head) == 2 and head[0] & 0x0f == 8 and
+            (head[0] << 8 | head[1]) % 31 == 0):
+        return zlib.MAX_WBITS
+    return None
+
+
+def _decode_body(headers, body, check=None):
+    """Join the chunks of an object body, decompressing them if needed.
+
+    check is called after each chunk is received. The body is closed if it
+    raises, so that the rest of the object is not downloaded.
+    """
+    try:
+        return _join_chunks(headers, _checked(body, check))
+    except exc.SwiftDownloadError:
+        close = getattr(body, 'close', None)
+        if close is not None:
+            close()
+        raise
+
+
+def _checked(body, check):
+    for chunk in body:
+        if check is not None:
+            check()
+        yield chunk
+
+
+def _join_chunks(headers, chunks):
+    first = next(chunks, b'')
+    wbits = _compression(headers, first)
+    size = len(first)
+    if wbits is None:
+        data = [first]
+        for chunk in chunks:
+            size += len(chunk)
+            data.append(chunk)
+        data = b''.join(data)
+    else:
+        decompressor = zlib.decompressobj(wbits)
+        data = [decompressor.decompress(first)]
+        for chunk in chunks:
+            size += len(chunk)
+            data.append(decompressor.decompress(chunk))
+        data.append(decompressor.flush())
+        data = b''.join(data)
+        stats.incr('swift.objects_compressed')
+    stats.incr('swift.bytes', size)
+    stats.incr('swift.bytes_decoded', len(data))
+    return data
+
 
-        return obj
+def _gzip(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
@@ -0,0 +1,296 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import threading
+
+from ahc_tools import stats
+
+LOG = logging.getLogger('ahc_tools.concurrency')
+
+# HTTP statuses returned by a backend which is overloaded: Ironic node lock
+# conflicts, rate limiting, expired tokens under load and service unavailable.
+CONGESTION_STATUSES = (409, 429, 498, 503)
+
+# Factor applied to the limit when congestion is detected.
+DECREASE_FACTOR = 0.5
+
+# Number of latencies kept by a LatencyWindow, and needed before it gives
+# percentiles.
+LATENCY_WINDOW = 1000
+LATENCY_MIN_SAMPLES = 20
+
+
+def is_congestion(error):
+    """Whether an exception means the backend is overloaded."""
+    return getattr(error, 'http_status', None) in CONGESTION_STATUSES
+
+
+class AIMDLimiter(object):
+    """Adaptive limit on the number of in-flight calls to a backend.
+
+    The limit grows by one every time a full window of calls succeeds within
+    latency_target seconds (additive increase), and is halved when a call is
+    slower than that or fails with a congestion error (multiplicative
+    decrease). The limit is decreased at most once per window, since the
+    calls already in flight when congestion starts all see it. It always
+    stays between minimum and maximum.
+    """
+
+    def __init__(self, name, maximum, latency_target, minimum=1):
+        self.name = name
+        self.maximum = max(minimum, maximum)
+        self.minimum = minimum
+        self.latency_target = latency_target
+        self.limit = float(max(minimum, self.maximum // 4))
+        self.in_flight = 0
+        self._since_decrease = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, congested=False):
+        with self._cond:
+            self.in_flight -= 1
+            self._since_decrease += 1
+            if congested or latency > self.latency_target:
+                if self._since_decrease >= self.limit:
+                    self.limit = max(self.minimum,
+                                     self.limit * DECREASE_FACTOR)
+                    self._since_decrease = 0
+                    stats.incr(self.name + '.throttled')
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def call(self, func, *args, **kwargs):
+        """Call func once a slot is available and adjust the limit."""
+        self.acquire()
+        start = stats.clock()
+        congested = False
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            congested = is_congestion(e)
+            raise
+        finally:
+            self.release(stats.clock() - start, congested)
+
+
+class FixedLimiter(object):
+    """Limit on the number of in-flight calls which does not adapt."""
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+
+    def call(self, func, *args, **kwargs):
+        # imap never runs more than maximum calls at once.
+        return func(*args, **kwargs)
+
+
+class LatencyWindow(object):
+    """Latencies of the last successful calls to a backend."""
+
+    def __init__(self, size=LATENCY_WINDOW, min_samples=LATENCY_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct):
+        """Return the pct-th percentile, None if there are too few samples."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return None
+        return stats.percentile(samples, pct)
+
+
+def hedged(name, func, delay, cancel=None):
+    """Call func, calling it a second time if it is still running after delay.
+
+    Each call runs in its own thread. The result of the first call to succeed
+    is returned, the other call being left to complete in the background. If
+    the first call fails before delay, or both calls fail, the error of the
+    first call is raised. The cancel event, if given, is set once a result or
+    an error is returned, so that the call left running can stop early.
+    """
+    cond = threading.Condition()
+    outcomes = []
+
+    def attempt(number):
+        try:
+            outcome = (number, func(), None)
+        except BaseException as e:
+            outcome = (number, None, e)
+        with cond:
+            outcomes.append(outcome)
+            cond.notify_all()
+
+    def start(number):
+        thread = threading.Thread(target=attempt, args=(number,))
+        thread.daemon = True
+        thread.start()
+
+    deadline = stats.clock() + delay
+    started = 1
+    start(0)
+    try:
+        with cond:
+            while True:
+                for number, result, error in outcomes:
+                    if error is None:
+                        if number:
+                            stats.incr(name + '.hedge_wins')
+                        return result
+                if len(outcomes) == started:
+                    raise min(outcomes, key=lambda outcome: outcome[0])[2]
+                remaining = deadline - stats.clock()
+                if started == 1 and remaining <= 0:
+                    stats.incr(name + '.hedged')
+                    start(1)
+                    started = 2
+                elif started == 1:
+                    cond.wait(remaining)
+                else:
+                    cond.wait()
+    finally:
+        if cancel is not None:
+            cancel.set()
+
+
+class _InputError(object):
+    """Exception raised by the input iterator of imap."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class _OrderedMap(object):
+    def __init__(self, func, items, limiter, backlog):
+        self.func = func
+        self.items = iter(items)
+        self.limiter = limiter
+        self.backlog = backlog
+        self.cond = threading.Condition()
+        # The input iterator may be slow, e.g. a generator fed by another
+        # stage, so it is not consumed while holding cond.
+        self.items_lock = threading.Lock()
+        self.results = {}
+        self.next_in = 0
+        self.next_out = 0
+        self.exhausted = False
+        self.stopped = False
+
+    def _wait_for_room(self):
+        with self.cond:
+            while (not self.stopped and
+                   self.next_in - self.next_out >= self.backlog):
+                self.cond.wait()
+            return not (self.stopped or self.exhausted)
+
+    def _next_item(self):
+        if not self._wait_for_room():
+            return None
+        with self.items_lock:
+            if self.exhausted:
+                return None
+            try:
+                item = next(self.items)
+            except StopIteration:
+                with self.cond:
+                    self.exhausted = True
+                    self.cond.notify_all()
+                return None
+            except BaseException as e:
+                # Let the consumer see errors from the input iterator.
+                with self.cond:
+                    self.exhausted = True
+                    self.results[self.next_in] = _InputError(e)
+                    self.next_in += 1
+                    self.cond.notify_all()
+                return None
+            with self.cond:
+                if self.stopped:
+                    return None
+                self.next_in += 1
+                return self.next_in - 1, item
+
+    def worker(self):
+        while True:
+            task = self._next_item()
+            if task is None:
+                return
+            index, item = task
+            try:
+                result = (item, self.limiter.call(self.func, item), None)
+            except BaseException as e:
+                result = (item, None, e)
+            with self.cond:
+                self.results[index] = result
+                self.cond.notify_all()
+
+    def __iter__(self):
+        threads = [threading.Thread(target=self.worker)
+                   for _ in range(self.limiter.maximum)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while True:
+                with self.cond:
+                    while (self.next_out not in self.results and
+                           not (self.exhausted and
+                                self.next_out >= self.next_in)):
+                        self.cond.wait()
+                    if self.next_out not in self.results:
+                        return
+                    result = self.results.pop(self.next_out)
+                    self.next_out += 1
+                    self.cond.notify_all()
+                if isinstance(result, _InputError):
+                    raise result.error
+                error = result[2]
+                if error is not None and not isinstance(error, Exception):
+                    raise error
+                yield result
+        finally:
+            with self.cond:
+                self.stopped = True
+                self.cond.notify_all()
+            # Do not leave calls running behind the consumer's back, e.g.
+            # matching nodes after the state file was restored.
+            for thread in threads:
+                thread.join()
+
+
+def imap(func, items, limiter, backlog=None):
+    """Call func on each item concurrently, within the limiter's limit.
+
+    Yields (item, result, error) tuples in the order of items, where error is
+    the exception raised by func, if any. Exceptions which are not instances
+    of Exception, such as SystemExit, are re-raised, as well as any exception
+    raised by the items iterator, so imap calls can be chained into a
+    pipeline of generators. At most backlog items (twice the limiter's
+    maximum by default) are processed ahead of the consumer.
+    """
+    backlog = backlog or 2 * limiter.maximum
+    return iter(_OrderedMap(func, items, limiter, backlog))
@@ -13,6 +13,8 @@
 
 from oslo_config import cfg
 
+from ahc_tools.common import swift
+
 EDEPLOY_OPTS = [
     cfg.StrOpt('lockname',
                default='/var/lock/edeploy.lock',
@@ -27,14 +29,48 @@ EDEPLOY_OPTS = [
 MATCH_OPTS = [
     cfg.BoolOpt('debug',
                 default=False,
-                help='Debug mode enabled/disabled.')
+                help='Debug mode enabled/disabled.'),
+    cfg.StrOpt('metrics_file',
+               help='Write metrics about each ahc-match run to this file, in '
+                    'the Prometheus textfile collector format. In watch '
+                    'mode, they are written after each batch of nodes and '
+                    'only cover that batch.'),
 ]
 
 
 REPORT_OPTS = [
     cfg.BoolOpt('debug',
                 default=False,
-                help='Debug mode enabled/disabled.')
+                help='Debug mode enabled/disabled.'),
+    cfg.StrOpt('metrics_file',
+               help='Write metrics about each ahc-report run to this file, in '
+                    'the Prometheus textfile collector format.'),
+    cfg.ListOpt('sites',
+                default=[],
+                help='Names of the sites to report on. The Ironic and Swift '
+                     'credentials of a site are read from the '
+                     '[ironic_<site>] and [swift_<site>] sections, instead '
+                     'of [ironic] and [swift], and its hosts are identified '
+                     'as <site>/<unique id>.'),
+    cfg.StrOpt('cache_file',
+               help='Keep the intermediate results of the report in this '
+                    'file, keyed by the digest of the facts of each node, '
+                    'so the next report only recomputes the results of the '
+                    'added, removed or changed nodes.'),
+]
+
+
+FACTS_OPTS = [
+    cfg.BoolOpt('debug',
+                default=False,
+                help='Debug mode enabled/disabled.'),
+]
+
+
+WHATIF_OPTS = [
+    cfg.BoolOpt('debug',
+                default=False,
+                help='Debug mode enabled/disabled.'),
 ]
 
 
@@ -53,6 +89,16 @@ IRONIC_OPTS = [
     cfg.StrOpt('os_tenant_name',
                default='',
                help='Tenant name for accessing Ironic API.'),
+    cfg.IntOpt('max_concurrency',
+               default=8,
+               help='Maximum number of concurrent requests to the Ironic '
+                    'API. The actual number adapts to the latency and '
+                    'errors of the API, up to this value.'),
+    cfg.FloatOpt('latency_target',
+                 default=5.0,
+                 help='Number of seconds above which an Ironic request is '
+                      'considered slow, reducing the number of concurrent '
+                      'requests.'),
 ]
 
 
@@ -60,12 +106,28 @@ cfg.CONF.register_opts(IRONIC_OPTS, group='ironic')
 cfg.CONF.register_opts(EDEPLOY_OPTS, group='edeploy')
 cfg.CONF.register_opts(MATCH_OPTS, group='match')
 cfg.CONF.register_opts(REPORT_OPTS, group='report')
+cfg.CONF.register_opts(FACTS_OPTS, group='facts')
+cfg.CONF.register_opts(WHATIF_OPTS, group='whatif')
+
+
+def register_site_opts(site):
+    """Register the [ironic_<site>] and [swift_<site>] sections of a site.
+
+    Returns the names of the two sections.
+    """
+    ironic_group = 'ironic_' + site
+    swift_group = 'swift_' + site
+    cfg.CONF.register_opts(IRONIC_OPTS, group=ironic_group)
+    cfg.CONF.register_opts(swift.SWIFT_OPTS, group=swift_group)
+    return ironic_group, swift_group
 
 
 def list_opts():
     return [
         ('match', MATCH_OPTS),
         ('report', REPORT_OPTS),
+        ('facts', FACTS_OPTS),
+        ('whatif', WHATIF_OPTS),
         ('edeploy', EDEPLOY_OPTS),
         ('ironic', IRONIC_OPTS)
     ]
@@ -45,10 +45,16 @@ class SwiftDownloadError(Exception):
     Attributes:
     o_msg -- original message from the exception that occured
     object_name -- name of the Swift object that failed to download
+    http_status -- HTTP status returned by Swift, if any
     """
 
-    def __init__(self, o_msg, object_name):
+    def __init__(self, o_msg, object_name, http_status=None):
         msg = ('Swift failed to download the object %(object_name)s. '
                '\nERROR: %(error)s' %
                {'object_name': object_name, 'error': o_msg})
         super(SwiftDownloadError, self).__init__(msg)
+        self.http_status = http_status
+
+
+class MissingCredentialsError(Exception):
+    """Credentials needed to authenticate with Keystone are missing."""
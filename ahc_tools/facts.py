@@ -0,0 +1,146 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import sys
+
+from oslo_config import cfg
+
+from ahc_tools import archive
+from ahc_tools import concurrency
+from ahc_tools import conf  # noqa
+from ahc_tools import stats
+from ahc_tools import utils
+
+CONF = cfg.CONF
+
+LOG = logging.getLogger('ahc_tools.facts')
+
+
+def add_command_parsers(subparsers):
+    parser = subparsers.add_parser(
+        'export',
+        help='Download the facts of the nodes into a facts archive.')
+    parser.add_argument('archive', help='Path of the archive to write.')
+    parser.set_defaults(func=export)
+
+    parser = subparsers.add_parser(
+        'show',
+        help='Print the facts of a node from a facts archive.')
+    parser.add_argument('archive', help='Path of the archive to read.')
+    parser.add_argument('uuid', help='UUID of the node.')
+    parser.set_defaults(func=show)
+
+    parser = subparsers.add_parser(
+        'compress',
+        help='Replace the facts objects of the Swift container by their '
+             'gzip compressed version.')
+    parser.add_argument('--prefix', default='extra_hardware-',
+                        help='Prefix of the names of the objects to '
+                             'compress.')
+    parser.set_defaults(func=compress)
+
+
+command_opt = cfg.SubCommandOpt('command',
+                                title='Commands',
+                                handler=add_command_parsers)
+
+
+def export():
+    """Write the facts of the matchable nodes to an archive."""
+    ironic_client = utils.get_ironic_client()
+    nodes = []
+    for node in utils.get_ironic_nodes(ironic_client):
+        if node.extra.get('hardware_swift_object'):
+            nodes.append(node)
+        else:
+            LOG.warning('Node %s has no introspection data, skipping it.' %
+                        node.uuid)
+
+    failed_nodes = []
+    with archive.ArchiveWriter(CONF.command.archive) as writer:
+        for node, facts, error in concurrency.imap(
+                utils.get_facts, nodes, utils.swift_limiter()):
+            if error is not None:
+                LOG.error('Failed to get the facts of node %s: %s' %
+                          (node.uuid, error))
+                failed_nodes.append(node.uuid)
+                continue
+            writer.add(node.uuid, facts)
+    stats.incr('nodes.exported', writer.count)
+    LOG.info('Exported the facts of %d node(s) to %s' %
+             (writer.count, CONF.command.archive))
+    if failed_nodes:
+        sys.exit('Unable to export the facts of the following nodes: %s' %
+                 ', '.join(failed_nodes))
+
+
+def show():
+    """Print the facts of a node as JSON."""
+    try:
+        facts = archive.ArchiveReader(CONF.command.archive).get(
+            CONF.command.uuid)
+    except archive.ArchiveError as e:
+        sys.exit(str(e))
+    json.dump(facts, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+def compress():
+    """Compress the facts objects of the Swift container in place."""
+    container = CONF.swift.container
+    swift_api = utils.get_swift_api()
+    try:
+        names = swift_api.list_objects(container, CONF.command.prefix)
+    finally:
+        utils.release_swift_api(swift_api)
+
+    def compress_object(name):
+        swift_api = utils.get_swift_api()
+        try:
+            return swift_api.compress_object(name, container)
+        finally:
+            utils.release_swift_api(swift_api)
+
+    failed_objects = []
+    before = after = compressed = 0
+    for name, sizes, error in concurrency.imap(
+            compress_object, names, utils.swift_limiter()):
+        if error is not None:
+            LOG.error('Failed to compress object %s: %s' % (name, error))
+            failed_objects.append(name)
+            continue
+        size, new_size = sizes
+        before += size
+        if new_size is None:
+            after += size
+        else:
+            after += new_size
+            compressed += 1
+    stats.incr('objects.compressed', compressed)
+    LOG.info('Compressed %d of %d object(s) in container %s, from %d to %d '
+             'bytes' % (compressed, len(names), container, before, after))
+    if failed_objects:
+        sys.exit('Unable to compress the following objects: %s' %
+                 ', '.join(failed_objects))
+
+
+def main(args=sys.argv[1:]):
+    CONF.register_cli_opt(command_opt)
+    CONF.register_cli_opts(stats.stats_cli_opts)
+    CONF(args=args, default_config_files=utils.DEFAULT_CONF_FILES)
+    utils.setup_logging(CONF.facts.debug)
+
+    with stats.run(CONF.profile_out, prefix='ahc_facts'):
+        CONF.command.func()
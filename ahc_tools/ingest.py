@@ -0,0 +1,78 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+try:
+    _STRING_TYPES = (str, unicode)  # noqa
+except NameError:
+    _STRING_TYPES = (str,)
+
+
+def parse_value(value):
+    """Convert a fact value to an int or a float.
+
+    A value is converted exactly when the numeric helpers of the .specs
+    files (gt, ge, lt, le) accept it. Values which are not numbers are
+    returned unchanged.
+    """
+    if not isinstance(value, _STRING_TYPES):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def is_number(value):
+    """Whether a typed value is a number, not a string."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class Facts(list):
+    """Facts of a node, as a list of (category, item, key, value) tuples.
+
+    The list holds the raw values, as expected by the hardware matcher and
+    cardiff. The typed values of a key are parsed the first time they are
+    requested and kept with the facts, which must not be modified
+    afterwards.
+    """
+
+    _index = None
+
+    def values(self, category, item, key):
+        """Return the typed values of the facts with the given keys."""
+        if self._index is None:
+            # The raw values of each key, replaced by their typed values
+            # once they are requested.
+            index = {}
+            for fact in self:
+                index.setdefault(tuple(fact[:3]), [[], False])[0].append(
+                    fact[3])
+            self._index = index
+        entry = self._index.get((category, item, key))
+        if entry is None:
+            return []
+        if not entry[1]:
+            entry[0] = [parse_value(value) for value in entry[0]]
+            entry[1] = True
+        return entry[0]
+
+
+def decode(blob):
+    """Decode the JSON facts stored in Swift."""
+    return Facts(tuple(fact) for fact in json.loads(blob))
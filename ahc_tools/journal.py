@@ -0,0 +1,106 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import threading
+
+LOG = logging.getLogger('ahc_tools.journal')
+
+MATCHED = 'matched'
+FAILED = 'failed'
+PATCHED = 'patched'
+
+
+class Journal(object):
+    """Append-only log of the per-node outcomes of an ahc-match run.
+
+    Each line is a JSON record with the node uuid and an event: 'matched'
+    (with the facts digest, the profile and the patches computed from the
+    match, including the CMDB allocation), 'failed' or 'patched'. Records
+    are synced to disk as they are written, so an interrupted run can be
+    resumed from the journal.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the record of each node, keyed by uuid.
+
+        The fields of the later records of a node override those of the
+        earlier ones, so a patched node keeps the profile and the patches it
+        was matched with.
+        """
+        records = {}
+        try:
+            with open(self.path) as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The last line may be truncated if we died while
+                        # writing it.
+                        LOG.warning('Ignoring corrupted journal record in '
+                                    '%s: %s' % (self.path, line.strip()))
+                        continue
+                    records.setdefault(record['uuid'], {}).update(record)
+        except IOError:
+            pass
+        return records
+
+    def open(self, resume=False):
+        """Open the journal, truncating it unless resuming."""
+        if resume:
+            self._drop_partial_record()
+        self._file = open(self.path, 'a' if resume else 'w')
+
+    def _drop_partial_record(self):
+        """Remove the last line if we died while writing it.
+
+        Otherwise the first new record would be appended to it, and both
+        would be ignored by load.
+        """
+        try:
+            with open(self.path, 'rb+') as journal:
+                data = journal.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    LOG.warning('Removing the truncated last record of %s' %
+                                self.path)
+                    journal.truncate(end)
+        except IOError:
+            pass
+
+    def record(self, uuid, event, **data):
+        data.update(uuid=uuid, event=event)
+        line = json.dumps(data, sort_keys=True) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
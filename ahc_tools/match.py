@@ -11,15 +11,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import logging
+import operator
+import os
+import re
 import shutil
 import sys
+import time
 
-from hardware import state
 from oslo_config import cfg
 
+from ahc_tools import concurrency
 from ahc_tools import conf  # noqa
 from ahc_tools import exc
+from ahc_tools import ingest
+from ahc_tools import journal
+from ahc_tools import projection
+from ahc_tools import stats
 from ahc_tools import utils
 
 
@@ -27,20 +36,242 @@ CONF = cfg.CONF
 
 LOG = logging.getLogger('ahc_tools.match')
 
+profile_opt = cfg.MultiStrOpt('profile',
+                              dest='profiles',
+                              default=[],
+                              help='Only consider this profile when '
+                                   'matching. May be repeated.')
 
-def match(node, node_info):
+match_cli_opts = [
+    cfg.BoolOpt('watch',
+                default=False,
+                help='Keep running and match nodes as their introspection '
+                     'finishes.'),
+    cfg.IntOpt('watch-interval',
+               dest='watch_interval',
+               default=10,
+               help='Seconds between two polls of Ironic in watch mode.'),
+    cfg.BoolOpt('resume',
+                default=False,
+                help='Resume an interrupted run from its journal, skipping '
+                     'the nodes which were already matched or updated.'),
+    cfg.MultiStrOpt('node',
+                    dest='nodes',
+                    default=[],
+                    help='UUID of a node to match, instead of all the '
+                         'matchable nodes. May be repeated.'),
+    cfg.StrOpt('nodes-file',
+               dest='nodes_file',
+               help='File with the UUIDs of the nodes to match, one per '
+                    'line.'),
+    cfg.BoolOpt('unprofiled',
+                default=False,
+                help='Only match the nodes without a profile capability.'),
+    profile_opt,
+]
+
+# Profiles keyed by the name of their .specs file, with the (mtime, size)
+# of the file they were read from.
+_SPECS_CACHE = {}
+
+# Maximum number of projections whose match is remembered per profile.
+_MATCH_MEMO_SIZE = 4096
+
+# Values of a .specs line using a numeric helper, e.g. 'gt(8)' or
+# '$ncpus=ge(4)'.
+_NUMERIC_SPEC_RE = re.compile(r'^(?:\$[^=]+=)?'       # optional variable
+                              r'(gt|ge|lt|le)\('      # helper name
+                              r'\s*([^,]+?)\s*\)$')  # single argument
+_COMPARATORS = {'gt': operator.gt, 'ge': operator.ge,
+                'lt': operator.lt, 'le': operator.le}
+
+
+def _numeric_requirements(specs):
+    """Return the numeric constraints of the .specs lines.
+
+    Only the lines with a literal category, item and key are used, as
+    ((category, item, key), comparator, bound) tuples.
+    """
+    requirements = []
+    for spec in specs:
+        if len(spec) != 4 or any(field.startswith('$') or
+                                 field.endswith(')') for field in spec[:3]):
+            continue
+        match = _NUMERIC_SPEC_RE.match(spec[3])
+        if not match:
+            continue
+        try:
+            bound = float(match.group(2).strip('\'"'))
+        except ValueError:
+            continue
+        requirements.append((tuple(spec[:3]),
+                             _COMPARATORS[match.group(1)], bound))
+    return requirements
+
+
+def _can_match(facts, requirements):
+    """Whether the typed facts may meet the numeric requirements.
+
+    A requirement is only checked when all the candidate values are
+    numbers, otherwise the matcher decides.
+    """
+    for keys, compare, bound in requirements:
+        values = facts.values(*keys)
+        if not all(ingest.is_number(value) for value in values):
+            continue
+        if not any(compare(float(value), bound) for value in values):
+            return False
+    return True
+
+
+class _Profile(object):
+    """The parsed .specs of a profile and what is derived from them."""
+
+    def __init__(self, specs):
+        self.specs = specs
+        self.requirements = _numeric_requirements(specs)
+        self.projector = projection.Projector(specs)
+        self._memo = {}
+
+    def match(self, facts):
+        """Match the facts against the specs, as matcher.match_all does.
+
+        The outcome is memoized by the projection of the facts, so nodes of
+        the same hardware type only run the matcher once.
+
+        Returns whether the facts match, and the two dictionaries of
+        variables filled by match_all.
+        """
+        from hardware import matcher
+
+        projected, values = self.projector.project(facts)
+        try:
+            matched, var, var2 = self._memo[projected]
+            stats.incr('match_memo.hits')
+        except KeyError:
+            stats.incr('match_memo.misses')
+            var = {}
+            var2 = {}
+            matched = matcher.match_all(projected, self.specs, var, var2)
+            if len(self._memo) >= _MATCH_MEMO_SIZE:
+                self._memo.clear()
+            self._memo[projected] = (matched, var, var2)
+        return (matched, projection.unmask(var, values),
+                projection.unmask(var2, values))
+
+
+def _load_profile(sobj, name):
+    """Load the profile, reusing the parsed .specs file if unchanged."""
+    from hardware import state
+
+    fname = os.path.join(sobj._cfg_dir or '', name + '.specs')
+    try:
+        stat = os.stat(fname)
+    except OSError:
+        return _Profile(state.State._load_specs(sobj, name))
+    version = (stat.st_mtime, stat.st_size)
+    cached = _SPECS_CACHE.get(fname)
+    if cached and cached[0] == version:
+        stats.incr('specs.hits')
+        return cached[1]
+    stats.incr('specs.misses')
+    profile = _Profile(state.State._load_specs(sobj, name))
+    _SPECS_CACHE[fname] = (version, profile)
+    return profile
+
+
+def _find_match(sobj, facts, profiles=None):
+    """Find the profile matching the facts, as State.find_match does.
+
+    Only the profiles in profiles are considered, if given. Profiles with
+    numeric requirements the typed facts cannot meet are skipped without
+    running the matcher.
+    """
+    from hardware import cmdb
+    from hardware import state
+
+    valid_roles = []
+    for idx, (name, times) in enumerate(sobj._data):
+        if profiles is not None and name not in profiles:
+            continue
+        if times != '*' and int(times) <= 0:
+            continue
+        valid_roles.append(name)
+        profile = _load_profile(sobj, name)
+        if not _can_match(facts, profile.requirements):
+            stats.incr('match.skipped_profiles')
+            continue
+        matched, var, var2 = profile.match(facts)
+        if not matched:
+            continue
+        LOG.debug('Specs %s matches' % name)
+        forced = (var2 != {})
+        if not forced:
+            var2 = var
+        if times != '*':
+            sobj._data[idx] = (name, int(times) - 1)
+        db = cmdb.load_cmdb(sobj._cfg_dir, name)
+        if db:
+            if cmdb.update_cmdb(db, var, var2, forced):
+                cmdb.save_cmdb(sobj._cfg_dir, name, db)
+            else:
+                continue
+        return name, var
+
+    if not valid_roles:
+        raise state.StateError('No more role available in %s' %
+                               sobj._state_filename)
+    raise state.StateError(
+        'Unable to match requirements on the following available roles '
+        'in %s: %s' % (sobj._cfg_dir, ', '.join(valid_roles)))
+
+
+def matching_profiles(sobj, facts, names):
+    """Return the names, among names, of the profiles matching the facts.
+
+    Unlike _find_match, every profile is tried whatever its count, and
+    neither the state nor the CMDB is modified.
+    """
+    if not isinstance(facts, ingest.Facts):
+        facts = ingest.Facts(facts)
+    matching = []
+    for name in names:
+        profile = _load_profile(sobj, name)
+        if not _can_match(facts, profile.requirements):
+            stats.incr('match.skipped_profiles')
+            continue
+        if profile.match(facts)[0]:
+            matching.append(name)
+    return matching
+
+
+def _new_state():
+    """Return a State object locked with the configured lock file."""
+    # hardware is slow to import, only do it when matching.
+    from hardware import state
+
+    return state.State(lockname=CONF.edeploy.lockname)
+
+
+def match(node, node_info, facts=None, profiles=None):
     sobj = None
     try:
-        sobj = state.State(lockname=CONF.edeploy.lockname)
-        sobj.load(CONF.edeploy.configdir)
+        sobj = _new_state()
+        with stats.timer('state.load'):
+            sobj.load(CONF.edeploy.configdir)
     except Exception as e:
         if sobj:
             sobj.unlock()
         raise exc.LoadFailedError(e.__str__(), CONF.edeploy.configdir)
 
     try:
-        facts = utils.get_facts(node)
-        profile, data = sobj.find_match(facts)
+        if facts is None:
+            facts = utils.get_facts(node)
+        if not isinstance(facts, ingest.Facts):
+            facts = ingest.Facts(facts)
+        node_info['facts_digest'] = utils.facts_digest(facts)
+        with stats.timer('match.find_match'):
+            profile, data = _find_match(sobj, facts, profiles)
         data['profile'] = profile
 
         if 'logical_disks' in data:
@@ -54,7 +285,8 @@ def match(node, node_info):
     except Exception as e:
         raise exc.MatchFailedError(e.__str__(), node.uuid)
     finally:
-        sobj.save()
+        with stats.timer('state.save'):
+            sobj.save()
         sobj.unlock()
 
 
@@ -92,51 +324,398 @@ def get_update_patches(node, node_info):
 
 
 def main(args=sys.argv[1:]):
+    CONF.register_cli_opts(match_cli_opts)
+    CONF.register_cli_opts(stats.stats_cli_opts)
     CONF(args=args, default_config_files=utils.DEFAULT_CONF_FILES)
     debug = CONF.match.debug
     utils.setup_logging(debug)
 
-    ironic_client = utils.get_ironic_client()
-    nodes = utils.get_ironic_nodes(ironic_client)
-    patches = {}
+    # In watch mode the metrics are written after each batch of nodes.
+    metrics_file = None if CONF.watch else CONF.match.metrics_file
+    with stats.run(CONF.profile_out, metrics_file, 'ahc_match'):
+        _check_profiles()
+        ironic_client = utils.get_ironic_client()
+        if CONF.watch:
+            try:
+                _watch(ironic_client)
+            except KeyboardInterrupt:
+                LOG.info('Interrupted, exiting.')
+        else:
+            nodes, held = _selected_nodes(ironic_client)
+            _match_and_update(ironic_client, nodes, resume=CONF.resume,
+                              profiles=CONF.profiles or None, held=held)
+
+
+def _check_profiles():
+    """Exit if a profile given with --profile has no .specs file."""
+    missing = [name for name in CONF.profiles
+               if not os.path.exists(os.path.join(CONF.edeploy.configdir,
+                                                  name + '.specs'))]
+    if missing:
+        sys.exit('The following profiles have no .specs file in %s: %s' %
+                 (CONF.edeploy.configdir, ', '.join(missing)))
+
+
+def _selected_uuids():
+    """Return the UUIDs given with --node and --nodes-file, in order."""
+    uuids = list(CONF.nodes)
+    if CONF.nodes_file:
+        try:
+            with open(CONF.nodes_file) as nodes_file:
+                for line in nodes_file:
+                    line = line.split('#', 1)[0].strip()
+                    if line:
+                        uuids.append(line)
+        except IOError as e:
+            sys.exit('Unable to read the nodes file %s: %s' %
+                     (CONF.nodes_file, e))
+    seen = set()
+    return [uuid for uuid in uuids
+            if not (uuid in seen or seen.add(uuid))]
+
+
+def _selected_nodes(ironic_client):
+    """Return the matchable nodes picked by the selectors.
+
+    Without selectors, all the matchable nodes are matched. Otherwise the
+    profiles held by the matchable nodes which are not picked are returned
+    too, so that they are not given again.
+
+    Returns the nodes and the list of the profiles held by the others.
+    """
+    uuids = _selected_uuids()
+    if not uuids and not CONF.unprofiled:
+        return utils.iter_ironic_nodes(ironic_client), []
+    listed = list(utils.iter_ironic_nodes(ironic_client))
+    if uuids:
+        by_uuid = dict((node.uuid, node) for node in listed)
+        # Nodes which are not listed are unknown or not matchable, or
+        # became matchable since.
+        by_uuid.update((node.uuid, node) for node in _get_nodes(
+            ironic_client, [uuid for uuid in uuids if uuid not in by_uuid]))
+        nodes = [by_uuid[uuid] for uuid in uuids if uuid in by_uuid]
+    else:
+        nodes = listed
+    if CONF.unprofiled:
+        nodes = [node for node in nodes if not _has_profile(node)]
+    return nodes, _held_profiles(listed, nodes)
+
+
+def _get_nodes(ironic_client, uuids):
+    """Get the matchable nodes with the given UUIDs from Ironic."""
+    def get(uuid):
+        with stats.timer('ironic.get'):
+            return ironic_client.node.get(uuid)
+
+    nodes = []
+    missing = []
+    for uuid, node, error in concurrency.imap(get, uuids,
+                                              utils.ironic_limiter()):
+        if error is not None:
+            LOG.error('Failed to get node %s: %s' % (uuid, error))
+            missing.append(uuid)
+        elif node.provision_state not in utils.MATCHABLE_STATES:
+            LOG.warning('Node %s is in state %s, skipping it.' %
+                        (uuid, node.provision_state))
+        else:
+            nodes.append(node)
+    if missing:
+        sys.exit('Unable to get the following nodes: %s' %
+                 ', '.join(missing))
+    stats.incr('nodes.listed', len(nodes))
+    return nodes
+
+
+def _has_profile(node):
+    return bool(_node_profile(node))
+
+
+def _node_profile(node):
+    """Return the profile of the node from its capabilities, or None."""
+    capabilities = utils.capabilities_to_dict(
+        node.properties.get('capabilities'))
+    return capabilities.get('profile') or None
+
+
+def _held_profiles(nodes, batch):
+    """Return the profiles of the nodes which are not in the batch."""
+    uuids = set(node.uuid for node in batch)
+    return [_node_profile(node) for node in nodes
+            if node.uuid not in uuids and _node_profile(node)]
+
+
+def _watch(ironic_client):
+    """Match nodes as they become matchable, until interrupted.
+
+    Ironic is polled every watch_interval seconds. A node is matched when it
+    enters one of the MATCHABLE_STATES with introspection data, or when its
+    hardware_swift_object changes. Nodes that failed to match are retried
+    when a .specs file changes, nodes that failed to be updated at the next
+    poll. Only the nodes picked by the selectors are watched. The profiles
+    of the matchable nodes outside a batch are taken from the state before
+    matching it.
+
+    The statistics are reset at every poll, so the metrics written after a
+    batch of nodes only cover that poll and batch.
+    """
+    uuids = set(_selected_uuids())
+    # uuid -> (hardware_swift_object, .specs version if it failed or None)
+    seen = {}
+    while True:
+        stats.REGISTRY.reset()
+        start = stats.clock()
+        nodes = utils.get_ironic_nodes(ironic_client)
+        specs_version = _specs_version()
+        listed = set()
+        pending = []
+        for node in nodes:
+            object_name = node.extra.get('hardware_swift_object')
+            if (not object_name or (uuids and node.uuid not in uuids) or
+                    (CONF.unprofiled and _has_profile(node))):
+                continue
+            listed.add(node.uuid)
+            previous = seen.get(node.uuid)
+            if (previous is None or previous[0] != object_name or
+                    previous[1] not in (None, specs_version)):
+                pending.append(node)
 
+        # Forget nodes which left the matchable states, so they are matched
+        # again if they come back.
+        for uuid in set(seen) - listed:
+            del seen[uuid]
+
+        if pending:
+            LOG.info('Matching %d node(s)' % len(pending))
+            failed, not_updated = _match_and_update(
+                ironic_client, pending, profiles=CONF.profiles or None,
+                held=_held_profiles(nodes, pending))
+            for node in pending:
+                if node.uuid in not_updated:
+                    # Retried at the next poll.
+                    seen.pop(node.uuid, None)
+                    continue
+                seen[node.uuid] = (
+                    node.extra['hardware_swift_object'],
+                    specs_version if node.uuid in failed else None)
+            stats.observe('total', stats.clock() - start)
+            for line in stats.REGISTRY.summary():
+                LOG.info(line)
+            if CONF.match.metrics_file:
+                stats.write_textfile(CONF.match.metrics_file, stats.REGISTRY,
+                                     'ahc_match')
+
+        time.sleep(CONF.watch_interval)
+
+
+def _specs_version():
+    """Return the modification times of the .specs files."""
+    configdir = CONF.edeploy.configdir
     try:
-        _copy_state()
+        return tuple(sorted(
+            (name, os.path.getmtime(os.path.join(configdir, name)))
+            for name in os.listdir(configdir) if name.endswith('.specs')))
+    except OSError:
+        return ()
+
+
+def _match_and_update(ironic_client, nodes, resume=False, profiles=None,
+                      held=()):
+    """Match the nodes and update them in Ironic.
+
+    The nodes flow through a pipeline whose stages overlap: their facts are
+    downloaded concurrently, they are matched one at a time as their facts
+    arrive since they share the state file, and their patches are applied
+    concurrently as soon as they are matched. Bounded queues between the
+    stages keep only a window of nodes in memory. The state file is restored
+    once the run is over, whether it succeeded or not.
+
+    Every outcome is written to the journal. When resuming, nodes the
+    journal records as updated or failed are skipped, and matched nodes are
+    updated from their journaled patches instead of being matched again.
+    The profiles given to the journaled nodes are taken from the state
+    before matching the others, as the interrupted run gave them back when
+    restoring it. So are the profiles in held, those of the nodes left out
+    of this run.
+    Only the profiles in profiles are considered, if given.
+
+    Returns the sets of uuids of the nodes which failed to match and of the
+    nodes which failed to be updated.
+    """
+    # Every batch of nodes matched in watch mode gets its own budget.
+    utils.reset_swift_budget()
+    run_journal = journal.Journal(_journal_path())
+    done = run_journal.load() if resume else {}
+    if done:
+        LOG.info('Resuming from %s: %d node(s) already processed' %
+                 (run_journal.path, len(done)))
+
+    # The state.bak left by the interrupted run is the state from before it
+    # started, keep it and take the profiles of the journaled nodes from it.
+    held = list(held)
+    if done:
+        held.extend(_journaled_profiles(done))
+    try:
+        if done:
+            _restore_state()
+        else:
+            _copy_state()
     except Exception as e:
         err_msg = ('Failed to copy the state file: %s/state. '
-                   'Error was: %s' % (CONF.edeploy.configdir, e.__str__()))
+                   'Error was: %s' % (CONF.edeploy.configdir,
+                                      e.__str__()))
         LOG.error(err_msg)
         sys.exit()
+    try:
+        _consume_profiles(held)
+    except Exception as e:
+        err_msg = ('Failed to update the state file: %s/state. '
+                   'Error was: %s' % (CONF.edeploy.configdir,
+                                      e.__str__()))
+        LOG.error(err_msg)
+        _restore_state()
+        sys.exit()
+    run_journal.open(resume=bool(done))
+
+    def fetch(node):
+        if node.uuid in done:
+            return None
+        return utils.get_facts(node)
 
     failed_nodes = []
-    for node in nodes:
+    fetched = concurrency.imap(fetch, nodes, utils.swift_limiter())
+    planned = _plan(fetched, done, run_journal, failed_nodes, profiles)
+    try:
+        not_updated = _apply(ironic_client, planned, run_journal)
+    finally:
+        planned.close()
+        fetched.close()
+        _restore_state()
+
+    if failed_nodes:
+        err_msg = ('The following nodes did not match any profiles '
+                   'and will not be updated: ' + ','.join(failed_nodes))
+        LOG.error(err_msg)
+
+    if not not_updated:
+        run_journal.remove()
+    else:
+        run_journal.close()
+        LOG.error('Run ahc-match with --resume to retry the failed updates.')
+
+    return set(failed_nodes), set(not_updated)
+
+
+def _plan(fetched, done, run_journal, failed_nodes, profiles=None):
+    """Match the nodes as their facts arrive and yield their patches.
+
+    Yields (node, patches) tuples, including the journaled patches of the
+    nodes matched by a resumed run. The uuids of the nodes which failed to
+    match are added to failed_nodes.
+    """
+    for node, facts, error in fetched:
+        record = done.get(node.uuid)
+        if record:
+            stats.incr('nodes.resumed')
+            if record['event'] == journal.MATCHED:
+                yield node, record['patches']
+            elif record['event'] == journal.FAILED:
+                failed_nodes.append(node.uuid)
+            continue
         try:
+            if error is not None:
+                raise exc.MatchFailedError(str(error), node.uuid)
             node_info = {}
             LOG.debug('Attempting to match node %s' % node.uuid)
-            match(node, node_info)
-            patches[node.uuid] = get_update_patches(node, node_info)
+            match(node, node_info, facts, profiles)
+            patches = get_update_patches(node, node_info)
+            run_journal.record(node.uuid, journal.MATCHED,
+                               digest=node_info.get('facts_digest'),
+                               profile=node_info.get('hardware', {}).get(
+                                   'profile'),
+                               patches=patches)
+            stats.incr('nodes.matched')
         except exc.LoadFailedError as e:
-            LOG.error(e.message)
+            LOG.error(str(e))
             sys.exit()
         except exc.MatchFailedError as e:
-            LOG.error(e.message)
-            failed_nodes.append(node)
+            LOG.error(str(e))
+            failed_nodes.append(node.uuid)
+            run_journal.record(node.uuid, journal.FAILED)
+            stats.incr('nodes.failed')
+            continue
+        yield node, patches
 
-    if failed_nodes:
-        err_msg = ('The following nodes did not match any profiles '
-                   'and will not be updated: ' +
-                   ','.join(node.uuid for node in failed_nodes))
-        LOG.error(err_msg)
-    _restore_state()
 
-    for node in nodes:
-        if node not in failed_nodes:
-            try:
-                ironic_client.node.update(node.uuid, patches[node.uuid])
-            except Exception as e:
+def _apply(ironic_client, planned, run_journal):
+    """Apply the planned patches, returns the uuids of the failed nodes."""
+    def update(task):
+        node, patches = task
+        if _patches_applied(node, patches):
+            # A resumed run may have died between the PATCH and its
+            # journal record.
+            LOG.debug('Node %s is already up to date' % node.uuid)
+            return
+        with stats.timer('ironic.update'):
+            ironic_client.node.update(node.uuid, patches)
+        stats.incr('nodes.patched')
+
+    failed = []
+    start = stats.clock()
+    results = concurrency.imap(update, planned, utils.ironic_limiter())
+    try:
+        for (node, _), _, error in results:
+            if error is not None:
                 err_msg = ('Failed to update node (%s). '
-                           'Error was: %s' % (node.uuid, e.__str__()))
+                           'Error was: %s' % (node.uuid, error.__str__()))
                 LOG.error(err_msg)
+                failed.append(node.uuid)
+                continue
+            if start is not None:
+                stats.observe('match.first_update', stats.clock() - start)
+                start = None
+            run_journal.record(node.uuid, journal.PATCHED)
+    finally:
+        # Stop the updates before the caller tears down the earlier stages.
+        results.close()
+    return failed
+
+
+def _patches_applied(node, patches):
+    """Whether the node already has the values set by the patches."""
+    if not patches:
+        return False
+    for patch in patches:
+        _, field, key = patch['path'].split('/', 2)
+        if getattr(node, field, {}).get(key) != patch['value']:
+            return False
+    return True
+
+
+def _journaled_profiles(done):
+    """Return the profiles given to the journaled nodes."""
+    return [record['profile'] for record in done.values()
+            if record['event'] in (journal.MATCHED, journal.PATCHED) and
+            record.get('profile')]
+
+
+def _consume_profiles(profiles):
+    """Decrement the state counts once per profile name in profiles."""
+    used = collections.Counter(profiles)
+    if not used:
+        return
+    sobj = _new_state()
+    sobj.load(CONF.edeploy.configdir)
+    try:
+        for idx, (name, times) in enumerate(sobj._data):
+            if times != '*' and name in used:
+                sobj._data[idx] = (name, int(times) - used[name])
+        sobj.save()
+    finally:
+        sobj.unlock()
+
+
+def _journal_path():
+    return CONF.edeploy.configdir + '/match.journal'
 
 
 def _copy_state():
@@ -0,0 +1,129 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Prefix of the values standing for masked fact values. It can't appear in
+# the introspection data or in a .specs file.
+PLACEHOLDER = '\0'
+
+
+def _is_pattern(field):
+    """Whether a .specs field may match values other than itself."""
+    return field.startswith('$') or field.endswith(')')
+
+
+def _is_variable(field):
+    """Whether a .specs field is a plain variable, such as '$mac'.
+
+    The matcher only compares the values bound to a plain variable with
+    each other, never with a literal or through a helper function.
+    """
+    return (field.startswith('$') and len(field.split('=')) != 2 and
+            not field.endswith(')'))
+
+
+class Projector(object):
+    """Projection of facts onto the fields the specs of a profile look at.
+
+    The projection only keeps the facts which some spec line may match.
+    Values which are only ever bound to plain variables are masked, so
+    nodes of the same hardware type share their projection even though
+    their MACs, IPs and serial numbers differ. Masking is canonical: equal
+    values get the same placeholder, and a value is not masked when it also
+    appears in a field which is compared with a literal. The matcher
+    therefore gives the same result on the projection as on the facts, with
+    placeholders bound instead of the masked values.
+    """
+
+    def __init__(self, specs):
+        specs = [spec for spec in specs if len(spec) == 4]
+        self._by_category = {}
+        self._any_category = []
+        for spec in specs:
+            if _is_pattern(spec[0]):
+                self._any_category.append(spec)
+            else:
+                self._by_category.setdefault(spec[0], []).append(spec)
+        self._mask_category = all(_is_variable(spec[0]) for spec in specs)
+        self._keys = {}
+
+    def _analyze(self, key):
+        """Return how the specs see the facts with a (category, item, key).
+
+        Returns which fields may be masked, and the values for which some
+        spec may match the fact: None for any value, or a set.
+
+        A field may be masked when all the specs evaluating it have a plain
+        variable there. A spec evaluates a field when it has a pattern or the
+        fact's value in all the fields before it.
+        """
+        specs = self._by_category.get(key[0], []) + self._any_category
+        maskable = [self._mask_category, True, True, True]
+        accepted = set()
+        for spec in specs:
+            for idx in range(1, 3):
+                if not _is_variable(spec[idx]):
+                    maskable[idx] = False
+                if not (_is_pattern(spec[idx]) or spec[idx] == key[idx]):
+                    break
+            else:
+                if not _is_variable(spec[3]):
+                    maskable[3] = False
+                if accepted is not None:
+                    if _is_pattern(spec[3]):
+                        accepted = None
+                    else:
+                        accepted.add(spec[3])
+        return maskable, accepted
+
+    def project(self, facts):
+        """Project the facts.
+
+        Returns the projected facts, as a tuple usable as a dictionary key,
+        and the mapping of placeholders to the values they mask.
+        """
+        kept = []
+        unmasked = set()
+        for line in facts:
+            key = (line[0], line[1], line[2])
+            try:
+                maskable, accepted = self._keys[key]
+            except KeyError:
+                maskable, accepted = self._keys[key] = self._analyze(key)
+            if accepted is not None and line[3] not in accepted:
+                continue
+            # A value which looks like a variable may be matched as is.
+            maskable = [mask and not str(value).startswith('$')
+                        for mask, value in zip(maskable, line)]
+            kept.append((line, maskable))
+            unmasked.update(value for value, mask in zip(line, maskable)
+                            if not mask)
+
+        placeholders = {}
+        projected = []
+        for line, maskable in kept:
+            fields = []
+            for value, mask in zip(line, maskable):
+                if mask and value not in unmasked:
+                    value = placeholders.setdefault(
+                        value, '%s%d' % (PLACEHOLDER, len(placeholders)))
+                fields.append(value)
+            projected.append(tuple(fields))
+        values = dict((placeholder, value)
+                      for value, placeholder in placeholders.items())
+        return tuple(projected), values
+
+
+def unmask(variables, values):
+    """Replace the placeholders bound to variables by their values."""
+    return dict((name, values.get(value, value))
+                for name, value in variables.items())
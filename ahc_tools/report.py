@@ -11,21 +11,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import logging
 import sys
 
-from hardware.cardiff import cardiff
-from hardware.cardiff import compare_sets
-from hardware.cardiff import utils as cardiff_utils
 from oslo_config import cfg
 
-from ahc_tools import conf  # noqa
+from ahc_tools import archive
+from ahc_tools import concurrency
+from ahc_tools import conf
+from ahc_tools import ingest
+from ahc_tools import report_cache
+from ahc_tools import stats
 from ahc_tools import utils
 
 CONF = cfg.CONF
 
 LOG = logging.getLogger('ahc_tools.report')
 
+facts_archive_opt = cfg.StrOpt('facts-archive',
+                               dest='facts_archive',
+                               help='Read the facts from this archive, '
+                                    'written by "ahc-facts export", instead '
+                                    'of Ironic and Swift.')
+
 report_cli_opts = [
     cfg.BoolOpt('full',
                 short='f',
@@ -47,11 +56,28 @@ report_cli_opts = [
                dest='unique_id',
                default='uuid',
                choices=['uuid', 'serial'],
-               help='Unique key to identify the nodes by.')
+               help='Unique key to identify the nodes by.'),
+    facts_archive_opt,
 ]
 
 
 def print_report(facts):
+    if CONF.report.cache_file:
+        cache = report_cache.ReportCache(CONF.report.cache_file,
+                                         CONF.unique_id)
+        cache.load()
+        report_cache.print_report(facts, cache,
+                                  groups=CONF.groups or CONF.full,
+                                  categories=CONF.categories or CONF.full,
+                                  outliers=CONF.outliers or CONF.full)
+        cache.save()
+        return
+
+    # cardiff pulls numpy and pandas in, only import it when it is needed.
+    from hardware.cardiff import cardiff
+    from hardware.cardiff import compare_sets
+    from hardware.cardiff import utils as cardiff_utils
+
     # The global_params are only used for a single output_dir key.
     # The output_dir key is not currently useful for this use case.
     # We could probably refactor hardware to make it a kwarg, so we don't need
@@ -85,8 +111,69 @@ def print_report(facts):
         cardiff.compare_performance(facts, unique_id, systems_groups, detail)
 
 
+def get_facts(ironic_group='ironic', swift_group='swift'):
+    """Get the facts of all the nodes of an Ironic and Swift pair."""
+    ironic_client = utils.get_ironic_client(ironic_group)
+    nodes = utils.get_ironic_nodes(ironic_client)
+    facts = []
+    for _, node_facts, error in concurrency.imap(
+            functools.partial(utils.get_facts, swift_group=swift_group),
+            nodes, utils.swift_limiter(swift_group)):
+        if error is not None:
+            raise error
+        facts.append(node_facts)
+    return facts
+
+
+def get_archive_facts(path):
+    """Get the facts of all the nodes of a facts archive."""
+    try:
+        return [facts for _, facts in archive.ArchiveReader(path)]
+    except archive.ArchiveError as e:
+        sys.exit(str(e))
+
+
+def get_sites_facts(sites):
+    """Get the facts of the nodes of all the sites, fetched concurrently.
+
+    The unique id of each host is prefixed with its site, so hosts from
+    different sites are never merged.
+    """
+    groups = dict((site, conf.register_site_opts(site)) for site in sites)
+
+    def get_site_facts(site):
+        return [_namespace(node_facts, site)
+                for node_facts in get_facts(*groups[site])]
+
+    facts = []
+    failed_sites = []
+    for site, site_facts, error in concurrency.imap(
+            get_site_facts, sites, concurrency.FixedLimiter(len(sites))):
+        if error is not None:
+            LOG.error('Failed to get the facts of site %s: %s' %
+                      (site, error))
+            failed_sites.append(site)
+            continue
+        LOG.info('Got the facts of %d node(s) from site %s' %
+                 (len(site_facts), site))
+        facts.extend(site_facts)
+    if failed_sites:
+        sys.exit('Unable to report on the following sites: %s' %
+                 ', '.join(failed_sites))
+    return facts
+
+
+def _namespace(facts, site):
+    """Prefix the unique id of the host with its site."""
+    unique_id = ('system', 'product', CONF.unique_id)
+    return ingest.Facts(
+        tuple(fact[:3]) + ('%s/%s' % (site, fact[3]),)
+        if tuple(fact[:3]) == unique_id else fact for fact in facts)
+
+
 def main(args=sys.argv[1:]):
     CONF.register_cli_opts(report_cli_opts)
+    CONF.register_cli_opts(stats.stats_cli_opts)
     CONF(args=args, default_config_files=utils.DEFAULT_CONF_FILES)
     debug = CONF.report.debug
     utils.setup_logging(debug)
@@ -97,8 +184,14 @@ def main(args=sys.argv[1:]):
         LOG.error("You did not specify anything to print.")
         sys.exit(1)
 
-    ironic_client = utils.get_ironic_client()
-    nodes = utils.get_ironic_nodes(ironic_client)
-    facts = [utils.get_facts(node) for node in nodes]
+    with stats.run(CONF.profile_out, CONF.report.metrics_file,
+                   'ahc_report'):
+        if CONF.facts_archive:
+            facts = get_archive_facts(CONF.facts_archive)
+        elif CONF.report.sites:
+            facts = get_sites_facts(CONF.report.sites)
+        else:
+            facts = get_facts()
 
-    print_report(facts)
+        with stats.timer('report.print'):
+            print_report(facts)
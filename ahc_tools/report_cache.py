@@ -0,0 +1,634 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ast
+import collections
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+
+from ahc_tools import stats
+from ahc_tools import utils
+
+LOG = logging.getLogger('ahc_tools.report_cache')
+
+# Bumped when the cached results change meaning.
+CACHE_VERSION = 2
+
+# The categories compared by cardiff.group_systems, in its order, as
+# (element, check function, title). The system category is ignored, as
+# ahc-report has always done.
+CATEGORIES = [
+    ('hpa', 'hpa', 'HPA Controller'),
+    ('disk', 'physical_hpa_disks', 'HPA Disks'),
+    ('megaraid', 'megaraid', 'Megaraid Controller'),
+    ('disk', 'physical_hpa_disks', 'Megaraid Disks'),
+    ('ahci', 'ahci', 'AHCI Controller'),
+    ('ipmi', 'ipmi', 'IPMI SDR'),
+    ('firmware', 'firmware', 'Firmware'),
+    ('memory', 'memory_timing', 'DDR Timing'),
+    ('network', 'network_interfaces', 'Network Interfaces'),
+    ('cpu', 'cpu', 'Processors'),
+]
+
+# The block sizes of the memory benchmark, as cardiff.check.memory_perf
+# looks them up.
+MEMORY_MODES = ['1K', '4K', '1M', '16M', '128M', '256M', '1G', '2G']
+
+# The lines of the facts read by the performance checks of cardiff, as
+# (name, element, regexp, keys): the lines whose first field contains the
+# element, whose second field matches the regexp and, if keys is not empty,
+# whose third field contains one of the keys, as cardiff.check.search_item
+# selects them.
+SAMPLES = [
+    ('disk', 'disk', r'[a-z]d(\S+)', ['simultaneous', 'standalone']),
+    ('cpu', 'cpu', r'(.*)', ['bogomips', 'loops_per_sec']),
+    ('cpu_number', 'cpu', r'(.*logical.*)', ['number']),
+    ('memory', 'cpu', r'(.*)', MEMORY_MODES),
+    ('network', 'network', r'(.*)', []),
+]
+
+# The performance checks of cardiff.compare_performance, in its order.
+PHASES = ['disk', 'cpu', 'memory', 'network']
+
+# Group number the outliers of a group are computed with, replaced by the
+# actual group number when printed.
+_GROUP_PLACEHOLDER = 987654321
+
+
+class ReportCache(object):
+    """Intermediate results of ahc-report, kept between runs.
+
+    Holds the fingerprint of each host in each category and the benchmark
+    samples its outliers are computed from, keyed by the digest of its
+    facts, and the outliers report of each group of hosts, keyed by the
+    digests of its members. Only the entries used by the last run are
+    saved, so removed and changed nodes are dropped.
+    """
+
+    def __init__(self, path, unique_id):
+        self.path = path
+        self.unique_id = unique_id
+        self.hosts = {}
+        self.outliers = {}
+        self._used_hosts = set()
+        self._used_outliers = set()
+
+    def load(self):
+        try:
+            with open(self.path) as cache_file:
+                data = json.load(cache_file)
+        except IOError:
+            return
+        except ValueError as e:
+            LOG.warning('Ignoring the corrupted report cache %s: %s' %
+                        (self.path, e))
+            return
+        if (data.get('version') != CACHE_VERSION or
+                data.get('unique_id') != self.unique_id):
+            return
+        self.hosts = data['hosts']
+        self.outliers = data['outliers']
+
+    def save(self):
+        data = {'version': CACHE_VERSION,
+                'unique_id': self.unique_id,
+                'hosts': dict((digest, self.hosts[digest])
+                              for digest in self._used_hosts),
+                'outliers': dict((key, self.outliers[key])
+                                 for key in self._used_outliers)}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(data, cache_file, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def host(self, digest, facts):
+        """Return the unique id, fingerprints and samples of a host."""
+        self._used_hosts.add(digest)
+        entry = self.hosts.get(digest)
+        if entry is None:
+            stats.incr('report_cache.host_misses')
+            entry = self.hosts[digest] = _host_entry(facts, self.unique_id)
+        else:
+            stats.incr('report_cache.host_hits')
+        return entry
+
+    def group_outliers(self, phase, members):
+        """Return the outliers report of a phase for a group of hosts.
+
+        members is the list of (digest, entry) of the hosts of the group,
+        entry being the one returned by host. The report of a group whose
+        members changed is computed from the samples of their entries.
+        """
+        key = '%s:%s' % (phase, hashlib.sha1(
+            ' '.join(digest for digest, _ in members).encode(
+                'utf-8')).hexdigest())
+        self._used_outliers.add(key)
+        output = self.outliers.get(key)
+        if output is None:
+            stats.incr('report_cache.outliers_misses')
+            report = _Outliers(_GROUP_PLACEHOLDER,
+                               [(entry['host'], entry['samples'])
+                                for _, entry in members])
+            if phase == 'disk':
+                report.disk('KBps')
+                report.disk('IOps')
+            else:
+                getattr(report, phase)()
+            output = self.outliers[key] = ''.join(report.lines)
+        else:
+            stats.incr('report_cache.outliers_hits')
+        return output
+
+
+def _host_id(facts, unique_id):
+    host = ''
+    for fact in facts:
+        if tuple(fact[:3]) == ('system', 'product', unique_id):
+            host = fact[3]
+    return host
+
+
+def _host_entry(facts, unique_id):
+    """Compute the fingerprints and samples of a host."""
+    from hardware.cardiff import check
+    from hardware.cardiff import utils as cardiff_utils
+
+    fingerprints = {}
+    for element, check_name, title in CATEGORIES:
+        systems = cardiff_utils.find_sub_element([facts], unique_id, element)
+        [result] = getattr(check, check_name)(systems, unique_id)
+        if result == 'set()':
+            fingerprints[title] = []
+        else:
+            fingerprints[title] = sorted(ast.literal_eval(result))
+    return {'host': _host_id(facts, unique_id),
+            'fingerprints': fingerprints,
+            'samples': _samples(facts)}
+
+
+def _samples(facts):
+    """Return the lines of the facts read by the performance checks.
+
+    The lines are kept in the order of the facts, so the sets built from
+    them iterate in the same order as the ones of cardiff.
+    """
+    samples = {}
+    for name, element, regexp, keys in SAMPLES:
+        samples[name] = [
+            list(fact) for fact in facts
+            if element in fact[0] and re.match(regexp, fact[1]) and
+            (not keys or any(key in fact[2] for key in keys))]
+    return samples
+
+
+def _sets(members, name):
+    """Return the sets of samples of the hosts, keyed by unique id."""
+    sets = collections.OrderedDict()
+    for host, samples in members:
+        sets[host] = set(tuple(line) for line in samples[name])
+    return sets
+
+
+class _Outliers(object):
+    """The outliers report of a group of hosts, as cardiff prints it.
+
+    The statistics of cardiff.check are computed from the cached samples
+    with numpy, the way pandas computes them for cardiff, instead of from
+    the facts of the hosts. Only the messages printed at the INFO, WARNING
+    and ERROR levels are reproduced, the only ones ahc-report prints.
+    """
+
+    def __init__(self, number, members):
+        self.number = number
+        self.members = members
+        self.lines = []
+
+    def _print(self, mode, level, string, *args):
+        from hardware.cardiff import utils as cardiff_utils
+
+        if level & int(cardiff_utils.print_level) != level:
+            return
+        self.lines.append(('%-34s: %-8s: ' + string + '\n') % (
+            (mode, cardiff_utils.Levels.message[level]) + args))
+
+    def _header(self, title):
+        self.lines.append('\nGroup %d : Checking %s\n' % (self.number,
+                                                          title))
+
+    def _perf(self, tolerance_min, tolerance_max, row, mode, title,
+              host_means):
+        """Print the statistics of a row, as cardiff's print_perf does.
+
+        row is an OrderedDict of the values of the hosts, NaN when missing,
+        and host_means the value of each host compared to the group.
+        """
+        from hardware.cardiff import utils as cardiff_utils
+
+        levels = cardiff_utils.Levels
+        values = _array(row.values())
+        mean, std, count = _stats(values)
+        min_group = mean - 2 * std
+        max_group = mean + 2 * std
+        self._print(mode, levels.INFO,
+                    '%-12s : Group performance : min=%8.2f, mean=%8.2f, '
+                    'max=%8.2f, stddev=%8.2f', title, _nanmin(values), mean,
+                    _nanmax(values), std)
+
+        variance_tolerance = 0 if count == 1 else _divide(std, mean) * 100
+        if variance_tolerance > tolerance_max:
+            self._print(mode, levels.ERROR,
+                        "%-12s : Group's variance is too important : "
+                        "%7.2f%% of %7.2f whereas limit is set to %3.2f%%",
+                        title, variance_tolerance, mean, tolerance_max)
+            self._print(mode, levels.ERROR,
+                        '%-12s : Group performance : UNSTABLE', title)
+            return
+
+        curious_performance = False
+        if variance_tolerance > tolerance_min:
+            for host in row:
+                mean_host = host_means[host]
+                if mean_host > max_group:
+                    curious_performance = True
+                    self._print(
+                        mode, levels.WARNING,
+                        '%-12s : %s : Curious overperformance  %7.2f : '
+                        'min_allow_group = %.2f, mean_group = %.2f '
+                        'max_allow_group = %.2f', title, host, mean_host,
+                        min_group, mean, max_group)
+                elif mean_host < min_group:
+                    curious_performance = True
+                    self._print(
+                        mode, levels.WARNING,
+                        '%-12s : %s : Curious underperformance %7.2f : '
+                        'min_allow_group = %.2f, mean_group = %.2f '
+                        'max_allow_group = %.2f', title, host, mean_host,
+                        min_group, mean, max_group)
+
+        unit = '%' if 'Effi.' in title else ' '
+        if curious_performance:
+            self._print(mode, levels.WARNING,
+                        '%-12s : Group performance = %7.2f %s : SUSPICIOUS',
+                        title, mean, unit)
+        else:
+            self._print(mode, levels.INFO,
+                        '%-12s : Group performance = %7.2f %s : CONSISTENT',
+                        title, mean, unit)
+
+    def disk(self, unit):
+        """Print the report of cardiff.check.logical_disks_perf."""
+        sets = _sets(self.members, 'disk')
+        modes = []
+        for perfs in sets.values():
+            for perf in perfs:
+                if perf[2] not in modes and unit in perf[2]:
+                    modes.append(perf[2])
+
+        header = True
+        for mode in sorted(modes):
+            results = collections.OrderedDict()
+            for host, perfs in sets.items():
+                results[host] = _series(
+                    (perf[1], int(perf[3])) for perf in perfs
+                    if perf[2] == mode)
+            frame = _Frame(results)
+            host_means = frame.column_means()
+            if 'rand' in mode:
+                tolerance_min, tolerance_max = 5, 15
+            else:
+                tolerance_min, tolerance_max = 2, 10
+            for disk in frame.index:
+                if header:
+                    self._header('logical disks perf')
+                    header = False
+                self._perf(tolerance_min, tolerance_max, frame.row(disk),
+                           mode, disk, host_means)
+
+    def cpu(self):
+        """Print the report of cardiff.check.cpu_perf."""
+        core_counts = 1
+        for perfs in _sets(self.members, 'cpu_number').values():
+            for perf in perfs:
+                core_counts = perf[3]
+                break
+
+        sets = _sets(self.members, 'cpu')
+        global_perf = {}
+        header = True
+        for mode in sorted(['bogomips', 'loops_per_sec']):
+            results = collections.OrderedDict()
+            for host, perfs in sets.items():
+                series = _cpu_series(perfs, mode, host, global_perf)
+                if series is not None:
+                    results[host] = series
+            if not results:
+                continue
+
+            frame = _Frame(results)
+            for cpu in frame.index:
+                if header:
+                    self._header('CPU perf')
+                    header = False
+                row = frame.row(cpu)
+                self._perf(2, 7, row, mode, cpu, row)
+
+            if mode == 'loops_per_sec':
+                efficiency = collections.OrderedDict()
+                for host in results:
+                    if host not in global_perf:
+                        continue
+                    total, count = frame.column_sum(host)
+                    host_perf = total * (int(core_counts) / count)
+                    efficiency[host] = _divide(global_perf[host],
+                                               host_perf) * 100
+                if efficiency:
+                    self._perf(1, 2, efficiency, mode, 'CPU Effi.',
+                               efficiency)
+
+    def memory(self):
+        """Print the report of cardiff.check.memory_perf."""
+        from hardware.cardiff import utils as cardiff_utils
+
+        sets = _sets(self.members, 'memory')
+        header = True
+        for mode in sorted(MEMORY_MODES):
+            real_mode = 'Memory benchmark %s' % mode
+            results = collections.OrderedDict()
+            threaded_perf = {}
+            forked_perf = {}
+            for host, perfs in sets.items():
+                (results[host], threaded_perf[host],
+                 forked_perf[host]) = _memory_series(perfs, mode)
+            if not results:
+                continue
+
+            frame = _Frame(results)
+            host_means = frame.column_means()
+            for memory in frame.index:
+                if header:
+                    self._header('Memory perf')
+                    header = False
+                self._perf(1, 7, frame.row(memory), real_mode, memory,
+                           host_means)
+
+            for bench_type in ['threaded', 'forked']:
+                if bench_type == 'threaded':
+                    mode_text = 'Thread effi.'
+                    bench_perf = threaded_perf
+                else:
+                    mode_text = 'Forked Effi.'
+                    bench_perf = forked_perf
+                efficiency = collections.OrderedDict()
+                for host in sets:
+                    host_perf, _ = frame.column_sum(host)
+                    if (host_perf > 0 and threaded_perf[host] > 0 and
+                            forked_perf[host] > 0):
+                        efficiency[host] = _divide(bench_perf[host],
+                                                   host_perf) * 100
+                if efficiency:
+                    self._perf(2, 10, efficiency, real_mode, mode_text,
+                               efficiency)
+                else:
+                    self._print(real_mode, cardiff_utils.Levels.WARNING,
+                                '%-12s : Benchmark not run on this group',
+                                mode_text)
+
+    def network(self):
+        """Print the report of cardiff.check.network_perf."""
+        sets = _sets(self.members, 'network')
+        header = True
+        for mode in sorted(['bandwidth', 'requests_per_sec']):
+            results = collections.OrderedDict()
+            for host, perfs in sets.items():
+                values = [float(perf[3]) for perf in perfs if perf[1] == mode]
+                if values:
+                    global_perf = 0.0
+                    for value in values:
+                        global_perf = global_perf + value
+                    results[host] = _series([(mode, global_perf)])
+            frame = _Frame(results)
+            for net in frame.index:
+                if header:
+                    self._header('network disks perf')
+                    header = False
+                row = frame.row(net)
+                self._perf(2, 15, row, mode, net, row)
+
+
+def _cpu_series(perfs, mode, host, global_perf):
+    """Return the series of a host for a CPU benchmark, None if not run.
+
+    The result of the run on all the CPUs is stored in global_perf.
+    """
+    series = []
+    found_data = False
+    for perf in perfs:
+        if perf[2] != mode:
+            continue
+        # Individual CPU runs are split from the global one.
+        if '_' in perf[1]:
+            series.append((perf[1], float(perf[3])))
+            found_data = True
+        elif 'loops_per_sec' in mode:
+            global_perf[host] = float(perf[3])
+            found_data = True
+    if not found_data:
+        return None
+    # A single "All CPU" run was done.
+    if not series:
+        series.append(('logical', global_perf[host]))
+    return _series(series)
+
+
+def _memory_series(perfs, mode):
+    """Return the series of a host for a memory block size.
+
+    Returns the series and the threaded and forked results, 0 if not run.
+    """
+    series = []
+    found_data = ''
+    threaded_perf = forked_perf = 0
+    for perf in perfs:
+        if mode not in perf[2]:
+            continue
+        if 'logical_' in perf[1] and 'bandwidth_%s' % mode in perf[2]:
+            series.append((perf[1], float(perf[3])))
+        elif 'threaded_bandwidth_%s' % mode in perf[2]:
+            threaded_perf = found_data = float(perf[3])
+        elif 'forked_bandwidth_%s' % mode in perf[2]:
+            forked_perf = found_data = float(perf[3])
+    # A single "All CPU" run was done.
+    if found_data and not series:
+        series.append(('logical', found_data))
+    return _series(series), threaded_perf, forked_perf
+
+
+def _series(pairs):
+    """Return the labels and values of a pandas Series, in order."""
+    labels = []
+    values = {}
+    for label, value in pairs:
+        if label not in values:
+            labels.append(label)
+        values[label] = value
+    return labels, values
+
+
+class _Frame(object):
+    """The values of the hosts of a group, as a pandas DataFrame of cardiff.
+
+    The rows keep the order of the series when they all have the same
+    labels in the same order, and are sorted otherwise, as pandas does.
+    """
+
+    def __init__(self, results):
+        self.results = results
+        indexes = [labels for labels, _ in results.values()]
+        if all(labels == indexes[0] for labels in indexes[1:]):
+            self.index = list(indexes[0]) if indexes else []
+        else:
+            self.index = sorted(set().union(*indexes))
+
+    def row(self, label):
+        nan = float('nan')
+        return collections.OrderedDict(
+            (host, values.get(label, nan))
+            for host, (_, values) in self.results.items())
+
+    def _column(self, host):
+        nan = float('nan')
+        _, values = self.results[host]
+        return _array(values.get(label, nan) for label in self.index)
+
+    def column_sum(self, host):
+        """Return the sum and the count of the values of a host."""
+        import numpy
+
+        values = self._column(host)
+        mask = numpy.isnan(values)
+        return (numpy.where(mask, 0.0, values).sum(),
+                int(len(values) - mask.sum()))
+
+    def column_means(self):
+        means = {}
+        for host in self.results:
+            total, count = self.column_sum(host)
+            means[host] = _divide(total, count)
+        return means
+
+
+def _array(values):
+    import numpy
+
+    return numpy.array(list(values), dtype=numpy.float64)
+
+
+def _divide(a, b):
+    """Divide as numpy does: by zero gives an infinite or NaN value."""
+    import numpy
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.float64(a) / b
+
+
+def _stats(values):
+    """Return the mean, sample standard deviation and count of values.
+
+    NaN values are skipped, and the sums computed the way pandas does, so
+    the results are the same as cardiff's.
+    """
+    import numpy
+
+    mask = numpy.isnan(values)
+    count = int(len(values) - mask.sum())
+    filled = numpy.where(mask, 0.0, values)
+    mean = _divide(filled.sum(), count)
+    if count < 2:
+        return mean, float('nan'), count
+    squares = (mean - filled) ** 2
+    squares[mask] = 0.0
+    return mean, numpy.sqrt(squares.sum() / (count - 1)), count
+
+
+def _nanmin(values):
+    import numpy
+
+    return numpy.where(numpy.isnan(values), numpy.inf, values).min()
+
+
+def _nanmax(values):
+    import numpy
+
+    return numpy.where(numpy.isnan(values), -numpy.inf, values).max()
+
+
+def print_report(facts, cache, groups=False, categories=False,
+                 outliers=False):
+    """Print the report of print_report, reusing the cached results.
+
+    The report is the one cardiff prints, except that hosts are grouped by
+    the content of their fingerprints rather than by their repr.
+    """
+    from hardware.cardiff import compare_sets
+
+    nodes = []
+    hosts = collections.OrderedDict()
+    for node_facts in facts:
+        digest = utils.facts_digest(node_facts)
+        entry = cache.host(digest, node_facts)
+        nodes.append((entry['host'], digest, entry))
+        hosts[entry['host']] = entry['fingerprints']
+
+    systems_groups = [set(hosts)]
+    if groups:
+        compare_sets.print_systems_groups(systems_groups)
+
+    if categories:
+        for _, _, title in CATEGORIES:
+            result = _category_result(hosts, title)
+            compare_sets.compute_similar_hosts_list(
+                systems_groups,
+                compare_sets.get_hosts_list_from_result(result))
+            compare_sets.print_groups({}, result, title)
+
+    if outliers:
+        group_numbers = {}
+        for number, group in enumerate(systems_groups):
+            for host in group:
+                group_numbers[host] = number
+        members = [[] for _ in systems_groups]
+        for host, digest, entry in nodes:
+            members[group_numbers[host]].append((digest, entry))
+        for phase in PHASES:
+            for number, group_members in enumerate(members):
+                output = cache.group_outliers(phase, group_members)
+                sys.stdout.write(output.replace(
+                    'Group %d :' % _GROUP_PLACEHOLDER,
+                    'Group %d :' % number))
+
+
+def _category_result(hosts, title):
+    """Return the hosts grouped by fingerprint, as cardiff's compare does."""
+    by_fingerprint = collections.OrderedDict()
+    for host, fingerprints in hosts.items():
+        fingerprint = tuple(tuple(line) for line in fingerprints[title])
+        by_fingerprint.setdefault(fingerprint, []).append(host)
+    return collections.OrderedDict(
+        (repr(set(fingerprint)), group_hosts)
+        for fingerprint, group_hosts in by_fingerprint.items())
@@ -0,0 +1,222 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import contextlib
+import cProfile
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import timeit
+
+from oslo_config import cfg
+
+CONF = cfg.CONF
+
+LOG = logging.getLogger('ahc_tools.stats')
+
+stats_cli_opts = [
+    cfg.StrOpt('profile-out',
+               dest='profile_out',
+               metavar='FILE',
+               help='Dump cProfile data for the whole run to FILE.'),
+]
+
+PERCENTILES = (50, 90, 99)
+
+# Upper bounds, in seconds, of the latency histogram buckets exported to
+# Prometheus.
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                     10.0, 30.0)
+
+clock = timeit.default_timer
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of a sorted list of values."""
+    if not values:
+        return 0.0
+    index = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+class Registry(object):
+    """Counters and latency samples recorded by the CLIs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counters = collections.defaultdict(int)
+        self.timings = collections.defaultdict(list)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.timings[name].append(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = clock()
+        try:
+            yield
+        finally:
+            self.observe(name, clock() - start)
+
+    def as_dict(self):
+        """Return the counters and a latency summary for each phase."""
+        phases = {}
+        for name, samples in self.timings.items():
+            samples = sorted(samples)
+            phase = {'count': len(samples),
+                     'total': sum(samples),
+                     'max': samples[-1]}
+            for pct in PERCENTILES:
+                phase['p%d' % pct] = percentile(samples, pct)
+            phases[name] = phase
+        return {'counters': dict(self.counters), 'phases': phases}
+
+    def summary(self):
+        """Return the lines of a human readable summary."""
+        data = self.as_dict()
+        lines = ['%-20s %7s %10s %9s %9s %9s %9s' % (
+            'phase', 'count', 'total (s)', 'p50 (ms)', 'p90 (ms)',
+            'p99 (ms)', 'max (ms)')]
+        for name, phase in sorted(data['phases'].items()):
+            lines.append('%-20s %7d %10.3f %9.2f %9.2f %9.2f %9.2f' % (
+                name, phase['count'], phase['total'],
+                phase['p50'] * 1000, phase['p90'] * 1000,
+                phase['p99'] * 1000, phase['max'] * 1000))
+        for name, value in sorted(data['counters'].items()):
+            lines.append('%-20s %7d' % (name, value))
+        return lines
+
+
+def _metric_name(prefix, name):
+    return '%s_%s' % (prefix, re.sub(r'[^a-zA-Z0-9_]', '_', name))
+
+
+def prometheus_lines(registry, prefix, success=True):
+    """Return the registry in the Prometheus text exposition format.
+
+    Counters are exported as gauges since the registry only covers a single
+    run, each phase as a latency histogram and the 'total' phase as the run
+    duration. For every pair of '<name>.hits' and '<name>.misses' counters a
+    '<name>_hit_ratio' gauge is added.
+    """
+    lines = []
+
+    def gauge(name, value, help_text):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s gauge' % name)
+        lines.append('%s %s' % (name, repr(float(value))))
+
+    gauge(prefix + '_last_run_timestamp_seconds', int(time.time()),
+          'Time the last run finished.')
+    gauge(prefix + '_last_run_success', int(success),
+          'Whether the last run finished without an error.')
+    total = registry.timings.get('total')
+    if total:
+        gauge(prefix + '_run_duration_seconds', sum(total),
+              'Wall time of the last run.')
+
+    for name, value in sorted(registry.counters.items()):
+        gauge(_metric_name(prefix, name), value, 'Last run %s.' % name)
+        if name.endswith('.hits'):
+            cache = name[:-len('.hits')]
+            lookups = value + registry.counters.get(cache + '.misses', 0)
+            gauge(_metric_name(prefix, cache + '_hit_ratio'),
+                  float(value) / lookups if lookups else 0,
+                  'Last run hit ratio of %s.' % cache)
+
+    for name, samples in sorted(registry.timings.items()):
+        if name == 'total':
+            continue
+        metric = _metric_name(prefix, name + '_seconds')
+        lines.append('# HELP %s Latency of %s.' % (metric, name))
+        lines.append('# TYPE %s histogram' % metric)
+        samples = sorted(samples)
+        count = 0
+        for bound in HISTOGRAM_BUCKETS:
+            while count < len(samples) and samples[count] <= bound:
+                count += 1
+            lines.append('%s_bucket{le="%s"} %d' % (metric, bound, count))
+        lines.append('%s_bucket{le="+Inf"} %d' % (metric, len(samples)))
+        lines.append('%s_sum %r' % (metric, float(sum(samples))))
+        lines.append('%s_count %d' % (metric, len(samples)))
+    return lines
+
+
+def write_textfile(path, registry, prefix, success=True):
+    """Atomically write the registry to a textfile-collector file."""
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                        prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(handle, 'w') as tmp_file:
+            tmp_file.write('\n'.join(prometheus_lines(registry, prefix,
+                                                      success)) + '\n')
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+REGISTRY = Registry()
+
+incr = REGISTRY.incr
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+@contextlib.contextmanager
+def run(profile_out=None, metrics_file=None, prefix='ahc'):
+    """Instrument a CLI run.
+
+    The registry is reset on entry and its summary is logged on exit. When
+    profile_out is set, the run is profiled and the cProfile data dumped to
+    that file. When metrics_file is set, the registry is written to it in
+    the Prometheus textfile-collector format, with metric names starting
+    with prefix.
+    """
+    REGISTRY.reset()
+    profiler = None
+    if profile_out:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = clock()
+    success = False
+    try:
+        yield
+        success = True
+    finally:
+        REGISTRY.observe('total', clock() - start)
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_out)
+            LOG.info('Profile data written to %s' % profile_out)
+        for line in REGISTRY.summary():
+            LOG.info(line)
+        if metrics_file:
+            try:
+                write_textfile(metrics_file, REGISTRY, prefix, success)
+            except Exception as e:
+                LOG.error('Failed to write metrics to %s. Error was: %s' %
+                          (metrics_file, e))
@@ -0,0 +1,91 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from ahc_tools import archive
+from ahc_tools import ingest
+from ahc_tools.test import base
+
+
+class TestArchive(base.BaseTest):
+    def setUp(self):
+        super(TestArchive, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'fleet.jsonl.gz')
+        self.facts = dict(
+            ('node%d' % i, [('cpu', 'logical', 'number', str(i)),
+                            ('system', 'product', 'serial', 'S%d' % i)])
+            for i in range(3))
+
+    def _write(self):
+        with archive.ArchiveWriter(self.path) as writer:
+            for uuid in sorted(self.facts):
+                writer.add(uuid, self.facts[uuid])
+        return writer
+
+    def test_get(self):
+        self.assertEqual(3, self._write().count)
+        reader = archive.ArchiveReader(self.path)
+        self.assertEqual(['node0', 'node1', 'node2'], reader.uuids())
+        facts = reader.get('node2')
+        self.assertIsInstance(facts, ingest.Facts)
+        self.assertEqual(self.facts['node2'], facts)
+
+    def test_iter(self):
+        self._write()
+        os.unlink(archive.index_path(self.path))
+        self.assertEqual(sorted(self.facts.items()),
+                         list(archive.ArchiveReader(self.path)))
+
+    def test_single_gzip_stream(self):
+        self._write()
+        with gzip.open(self.path, 'rb') as archive_file:
+            lines = archive_file.read().decode('utf-8').splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual('node1', json.loads(lines[1])['uuid'])
+
+    def test_unknown_node(self):
+        self._write()
+        self.assertRaisesRegexp(archive.ArchiveError, 'node9',
+                                archive.ArchiveReader(self.path).get,
+                                'node9')
+
+    def test_missing_index(self):
+        self._write()
+        os.unlink(archive.index_path(self.path))
+        self.assertRaisesRegexp(archive.ArchiveError, 'index',
+                                archive.ArchiveReader(self.path).get,
+                                'node0')
+
+    def test_corrupted_record(self):
+        self._write()
+        with open(self.path, 'r+b') as archive_file:
+            archive_file.seek(20)
+            archive_file.write(b'garbage')
+        self.assertRaisesRegexp(archive.ArchiveError, 'Corrupted',
+                                archive.ArchiveReader(self.path).get,
+                                'node0')
+
+    def test_nothing_written_on_error(self):
+        def write():
+            with archive.ArchiveWriter(self.path) as writer:
+                writer.add('node0', self.facts['node0'])
+                raise ValueError('boom')
+        self.assertRaises(ValueError, write)
+        self.assertEqual([], os.listdir(self.tmpdir))
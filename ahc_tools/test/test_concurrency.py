@@ -0,0 +1,224 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from ahc_tools import concurrency
+from ahc_tools import exc
+from ahc_tools import stats
+from ahc_tools.test import base
+
+
+class TestAIMDLimiter(base.BaseTest):
+    def setUp(self):
+        super(TestAIMDLimiter, self).setUp()
+        stats.REGISTRY.reset()
+        self.limiter = concurrency.AIMDLimiter('swift', 16, 1.0)
+
+    def _release(self, latency, congested=False):
+        self.limiter.acquire()
+        self.limiter.release(latency, congested)
+
+    def test_initial_limit(self):
+        self.assertEqual(4, self.limiter.limit)
+        self.assertEqual(1, concurrency.AIMDLimiter('ironic', 2, 1.0).limit)
+
+    def test_additive_increase(self):
+        for _ in range(5):
+            self._release(0.1)
+        self.assertEqual(5, int(self.limiter.limit))
+        for _ in range(1000):
+            self._release(0.1)
+        self.assertEqual(16, self.limiter.limit)
+
+    def test_decrease_on_latency(self):
+        for _ in range(4):
+            self._release(2.0)
+        self.assertEqual(2, self.limiter.limit)
+        self.assertEqual(1, stats.REGISTRY.counters['swift.throttled'])
+
+    def test_decrease_once_per_window(self):
+        self._release(2.0)
+        self._release(2.0)
+        self.assertEqual(4, self.limiter.limit)
+        self._release(2.0)
+        self._release(2.0)
+        self.assertEqual(2, self.limiter.limit)
+
+    def test_decrease_on_congestion(self):
+        error = exc.SwiftDownloadError('boom', 'name', http_status=503)
+
+        def fail():
+            raise error
+        for _ in range(20):
+            self.assertRaises(exc.SwiftDownloadError, self.limiter.call, fail)
+        self.assertEqual(1, self.limiter.limit)
+        self.assertEqual(0, self.limiter.in_flight)
+
+    def test_other_errors_not_congestion(self):
+        self.assertFalse(concurrency.is_congestion(ValueError('boom')))
+        self.assertFalse(concurrency.is_congestion(
+            exc.SwiftDownloadError('boom', 'name', http_status=404)))
+
+    def test_limit_enforced(self):
+        # Every call is slow, the limit stays at its minimum.
+        limiter = concurrency.AIMDLimiter('swift', 4, 0.001)
+        lock = threading.Lock()
+        current = [0]
+        peak = [0]
+
+        def work(item):
+            with lock:
+                current[0] += 1
+                peak[0] = max(peak[0], current[0])
+            time.sleep(0.01)
+            with lock:
+                current[0] -= 1
+
+        list(concurrency.imap(work, range(8), limiter))
+        self.assertEqual(1, peak[0])
+
+
+class TestImap(base.BaseTest):
+    def setUp(self):
+        super(TestImap, self).setUp()
+        self.limiter = concurrency.AIMDLimiter('swift', 8, 10.0)
+
+    def test_order_preserved(self):
+        def work(item):
+            time.sleep(0.001 * (10 - item))
+            return item * 2
+        results = list(concurrency.imap(work, range(10), self.limiter))
+        self.assertEqual([(i, i * 2, None) for i in range(10)], results)
+
+    def test_errors_returned(self):
+        def work(item):
+            if item == 1:
+                raise ValueError('boom')
+            return item
+        results = list(concurrency.imap(work, range(3), self.limiter))
+        self.assertEqual((0, 0, None), results[0])
+        self.assertIsInstance(results[1][2], ValueError)
+        self.assertEqual((2, 2, None), results[2])
+
+    def test_system_exit_raised(self):
+        def work(item):
+            if item == 2:
+                raise SystemExit('no facts')
+            return item
+        results = concurrency.imap(work, range(5), self.limiter)
+        self.assertEqual((0, 0, None), next(results))
+        self.assertEqual((1, 1, None), next(results))
+        self.assertRaises(SystemExit, next, results)
+
+    def test_empty(self):
+        self.assertEqual([], list(concurrency.imap(str, [], self.limiter)))
+
+    def test_input_error_raised(self):
+        def items():
+            yield 0
+            raise ValueError('boom')
+        results = concurrency.imap(str, items(), self.limiter)
+        self.assertEqual((0, '0', None), next(results))
+        self.assertRaises(ValueError, next, results)
+
+    def test_chained(self):
+        doubled = concurrency.imap(lambda item: item * 2, range(20),
+                                   self.limiter, backlog=3)
+        plus_one = concurrency.imap(lambda item: item[1] + 1, doubled,
+                                    concurrency.FixedLimiter(4))
+        self.assertEqual([i * 2 + 1 for i in range(20)],
+                         [result for _, result, _ in plus_one])
+
+
+class TestLatencyWindow(base.BaseTest):
+    def test_percentile(self):
+        window = concurrency.LatencyWindow(size=100, min_samples=10)
+        for i in range(9):
+            window.add(i)
+        self.assertIsNone(window.percentile(90))
+        for i in range(9, 200):
+            window.add(i)
+        self.assertEqual(189, window.percentile(90))
+
+
+class TestHedged(base.BaseTest):
+    def setUp(self):
+        super(TestHedged, self).setUp()
+        stats.REGISTRY.reset()
+        self.calls = []
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def _func(self, *behaviors):
+        """Return a function behaving as told for each of its calls."""
+        lock = threading.Lock()
+
+        def func():
+            with lock:
+                number = len(self.calls)
+                self.calls.append(number)
+            behavior = behaviors[number]
+            if behavior == 'stall':
+                self.release.wait()
+            elif behavior == 'fail':
+                raise ValueError('attempt %d' % number)
+            return number
+        return func
+
+    def test_fast_call_not_hedged(self):
+        self.assertEqual(0, concurrency.hedged('swift', self._func('ok'),
+                                               10.0))
+        self.assertEqual([0], self.calls)
+        self.assertEqual(0, stats.REGISTRY.counters['swift.hedged'])
+
+    def test_hedge_wins(self):
+        func = self._func('stall', 'ok')
+        cancel = threading.Event()
+        self.assertEqual(1, concurrency.hedged('swift', func, 0.01, cancel))
+        # The first call, still stalled, is told to stop.
+        self.assertTrue(cancel.is_set())
+        self.assertEqual(1, stats.REGISTRY.counters['swift.hedged'])
+        self.assertEqual(1, stats.REGISTRY.counters['swift.hedge_wins'])
+
+    def test_fast_error_not_hedged(self):
+        cancel = threading.Event()
+        self.assertRaisesRegexp(ValueError, 'attempt 0', concurrency.hedged,
+                                'swift', self._func('fail'), 10.0, cancel)
+        self.assertEqual([0], self.calls)
+        self.assertTrue(cancel.is_set())
+
+    def test_hedge_fails(self):
+        def func():
+            if not self.calls:
+                self.calls.append(0)
+                time.sleep(0.05)
+                raise ValueError('attempt 0')
+            self.calls.append(1)
+            raise ValueError('attempt 1')
+        self.assertRaisesRegexp(ValueError, 'attempt 0', concurrency.hedged,
+                                'swift', func, 0.01)
+        self.assertEqual([0, 1], self.calls)
+
+    def test_first_call_still_wins(self):
+        def func():
+            if not self.calls:
+                self.calls.append(0)
+                time.sleep(0.05)
+                return 0
+            self.calls.append(1)
+            self.release.wait()
+            return 1
+        self.assertEqual(0, concurrency.hedged('swift', func, 0.01))
+        self.assertEqual(0, stats.REGISTRY.counters['swift.hedge_wins'])
@@ -0,0 +1,111 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from ahc_tools import archive
+from ahc_tools import facts
+from ahc_tools.test import base
+from ahc_tools import utils
+
+CONF = facts.CONF
+
+
+@mock.patch.object(facts.cfg, 'ConfigParser', autospec=True)
+@mock.patch.object(facts, 'LOG')
+class TestFacts(base.BaseTest):
+    def setUp(self):
+        super(TestFacts, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'fleet.jsonl.gz')
+        self.nodes = [
+            mock.Mock(uuid='node%d' % i, provision_state='manageable',
+                      extra={'hardware_swift_object': 'extra_hardware-%d' % i})
+            for i in range(3)]
+        self.nodes.append(mock.Mock(uuid='new', provision_state='manageable',
+                                    extra={}))
+        ironic_client = mock.Mock()
+        ironic_client.node.list.return_value = self.nodes
+        patcher = mock.patch.object(utils, 'get_ironic_client',
+                                    return_value=ironic_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self._unregister_command)
+
+    def _unregister_command(self):
+        # The sub-command is a positional argument the other tools don't
+        # expect.
+        CONF.reset()
+        CONF.unregister_opt(facts.command_opt)
+
+    def _get_facts(self, node):
+        return [('system', 'product', 'uuid', node.uuid)]
+
+    @mock.patch.object(utils, 'get_facts', autospec=True)
+    def test_export(self, facts_mock, log_mock, cfg_mock):
+        facts_mock.side_effect = self._get_facts
+        facts.main(['export', self.path])
+        reader = archive.ArchiveReader(self.path)
+        self.assertEqual(['node0', 'node1', 'node2'], reader.uuids())
+        self.assertEqual([('system', 'product', 'uuid', 'node1')],
+                         reader.get('node1'))
+        self.assertEqual(1, log_mock.warning.call_count)
+
+    @mock.patch.object(utils, 'get_facts', autospec=True)
+    def test_export_failed(self, facts_mock, log_mock, cfg_mock):
+        def get_facts(node):
+            if node.uuid == 'node1':
+                raise Exception('boom')
+            return self._get_facts(node)
+        facts_mock.side_effect = get_facts
+        self.assertRaisesRegexp(SystemExit, 'nodes: node1$',
+                                facts.main, ['export', self.path])
+        self.assertEqual(['node0', 'node2'],
+                         archive.ArchiveReader(self.path).uuids())
+
+    def _write_archive(self):
+        with archive.ArchiveWriter(self.path) as writer:
+            writer.add('node0', self._get_facts(self.nodes[0]))
+
+    @mock.patch.object(facts.sys, 'stdout')
+    def test_show(self, stdout_mock, log_mock, cfg_mock):
+        self._write_archive()
+        facts.main(['show', self.path, 'node0'])
+        output = ''.join(c[0][0] for c in stdout_mock.write.call_args_list)
+        self.assertEqual([['system', 'product', 'uuid', 'node0']],
+                         json.loads(output))
+
+    def test_show_unknown_node(self, log_mock, cfg_mock):
+        self._write_archive()
+        self.assertRaisesRegexp(SystemExit, 'not in the facts archive',
+                                facts.main, ['show', self.path, 'node9'])
+
+    @mock.patch.object(utils, 'get_swift_api', autospec=True)
+    def test_compress(self, swift_mock, log_mock, cfg_mock):
+        swift_api = swift_mock.return_value
+        swift_api.list_objects.return_value = ['extra_hardware-0',
+                                               'extra_hardware-1']
+        swift_api.compress_object.side_effect = [(1000, 100), (100, None)]
+        facts.main(['compress'])
+        swift_api.list_objects.assert_called_once_with('ironic-discoverd',
+                                                       'extra_hardware-')
+        self.assertEqual(2, swift_api.compress_object.call_count)
+        log_mock.info.assert_called_once_with(
+            'Compressed 1 of 2 object(s) in container ironic-discoverd, '
+            'from 1100 to 200 bytes')
@@ -0,0 +1,43 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import sys
+
+from ahc_tools.test import base
+
+# Modules which are slow to import and must only be loaded by the code paths
+# using them.
+HEAVY_MODULES = ('hardware', 'ironicclient', 'swiftclient', 'pandas')
+
+
+class TestLazyImports(base.BaseTest):
+    def _imported_heavy_modules(self, module):
+        code = ('import sys\n'
+                'import %s\n'
+                'print(",".join(m for m in %r if m in sys.modules))'
+                % (module, HEAVY_MODULES))
+        output = subprocess.check_output([sys.executable, '-c', code])
+        return output.decode().strip()
+
+    def test_match(self):
+        self.assertEqual('', self._imported_heavy_modules('ahc_tools.match'))
+
+    def test_report(self):
+        self.assertEqual('', self._imported_heavy_modules('ahc_tools.report'))
+
+    def test_facts(self):
+        self.assertEqual('', self._imported_heavy_modules('ahc_tools.facts'))
+
+    def test_whatif(self):
+        self.assertEqual('', self._imported_heavy_modules('ahc_tools.whatif'))
@@ -0,0 +1,66 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import mock
+
+from ahc_tools import ingest
+from ahc_tools.test import base
+
+
+class TestParseValue(base.BaseTest):
+    def test_numbers(self):
+        self.assertEqual(8, ingest.parse_value('8'))
+        self.assertIsInstance(ingest.parse_value('8'), int)
+        self.assertEqual(4199.99, ingest.parse_value('4199.99'))
+        self.assertTrue(ingest.is_number(ingest.parse_value('-1')))
+
+    def test_strings(self):
+        for value in ('99:99:99:99:99:99', '192.168.100.12', 'x86_64',
+                      'Intel(R) Xeon(R)', '4096KB', ''):
+            self.assertEqual(value, ingest.parse_value(value))
+            self.assertFalse(ingest.is_number(ingest.parse_value(value)))
+
+
+class TestFacts(base.BaseTest):
+    def setUp(self):
+        super(TestFacts, self).setUp()
+        self.blob = json.dumps([
+            ['cpu', 'logical', 'number', '8'],
+            ['cpu', 'logical_0', 'cache_size', '4096KB'],
+            ['disk', 'sda', 'size', '100'],
+            ['disk', 'sda', 'size', '200'],
+            ['network', 'eth0', 'serial', '99:99:99:99:99:99']])
+
+    def test_decode_keeps_raw_values(self):
+        facts = ingest.decode(self.blob)
+        self.assertIsInstance(facts, ingest.Facts)
+        self.assertEqual(('cpu', 'logical', 'number', '8'), facts[0])
+        self.assertEqual(json.loads(self.blob),
+                         json.loads(json.dumps(facts)))
+
+    def test_values(self):
+        facts = ingest.decode(self.blob)
+        self.assertEqual([100, 200], facts.values('disk', 'sda', 'size'))
+        self.assertEqual(['4096KB'],
+                         facts.values('cpu', 'logical_0', 'cache_size'))
+        self.assertEqual([], facts.values('disk', 'sdb', 'size'))
+
+    def test_values_parsed_once(self):
+        facts = ingest.decode(self.blob)
+        with mock.patch.object(ingest, 'parse_value',
+                               wraps=ingest.parse_value) as parse_mock:
+            values = facts.values('disk', 'sda', 'size')
+            self.assertIs(values, facts.values('disk', 'sda', 'size'))
+        self.assertEqual(2, parse_mock.call_count)
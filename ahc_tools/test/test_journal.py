@@ -0,0 +1,78 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from ahc_tools import journal
+from ahc_tools.test import base
+
+
+class TestJournal(base.BaseTest):
+    def setUp(self):
+        super(TestJournal, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'match.journal')
+        self.journal = journal.Journal(self.path)
+        self.addCleanup(self.journal.close)
+
+    def test_load_missing(self):
+        self.assertEqual({}, self.journal.load())
+
+    def test_record_and_load(self):
+        self.journal.open()
+        self.journal.record('uuid1', journal.MATCHED, digest='abc',
+                            profile='compute', patches=[{'op': 'add'}])
+        self.journal.record('uuid2', journal.FAILED)
+        self.journal.record('uuid1', journal.PATCHED)
+        records = journal.Journal(self.path).load()
+        self.assertEqual({'uuid': 'uuid1', 'event': 'patched',
+                          'digest': 'abc', 'profile': 'compute',
+                          'patches': [{'op': 'add'}]}, records['uuid1'])
+        self.assertEqual('failed', records['uuid2']['event'])
+
+    def test_open_truncates_unless_resuming(self):
+        self.journal.open()
+        self.journal.record('uuid1', journal.FAILED)
+        self.journal.close()
+        self.journal.open(resume=True)
+        self.journal.record('uuid2', journal.FAILED)
+        self.journal.close()
+        self.assertEqual(set(['uuid1', 'uuid2']), set(self.journal.load()))
+        self.journal.open()
+        self.journal.close()
+        self.assertEqual({}, self.journal.load())
+
+    def test_truncated_record_ignored(self):
+        with open(self.path, 'w') as journal_file:
+            journal_file.write('{"event": "failed", "uuid": "uuid1"}\n'
+                               '{"event": "matc')
+        self.assertEqual(['uuid1'], list(self.journal.load()))
+
+    def test_resume_after_truncated_record(self):
+        with open(self.path, 'w') as journal_file:
+            journal_file.write('{"event": "failed", "uuid": "a"}\n'
+                               '{"event": "matc')
+        self.journal.open(resume=True)
+        self.journal.record('b', journal.MATCHED)
+        self.assertEqual({'a': journal.FAILED, 'b': journal.MATCHED},
+                         dict((uuid, record['event']) for uuid, record
+                              in journal.Journal(self.path).load().items()))
+
+    def test_remove(self):
+        self.journal.open()
+        self.journal.remove()
+        self.assertFalse(os.path.exists(self.path))
+        self.journal.remove()
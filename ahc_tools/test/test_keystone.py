@@ -0,0 +1,124 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import mock
+import os
+import shutil
+import stat
+import tempfile
+
+from keystoneauth1 import access
+from keystoneauth1.identity import base as identity_base
+from oslo_config import cfg
+
+from ahc_tools.common import keystone
+from ahc_tools import exc
+from ahc_tools import stats
+from ahc_tools.test import base
+
+CONF = cfg.CONF
+
+CREDENTIALS = ('http://authurl/v2.0', 'ironic', 'password', 'service')
+
+
+@mock.patch.object(identity_base.BaseIdentityPlugin, 'get_access',
+                   autospec=True)
+class TestGetSession(base.BaseTest):
+    def setUp(self):
+        super(TestGetSession, self).setUp()
+        self.cache_dir = os.path.join(tempfile.mkdtemp(), 'cache')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.cache_dir))
+        CONF.set_override('auth_cache_dir', self.cache_dir, 'keystone')
+        patcher = mock.patch.object(keystone, '_SESSIONS', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        stats.REGISTRY.reset()
+        self.expires = (datetime.datetime.utcnow() +
+                        datetime.timedelta(hours=1))
+
+    def _fake_get_access(self, auth, session):
+        token = {'access': {'token': {
+            'id': 'token',
+            'expires': self.expires.strftime('%Y-%m-%dT%H:%M:%SZ')}}}
+        auth.auth_ref = access.create(body=token)
+        return auth.auth_ref
+
+    def _new_process(self):
+        keystone._SESSIONS.clear()
+
+    def test_cached_on_disk(self, access_mock):
+        access_mock.side_effect = self._fake_get_access
+        sess = keystone.get_session(*CREDENTIALS)
+        self.assertIs(sess, keystone.get_session(*CREDENTIALS))
+        self.assertEqual(1, access_mock.call_count)
+
+        [name] = os.listdir(self.cache_dir)
+        mode = os.stat(os.path.join(self.cache_dir, name)).st_mode
+        self.assertEqual(0o600, stat.S_IMODE(mode))
+        mode = os.stat(self.cache_dir).st_mode
+        self.assertEqual(0o700, stat.S_IMODE(mode))
+
+        self._new_process()
+        sess = keystone.get_session(*CREDENTIALS)
+        self.assertEqual(1, access_mock.call_count)
+        self.assertEqual('token', sess.auth.auth_ref.auth_token)
+        self.assertEqual(1, stats.REGISTRY.counters['keystone.cache.hits'])
+
+    def test_other_credentials_not_shared(self, access_mock):
+        access_mock.side_effect = self._fake_get_access
+        sess = keystone.get_session(*CREDENTIALS)
+        self.assertIsNot(sess, keystone.get_session(
+            'http://authurl/v2.0', 'swift', 'password', 'service'))
+        self.assertEqual(2, access_mock.call_count)
+
+    def test_expiring_token_renewed(self, access_mock):
+        access_mock.side_effect = self._fake_get_access
+        self.expires = datetime.datetime.utcnow() + datetime.timedelta(
+            seconds=keystone.MIN_TOKEN_LIFE - 60)
+        keystone.get_session(*CREDENTIALS)
+        self._new_process()
+        keystone.get_session(*CREDENTIALS)
+        self.assertEqual(2, access_mock.call_count)
+
+    def test_corrupted_cache(self, access_mock):
+        access_mock.side_effect = self._fake_get_access
+        keystone.get_session(*CREDENTIALS)
+        [name] = os.listdir(self.cache_dir)
+        with open(os.path.join(self.cache_dir, name), 'w') as cache_file:
+            cache_file.write('{"auth_')
+        self._new_process()
+        keystone.get_session(*CREDENTIALS)
+        self.assertEqual(2, access_mock.call_count)
+
+    def test_cache_wrong_structure(self, access_mock):
+        access_mock.side_effect = self._fake_get_access
+        keystone.get_session(*CREDENTIALS)
+        [name] = os.listdir(self.cache_dir)
+        for content in ('[]', 'null'):
+            with open(os.path.join(self.cache_dir, name), 'w') as cache_file:
+                cache_file.write(content)
+            self._new_process()
+            keystone.get_session(*CREDENTIALS)
+        self.assertEqual(3, access_mock.call_count)
+
+    def test_cache_disabled(self, access_mock):
+        access_mock.side_effect = self._fake_get_access
+        CONF.set_override('auth_cache_dir', '', 'keystone')
+        keystone.get_session(*CREDENTIALS)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_missing_credentials(self, access_mock):
+        self.assertRaises(exc.MissingCredentialsError, keystone.get_session,
+                          'http://authurl/v2.0', 'ironic', '', 'service')
+        self.assertFalse(access_mock.called)
@@ -12,14 +12,21 @@
 # limitations under the License.
 
 import mock
+import operator
 import os
+import shutil
+import tempfile
+import threading
 
 from hardware import cmdb
 from hardware import state
 from oslo_config import cfg
 
 from ahc_tools import exc
+from ahc_tools import ingest
+from ahc_tools import journal
 from ahc_tools import match
+from ahc_tools import stats
 from ahc_tools.test import base
 from ahc_tools import utils
 
@@ -88,7 +95,7 @@ class TestMatch(MatchBase):
         self.assertRaises(exc.LoadFailedError, match.match,
                           self.node, self.facts)
 
-    @mock.patch.object(state.State, 'find_match',
+    @mock.patch.object(match, '_find_match',
                        side_effect=Exception('boom'), autospec=True)
     def test_no_match(self, find_mock, mock_facts):
         self.assertRaises(exc.MatchFailedError, match.match, self.node, {})
@@ -148,10 +155,14 @@ class TestMatch(MatchBase):
 @mock.patch.object(match.cfg, 'ConfigParser', autospec=True)
 @mock.patch.object(match, 'LOG')
 @mock.patch.object(utils, 'get_ironic_client', autospec=True)
+@mock.patch.object(utils, 'get_facts', lambda node: [])
 @mock.patch.object(match, '_restore_state', lambda: None)
 class TestMain(MatchBase):
     def setUp(self):
         super(TestMain, self).setUp()
+        self.cfg_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cfg_dir)
+        CONF.set_override('configdir', self.cfg_dir, 'edeploy')
         self.mock_client = mock.Mock()
         self.mock_client.node.list.return_value = [self.node]
 
@@ -180,7 +191,7 @@ class TestMain(MatchBase):
         self.assertEqual(2, mock_log.error.call_count)
         self.assertFalse(mock_update.called)
 
-    @mock.patch.object(match, 'match', lambda x, y: None)
+    @mock.patch.object(match, 'match', lambda x, y, z, p: None)
     @mock.patch.object(match, 'get_update_patches', lambda x, y: None)
     @mock.patch.object(match, '_copy_state', lambda: None)
     def test_match_success(self, mock_ic, mock_log, mock_cfg):
@@ -188,7 +199,7 @@ class TestMain(MatchBase):
         match.main(args=[])
         self.assertFalse(mock_log.error.called)
 
-    @mock.patch.object(match, 'match', lambda x, y: None)
+    @mock.patch.object(match, 'match', lambda x, y, z, p: None)
     @mock.patch.object(match, 'get_update_patches', lambda x, y: None)
     @mock.patch.object(match, '_copy_state', lambda: None)
     def test_update_failed(self, mock_ic, mock_log, mock_cfg):
@@ -196,3 +207,547 @@ class TestMain(MatchBase):
         mock_ic.return_value = self.mock_client
         match.main(args=[])
         self.assertTrue(1, mock_log.error.call_count)
+
+
+@mock.patch.object(match, 'LOG')
+@mock.patch.object(utils, 'get_facts', lambda node: [])
+@mock.patch.object(match, '_restore_state', lambda: None)
+@mock.patch.object(match, 'match', autospec=True)
+class TestResume(MatchBase):
+    def setUp(self):
+        super(TestResume, self).setUp()
+        self.cfg_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cfg_dir)
+        CONF.set_override('configdir', self.cfg_dir, 'edeploy')
+        self.nodes = [mock.Mock(uuid='node%d' % i, extra={},
+                                properties={}) for i in range(4)]
+        self.patches = [{'op': 'add', 'path': '/extra/bios_settings',
+                         'value': {'ProcVirtualization': 'Disabled'}}]
+        self.mock_client = mock.Mock()
+
+    def _write_journal(self):
+        run_journal = journal.Journal(match._journal_path())
+        run_journal.open()
+        run_journal.record('node0', journal.MATCHED, patches=self.patches)
+        run_journal.record('node0', journal.PATCHED)
+        run_journal.record('node1', journal.MATCHED, patches=self.patches)
+        run_journal.record('node2', journal.FAILED)
+        run_journal.close()
+
+    def _fake_match(self, node, node_info, facts, profiles):
+        node_info['hardware'] = {'profile': 'compute'}
+
+    @mock.patch.object(match, '_copy_state', autospec=True)
+    def test_resume(self, copy_mock, match_mock, log_mock):
+        self._write_journal()
+        match_mock.side_effect = self._fake_match
+        failed, not_updated = match._match_and_update(
+            self.mock_client, self.nodes, resume=True)
+        self.assertEqual(set(['node2']), failed)
+        self.assertEqual(set(), not_updated)
+        match_mock.assert_called_once_with(self.nodes[3], mock.ANY, [],
+                                           None)
+        self.assertFalse(copy_mock.called)
+        self.assertEqual(
+            ['node1', 'node3'],
+            [c[0][0] for c in self.mock_client.node.update.call_args_list])
+        self.assertEqual(self.patches,
+                         self.mock_client.node.update.call_args_list[0][0][1])
+        self.assertFalse(os.path.exists(match._journal_path()))
+
+    @mock.patch.object(match, '_copy_state', autospec=True)
+    def test_resume_patch_already_applied(self, copy_mock, match_mock,
+                                          log_mock):
+        self._write_journal()
+        self.nodes[1].extra = {'bios_settings': {
+            'ProcVirtualization': 'Disabled'}}
+        match._match_and_update(self.mock_client, self.nodes[:2],
+                                resume=True)
+        self.assertFalse(self.mock_client.node.update.called)
+
+    @mock.patch.object(match, '_copy_state', autospec=True)
+    def test_no_resume_starts_over(self, copy_mock, match_mock, log_mock):
+        self._write_journal()
+        match_mock.side_effect = self._fake_match
+        match._match_and_update(self.mock_client, self.nodes)
+        self.assertTrue(copy_mock.called)
+        self.assertEqual(4, match_mock.call_count)
+
+    def test_resume_consumes_journaled_profiles(self, match_mock, log_mock):
+        CONF.set_override('lockname', os.path.join(self.cfg_dir, 'lock'),
+                          'edeploy')
+        # The interrupted run restored the state.
+        with open(os.path.join(self.cfg_dir, 'state'), 'w') as state:
+            state.write("[('control', 3), ('compute', '*')]")
+        run_journal = journal.Journal(match._journal_path())
+        run_journal.open()
+        run_journal.record('node0', journal.MATCHED, profile='control',
+                           patches=self.patches)
+        run_journal.record('node0', journal.PATCHED)
+        run_journal.record('node1', journal.MATCHED, profile='control',
+                           patches=self.patches)
+        run_journal.record('node2', journal.MATCHED, profile='compute',
+                           patches=self.patches)
+        run_journal.close()
+
+        states = []
+
+        def fake_match(node, node_info, facts, profiles):
+            with open(os.path.join(self.cfg_dir, 'state')) as state:
+                states.append(eval(state.read()))
+        match_mock.side_effect = fake_match
+        match._match_and_update(self.mock_client, self.nodes, resume=True)
+        self.assertEqual([[('control', 1), ('compute', '*')]], states)
+
+    @mock.patch.object(match, '_copy_state', autospec=True)
+    def test_journal_kept_on_update_failure(self, copy_mock, match_mock,
+                                            log_mock):
+        match_mock.side_effect = self._fake_match
+        self.mock_client.node.update.side_effect = [None, Exception('boom')]
+        failed, not_updated = match._match_and_update(self.mock_client,
+                                                      self.nodes[:2])
+        self.assertEqual(set(), failed)
+        self.assertEqual(set(['node1']), not_updated)
+        records = journal.Journal(match._journal_path()).load()
+        self.assertEqual('patched', records['node0']['event'])
+        self.assertEqual('matched', records['node1']['event'])
+        self.assertEqual('compute', records['node1']['profile'])
+
+
+@mock.patch.object(match, 'LOG')
+@mock.patch.object(utils, 'get_facts', lambda node: [])
+@mock.patch.object(match, '_copy_state', lambda: None)
+@mock.patch.object(match, '_restore_state', autospec=True)
+@mock.patch.object(match, 'match', autospec=True)
+class TestPipeline(MatchBase):
+    def setUp(self):
+        super(TestPipeline, self).setUp()
+        self.cfg_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cfg_dir)
+        CONF.set_override('configdir', self.cfg_dir, 'edeploy')
+        self.nodes = [mock.Mock(uuid='node%d' % i, extra={},
+                                properties={}) for i in range(3)]
+        self.mock_client = mock.Mock()
+
+    def test_updates_start_before_matching_ends(self, match_mock,
+                                                restore_mock, log_mock):
+        updated = threading.Event()
+        self.mock_client.node.update.side_effect = (
+            lambda uuid, patches: updated.set())
+
+        overlapped = []
+
+        def fake_match(node, node_info, facts, profiles):
+            if node is self.nodes[-1]:
+                # The first node is updated while the last one is matched.
+                overlapped.append(updated.wait(5))
+        match_mock.side_effect = fake_match
+
+        match._match_and_update(self.mock_client, iter(self.nodes))
+        self.assertEqual([True], overlapped)
+        self.assertEqual(3, self.mock_client.node.update.call_count)
+        restore_mock.assert_called_once_with()
+
+    @mock.patch.object(utils, '_SWIFT_DEADLINES', {})
+    @mock.patch.object(stats, 'clock', autospec=True)
+    def test_swift_budget_per_batch(self, clock_mock, match_mock,
+                                    restore_mock, log_mock):
+        CONF.set_override('run_budget', 10.0, 'swift')
+
+        def get_facts(node):
+            utils._check_swift_budget('extra_hardware-' + node.uuid, 'swift')
+            return []
+        clock_mock.return_value = 100.0
+        with mock.patch.object(utils, 'get_facts', get_facts):
+            first = match._match_and_update(self.mock_client, self.nodes[:1])
+            clock_mock.return_value = 200.0
+            second = match._match_and_update(self.mock_client,
+                                             self.nodes[1:])
+        self.assertEqual((set(), set()), first)
+        self.assertEqual((set(), set()), second)
+        self.assertEqual(3, self.mock_client.node.update.call_count)
+
+    def test_state_restored_on_load_failure(self, match_mock, restore_mock,
+                                            log_mock):
+        match_mock.side_effect = [
+            None, exc.LoadFailedError('boom', '/etc/edeploy')]
+        self.assertRaises(SystemExit, match._match_and_update,
+                          self.mock_client, self.nodes)
+        restore_mock.assert_called_once_with()
+        records = journal.Journal(match._journal_path()).load()
+        self.assertNotIn('node2', records)
+
+
+class TestSpecsCache(base.BaseTest):
+    def setUp(self):
+        super(TestSpecsCache, self).setUp()
+        self.cfg_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cfg_dir)
+        self.specs_file = os.path.join(self.cfg_dir, 'hw1.specs')
+        with open(self.specs_file, 'w') as specs:
+            specs.write("[('cpu', 'logical', 'number', '4')]")
+        stats.REGISTRY.reset()
+
+    def _load(self, name):
+        sobj = match._new_state()
+        sobj._cfg_dir = self.cfg_dir
+        return match._load_profile(sobj, name).specs
+
+    @mock.patch.dict(match._SPECS_CACHE, clear=True)
+    def test_specs_reused(self):
+        expected = [('cpu', 'logical', 'number', '4')]
+        self.assertEqual(expected, self._load('hw1'))
+        self.assertEqual(expected, self._load('hw1'))
+        self.assertEqual(1, stats.REGISTRY.counters['specs.misses'])
+        self.assertEqual(1, stats.REGISTRY.counters['specs.hits'])
+
+    @mock.patch.dict(match._SPECS_CACHE, clear=True)
+    def test_specs_reloaded_when_changed(self):
+        self._load('hw1')
+        with open(self.specs_file, 'w') as specs:
+            specs.write("[('cpu', 'logical', 'number', '16')]")
+        os.utime(self.specs_file, (0, 0))
+        self.assertEqual([('cpu', 'logical', 'number', '16')],
+                         self._load('hw1'))
+
+    def test_missing_specs(self):
+        self.assertEqual(state._INVALID_SPECS, self._load('nope'))
+
+
+@mock.patch.dict(match._SPECS_CACHE, clear=True)
+class TestFindMatch(base.BaseTest):
+    def setUp(self):
+        super(TestFindMatch, self).setUp()
+        self.cfg_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cfg_dir)
+        self._write_specs('big', [('cpu', 'logical', 'number', 'ge(16)'),
+                                  ('disk', '$disk', 'size', '$size')])
+        self._write_specs('small', [('cpu', 'logical', 'number', 'lt(16)'),
+                                    ('disk', '$disk', 'size', '$size')])
+        self.sobj = match._new_state()
+        self.sobj._cfg_dir = self.cfg_dir
+        self.sobj._data = [('big', '*'), ('small', 1)]
+        self.facts = ingest.Facts([('cpu', 'logical', 'number', '8'),
+                                   ('disk', 'sda', 'size', '100')])
+        stats.REGISTRY.reset()
+
+    def _write_specs(self, name, specs):
+        with open(os.path.join(self.cfg_dir, name + '.specs'), 'w') as f:
+            f.write(repr(specs))
+
+    def test_numeric_requirements(self):
+        requirements = match._numeric_requirements(
+            [('cpu', 'logical', 'number', '$ncpus=gt(4)'),
+             ('memory', 'total', 'size', "le('2048')"),
+             ('disk', '$disk', 'size', 'gt(100)'),
+             ('cpu', 'logical', 'number', 'in(4, 8)'),
+             ('system', 'product', 'name', 'regexp(^R)')])
+        self.assertEqual(
+            [(('cpu', 'logical', 'number'), operator.gt, 4.0),
+             (('memory', 'total', 'size'), operator.le, 2048.0)],
+            requirements)
+
+    def test_profile_skipped(self):
+        self.assertEqual(
+            ('small', {'disk': 'sda', 'size': '100'}),
+            match._find_match(self.sobj, self.facts))
+        self.assertEqual(1, stats.REGISTRY.counters['match.skipped_profiles'])
+        self.assertEqual([('big', '*'), ('small', 0)], self.sobj._data)
+
+    def test_not_numbers_left_to_matcher(self):
+        facts = ingest.Facts([('cpu', 'logical', 'number', '8 cores'),
+                              ('disk', 'sda', 'size', '100')])
+        self.assertRaises(ValueError, match._find_match, self.sobj, facts)
+        self.assertEqual(0, stats.REGISTRY.counters['match.skipped_profiles'])
+
+    def test_no_match(self):
+        self.sobj._data = [('big', '*'), ('small', 0)]
+        self.assertRaisesRegexp(state.StateError, 'roles in .*: big$',
+                                match._find_match, self.sobj, self.facts)
+
+    def test_no_role_available(self):
+        self.sobj._data = [('small', 0)]
+        self.assertRaisesRegexp(state.StateError, 'No more role',
+                                match._find_match, self.sobj, self.facts)
+
+    def test_profiles_restricted(self):
+        self.assertRaisesRegexp(state.StateError, 'roles in .*: big$',
+                                match._find_match, self.sobj, self.facts,
+                                profiles=['big'])
+        self.assertEqual([('big', '*'), ('small', 1)], self.sobj._data)
+
+
+@mock.patch.object(match, 'LOG')
+class TestSelectors(MatchBase):
+    def setUp(self):
+        super(TestSelectors, self).setUp()
+        CONF.register_cli_opts(match.match_cli_opts)
+        self.nodes = [mock.Mock(uuid='node%d' % i, properties={},
+                                provision_state='available')
+                      for i in range(3)]
+        self.nodes[1].properties = {'capabilities': 'profile:compute'}
+        self.mock_client = mock.Mock()
+        self.mock_client.node.list.return_value = self.nodes
+        self.mock_client.node.get.side_effect = lambda uuid: self.nodes[
+            int(uuid[-1])]
+
+    def test_all_nodes(self, log_mock):
+        nodes, held = match._selected_nodes(self.mock_client)
+        self.assertEqual(self.nodes, list(nodes))
+        self.assertEqual([], held)
+
+    def test_nodes_by_uuid(self, log_mock):
+        nodes_file = tempfile.NamedTemporaryFile(mode='w')
+        self.addCleanup(nodes_file.close)
+        nodes_file.write('# rack 12\nnode2\n\nnode0  # again\n')
+        nodes_file.flush()
+        CONF.set_override('nodes', ['node0'])
+        CONF.set_override('nodes_file', nodes_file.name)
+        self.nodes[2].provision_state = 'active'
+        self.assertEqual(([self.nodes[0]], ['compute']),
+                         match._selected_nodes(self.mock_client))
+        # Only the node which is not listed as matchable is fetched.
+        self.mock_client.node.get.assert_called_once_with('node2')
+        self.assertTrue(log_mock.warning.called)
+
+    def test_unknown_node(self, log_mock):
+        CONF.set_override('nodes', ['node0', 'nodeX'])
+        self.assertRaisesRegexp(SystemExit, 'following nodes: nodeX$',
+                                match._selected_nodes, self.mock_client)
+
+    def test_unprofiled(self, log_mock):
+        CONF.set_override('unprofiled', True)
+        self.assertEqual(([self.nodes[0], self.nodes[2]], ['compute']),
+                         match._selected_nodes(self.mock_client))
+
+    def test_unknown_profile(self, log_mock):
+        cfg_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cfg_dir)
+        open(os.path.join(cfg_dir, 'hw1.specs'), 'w').close()
+        CONF.set_override('configdir', cfg_dir, 'edeploy')
+        CONF.set_override('profiles', ['hw1', 'nope'])
+        self.assertRaisesRegexp(SystemExit, 'no .specs file .*: nope$',
+                                match._check_profiles)
+
+    @mock.patch.object(match, '_match_and_update', autospec=True)
+    @mock.patch.object(match.time, 'sleep', autospec=True)
+    def test_watch(self, sleep_mock, match_mock, log_mock):
+        for node in self.nodes:
+            node.extra = {'hardware_swift_object': 'extra_hardware-1'}
+        CONF.set_override('nodes', ['node0', 'node1'])
+        CONF.set_override('unprofiled', True)
+        CONF.set_override('profiles', ['hw1'])
+        match_mock.return_value = set(), set()
+        sleep_mock.side_effect = KeyboardInterrupt
+        self.assertRaises(KeyboardInterrupt, match._watch, self.mock_client)
+        match_mock.assert_called_once_with(self.mock_client, [self.nodes[0]],
+                                           profiles=['hw1'], held=['compute'])
+
+
+class TestMatchMemo(base.BaseTest):
+    def setUp(self):
+        super(TestMatchMemo, self).setUp()
+        self.profile = match._Profile(
+            [('cpu', 'logical', 'number', 'ge(4)'),
+             ('network', '$eth', 'serial', '$mac'),
+             ('network', '$eth', 'ipv4', '$ipv4')])
+        stats.REGISTRY.reset()
+
+    def _facts(self, mac, ipv4, ncpus='8'):
+        return ingest.Facts([('cpu', 'logical', 'number', ncpus),
+                             ('network', 'eth0', 'serial', mac),
+                             ('network', 'eth0', 'ipv4', ipv4)])
+
+    def test_identical_hardware_matched_once(self):
+        first = self.profile.match(self._facts('99:99:99:99:99:99',
+                                               '192.168.100.12'))
+        second = self.profile.match(self._facts('11:11:11:11:11:11',
+                                                '192.168.100.13'))
+        self.assertEqual((True, {'eth': 'eth0', 'mac': '99:99:99:99:99:99',
+                                 'ipv4': '192.168.100.12'}, {}), first)
+        self.assertEqual((True, {'eth': 'eth0', 'mac': '11:11:11:11:11:11',
+                                 'ipv4': '192.168.100.13'}, {}), second)
+        self.assertEqual(1, stats.REGISTRY.counters['match_memo.misses'])
+        self.assertEqual(1, stats.REGISTRY.counters['match_memo.hits'])
+
+    def test_different_hardware(self):
+        self.profile.match(self._facts('99:99:99:99:99:99', '192.168.100.12'))
+        matched, _, _ = self.profile.match(
+            self._facts('11:11:11:11:11:11', '192.168.100.13', ncpus='2'))
+        self.assertFalse(matched)
+        self.assertEqual(2, stats.REGISTRY.counters['match_memo.misses'])
+
+    @mock.patch.object(match, '_MATCH_MEMO_SIZE', 1)
+    def test_memo_bounded(self):
+        self.profile.match(self._facts('99:99:99:99:99:99', '192.168.100.12'))
+        self.profile.match(self._facts('11:11:11:11:11:11', '192.168.100.13',
+                                       ncpus='2'))
+        self.assertEqual(1, len(self.profile._memo))
+
+
+@mock.patch.object(match, '_match_and_update', autospec=True)
+@mock.patch.object(match.time, 'sleep', autospec=True)
+class TestWatch(MatchBase):
+    def setUp(self):
+        super(TestWatch, self).setUp()
+        CONF.register_cli_opts(match.match_cli_opts)
+        self.node.extra = {'hardware_swift_object': 'extra_hardware-1'}
+        self.other = mock.Mock(uuid='other', provision_state='manageable',
+                               extra={}, properties={})
+        self.mock_client = mock.Mock()
+
+    def _watch(self, *polls):
+        self.mock_client.node.list.side_effect = polls
+        self.assertRaises(StopIteration, match._watch, self.mock_client)
+
+    def test_only_new_nodes_matched(self, sleep_mock, match_mock):
+        match_mock.return_value = set(), set()
+        self._watch([self.other], [self.node, self.other], [self.node])
+        match_mock.assert_called_once_with(self.mock_client, [self.node],
+                                           profiles=None, held=[])
+        sleep_mock.assert_called_with(10)
+
+    def test_changed_object_rematched(self, sleep_mock, match_mock):
+        match_mock.return_value = set(), set()
+        changed = mock.Mock(uuid=self.uuid, provision_state='available',
+                            extra={'hardware_swift_object': 'extra_new'},
+                            properties={})
+        self._watch([self.node], [self.node], [changed])
+        self.assertEqual(
+            [mock.call(self.mock_client, [self.node], profiles=None,
+                       held=[]),
+             mock.call(self.mock_client, [changed], profiles=None,
+                       held=[])],
+            match_mock.call_args_list)
+
+    def test_node_back_in_matchable_state(self, sleep_mock, match_mock):
+        match_mock.return_value = set(), set()
+        self._watch([self.node], [], [self.node])
+        self.assertEqual(2, match_mock.call_count)
+
+    @mock.patch.object(match, '_specs_version', autospec=True)
+    def test_failed_retried_on_specs_change(self, version_mock, sleep_mock,
+                                            match_mock):
+        match_mock.return_value = set([self.uuid]), set()
+        version_mock.side_effect = [1, 1, 2]
+        self._watch([self.node], [self.node], [self.node])
+        self.assertEqual(2, match_mock.call_count)
+
+    def test_update_failed_retried(self, sleep_mock, match_mock):
+        match_mock.side_effect = [(set(), set([self.uuid])),
+                                  (set(), set())]
+        self._watch([self.node], [self.node], [self.node])
+        self.assertEqual(
+            [mock.call(self.mock_client, [self.node], profiles=None,
+                       held=[])] * 2,
+            match_mock.call_args_list)
+
+    def test_metrics_per_batch(self, sleep_mock, match_mock):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'ahc_match.prom')
+        CONF.set_override('metrics_file', path, 'match')
+
+        def fake_match(ironic_client, nodes, profiles, held):
+            stats.incr('nodes.matched', len(nodes))
+            return set(), set()
+        match_mock.side_effect = fake_match
+        changed = mock.Mock(uuid=self.uuid, provision_state='available',
+                            extra={'hardware_swift_object': 'extra_new'},
+                            properties={})
+        self._watch([self.node], [changed])
+        with open(path) as metrics:
+            lines = metrics.read().splitlines()
+        self.assertIn('ahc_match_nodes_matched 1.0', lines)
+        self.assertIn('# TYPE ahc_match_run_duration_seconds gauge', lines)
+
+    @mock.patch.object(match.cfg, 'ConfigParser', autospec=True)
+    @mock.patch.object(utils, 'get_ironic_client', autospec=True)
+    def test_main_interrupted(self, ic_mock, cfg_mock, sleep_mock,
+                              match_mock):
+        match_mock.return_value = set(), set()
+        ic_mock.return_value = self.mock_client
+        self.mock_client.node.list.return_value = [self.node]
+        sleep_mock.side_effect = KeyboardInterrupt
+        match.main(args=['--watch'])
+        match_mock.assert_called_once_with(self.mock_client, [self.node],
+                                           profiles=None, held=[])
+
+
+@mock.patch.object(match, 'LOG')
+@mock.patch.object(utils, 'get_facts', lambda node: [])
+@mock.patch.dict(match._SPECS_CACHE, clear=True)
+class TestProfileLimits(MatchBase):
+    def setUp(self):
+        super(TestProfileLimits, self).setUp()
+        CONF.register_cli_opts(match.match_cli_opts)
+        self.cfg_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cfg_dir)
+        CONF.set_override('configdir', self.cfg_dir, 'edeploy')
+        CONF.set_override('lockname', os.path.join(self.cfg_dir, 'lock'),
+                          'edeploy')
+        self.state = "[('control', 1), ('compute', '*')]"
+        with open(os.path.join(self.cfg_dir, 'state'), 'w') as state_file:
+            state_file.write(self.state)
+        for name in ('control', 'compute'):
+            with open(os.path.join(self.cfg_dir, name + '.specs'),
+                      'w') as specs:
+                specs.write('[]')
+        self.mock_client = mock.Mock()
+        self.mock_client.node.update.side_effect = self._update
+        self.profiles = {}
+
+    def _node(self, uuid):
+        return mock.Mock(uuid=uuid, provision_state='available',
+                         extra={'hardware_swift_object': 'extra-' + uuid},
+                         properties={})
+
+    def _update(self, uuid, patches):
+        # Only the capabilities are looked at by the next batches.
+        for patch in patches:
+            if patch['path'] == '/properties/capabilities':
+                self.profiles[uuid] = patch['value']
+
+    def _profiles(self):
+        return dict((uuid, utils.capabilities_to_dict(caps)['profile'])
+                    for uuid, caps in self.profiles.items())
+
+    def _list(self, *polls):
+        """Return the nodes of each poll, with their current profile."""
+        polls = list(polls)
+
+        def list_nodes(**kwargs):
+            if not polls:
+                raise StopIteration()
+            nodes = [self._node(uuid) for uuid in polls.pop(0)]
+            for node in nodes:
+                if node.uuid in self.profiles:
+                    node.properties = {
+                        'capabilities': self.profiles[node.uuid]}
+            return nodes
+        return list_nodes
+
+    @mock.patch.object(match.time, 'sleep', autospec=True)
+    def test_watch_batches(self, sleep_mock, log_mock):
+        self.mock_client.node.list.side_effect = self._list(
+            ['node0'], ['node0', 'node1'])
+        self.assertRaises(StopIteration, match._watch, self.mock_client)
+        # node0 holds the only control profile when node1 is matched.
+        self.assertEqual({'node0': 'control', 'node1': 'compute'},
+                         self._profiles())
+        with open(os.path.join(self.cfg_dir, 'state')) as state_file:
+            self.assertEqual(self.state, state_file.read())
+
+    @mock.patch.object(match.cfg, 'ConfigParser', autospec=True)
+    @mock.patch.object(utils, 'get_ironic_client', autospec=True)
+    def test_targeted_runs(self, ic_mock, cfg_mock, log_mock):
+        ic_mock.return_value = self.mock_client
+        self.mock_client.node.list.side_effect = self._list(
+            ['node0', 'node1'], ['node0', 'node1'])
+        for uuid in ('node0', 'node1'):
+            match.main(args=['--node', uuid])
+            # Parse the command line of the next run.
+            CONF.clear()
+        self.assertEqual({'node0': 'control', 'node1': 'compute'},
+                         self._profiles())
+        self.assertFalse(self.mock_client.node.get.called)
@@ -0,0 +1,78 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ahc_tools import projection
+from ahc_tools.test import base
+
+SPECS = [('cpu', 'logical', 'number', 'ge(4)'),
+         ('network', '$eth', 'serial', '$mac'),
+         ('network', '$eth', 'ipv4', '$ipv4')]
+
+
+def facts(mac, ipv4):
+    return [('cpu', 'logical', 'number', '8'),
+            ('cpu', 'logical_0', 'bogomips', '4199.99'),
+            ('network', 'eth0', 'serial', mac),
+            ('network', 'eth0', 'ipv4', ipv4),
+            ('system', 'product', 'serial', 'ABC123')]
+
+
+class TestProjector(base.BaseTest):
+    def setUp(self):
+        super(TestProjector, self).setUp()
+        self.projector = projection.Projector(SPECS)
+
+    def test_project(self):
+        projected, values = self.projector.project(
+            facts('99:99:99:99:99:99', '192.168.100.12'))
+        self.assertEqual((('cpu', 'logical', 'number', '8'),
+                          ('network', '\x000', 'serial', '\x001'),
+                          ('network', '\x000', 'ipv4', '\x002')),
+                         projected)
+        self.assertEqual({'\x000': 'eth0', '\x001': '99:99:99:99:99:99',
+                          '\x002': '192.168.100.12'}, values)
+
+    def test_same_hardware_same_projection(self):
+        first, _ = self.projector.project(facts('99:99:99:99:99:99',
+                                                '192.168.100.12'))
+        second, _ = self.projector.project(facts('11:11:11:11:11:11',
+                                                 '192.168.100.13'))
+        self.assertEqual(first, second)
+
+    def test_equal_values_share_placeholder(self):
+        first, _ = self.projector.project(facts('same', 'same'))
+        second, _ = self.projector.project(facts('one', 'other'))
+        self.assertEqual(first[1][3], first[2][3])
+        self.assertNotEqual(first, second)
+
+    def test_value_compared_with_literal_not_masked(self):
+        projector = projection.Projector(
+            SPECS + [('network', 'eth0', 'netmask', '$netmask')])
+        projected, _ = projector.project(facts('99:99:99:99:99:99',
+                                               '192.168.100.12'))
+        self.assertEqual(('network', 'eth0', 'serial', '\x000'),
+                         projected[1])
+
+    def test_helper_field_not_masked(self):
+        projector = projection.Projector(
+            [('network', '$eth', 'serial', 'regexp(^99)')])
+        projected, _ = projector.project(facts('99:99:99:99:99:99',
+                                               '192.168.100.12'))
+        self.assertEqual((('network', '\x000', 'serial',
+                           '99:99:99:99:99:99'),), projected)
+
+    def test_unmask(self):
+        self.assertEqual({'eth': 'eth0', 'profile': 'compute'},
+                         projection.unmask({'eth': '\x000',
+                                            'profile': 'compute'},
+                                           {'\x000': 'eth0'}))
@@ -11,6 +11,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import shutil
+import tempfile
+
 import mock
 
 from hardware.cardiff import cardiff
@@ -18,6 +22,7 @@ from hardware.cardiff import compare_sets
 from hardware.cardiff import utils
 from oslo_config import cfg
 
+from ahc_tools import archive
 from ahc_tools import report
 from ahc_tools.test import base
 
@@ -90,3 +95,66 @@ class TestMain(ReportBase):
     @mock.patch.object(report, 'print_report', autospec=True)
     def test_no_exceptions(self, print_mock, facts_mock, ic_mock, cfg_mock):
         report.main(args=['-f'])
+
+    @mock.patch.object(report, 'print_report', autospec=True)
+    def test_facts_archive(self, print_mock, facts_mock, ic_mock, cfg_mock):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'fleet.jsonl.gz')
+        with archive.ArchiveWriter(path) as writer:
+            writer.add('node0', [('system', 'product', 'uuid', 'node0')])
+        report.main(args=['-f', '--facts-archive', path])
+        print_mock.assert_called_once_with(
+            [[('system', 'product', 'uuid', 'node0')]])
+        self.assertFalse(ic_mock.called)
+        self.assertFalse(facts_mock.called)
+
+    def test_missing_facts_archive(self, facts_mock, ic_mock, cfg_mock):
+        self.assertRaisesRegexp(SystemExit, 'facts archive', report.main,
+                                args=['-f', '--facts-archive', '/nonexistent'])
+
+
+@mock.patch.object(report, 'LOG')
+@mock.patch.object(report.utils, 'get_ironic_nodes', autospec=True)
+@mock.patch.object(report.utils, 'get_ironic_client', autospec=True)
+@mock.patch.object(report.utils, 'get_facts', autospec=True)
+class TestSites(ReportBase):
+    def setUp(self):
+        super(TestSites, self).setUp()
+        CONF.set_override('unique_id', 'serial')
+        self.nodes = {'ironic_east': [mock.Mock(uuid='e1')],
+                      'ironic_west': [mock.Mock(uuid='w1'),
+                                      mock.Mock(uuid='w2')]}
+
+    def _facts(self, node, swift_group):
+        return [('system', 'product', 'serial', 'S1'),
+                ('system', 'product', 'uuid', node.uuid),
+                ('swift', 'section', 'name', swift_group)]
+
+    def test_sites(self, facts_mock, ic_mock, nodes_mock, log_mock):
+        ic_mock.side_effect = lambda group: group
+        nodes_mock.side_effect = lambda group: self.nodes[group]
+        facts_mock.side_effect = self._facts
+        facts = report.get_sites_facts(['east', 'west'])
+        self.assertEqual(3, len(facts))
+        self.assertEqual([('system', 'product', 'serial', 'east/S1'),
+                          ('system', 'product', 'uuid', 'e1'),
+                          ('swift', 'section', 'name', 'swift_east')],
+                         facts[0])
+        self.assertEqual(('system', 'product', 'serial', 'west/S1'),
+                         facts[2][0])
+        self.assertEqual('swift_west', facts[2][2][3])
+        self.assertEqual(8, CONF.ironic_west.max_concurrency)
+
+    def test_site_failed(self, facts_mock, ic_mock, nodes_mock, log_mock):
+        ic_mock.side_effect = lambda group: group
+        nodes_mock.side_effect = lambda group: self.nodes[group]
+
+        def get_facts(node, swift_group):
+            if swift_group == 'swift_east':
+                raise Exception('boom')
+            return []
+        facts_mock.side_effect = get_facts
+        self.assertRaisesRegexp(SystemExit, 'sites: east$',
+                                report.get_sites_facts, ['east', 'west'])
+        self.assertEqual(1, log_mock.error.call_count)
@@ -0,0 +1,127 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from hardware.cardiff import check
+import mock
+from oslo_config import cfg
+
+from ahc_tools import report
+from ahc_tools import report_cache
+from ahc_tools import stats
+from ahc_tools.test import base
+
+CONF = cfg.CONF
+
+
+def _host(uuid, model='Xeon', loops='1000', mac='99:99:99:99:99:99'):
+    return [('system', 'product', 'uuid', uuid),
+            ('cpu', 'physical_0', 'product', model),
+            ('cpu', 'logical', 'number', '2'),
+            ('cpu', 'logical', 'loops_per_sec', str(2 * int(loops))),
+            ('cpu', 'logical_0', 'loops_per_sec', loops),
+            ('cpu', 'logical_1', 'loops_per_sec', loops),
+            ('network', 'eth0', 'serial', mac),
+            ('network', 'eth0', 'size', '1000000000'),
+            ('network', 'bandwidth', 'eth0', '940'),
+            ('network', 'requests_per_sec', 'eth0', '11000')]
+
+
+def _capture(func, *args):
+    """Return what func prints."""
+    with mock.patch.object(sys, 'stdout', StringIO()) as stdout:
+        func(*args)
+        return stdout.getvalue()
+
+
+class TestReportCache(base.BaseTest):
+    def setUp(self):
+        super(TestReportCache, self).setUp()
+        CONF.register_cli_opts(report.report_cli_opts)
+        CONF.set_override('full', True)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, 'report.cache')
+        self.facts = [_host('node0', loops='1000'),
+                      _host('node1', loops='1010'),
+                      _host('node2', model='Opteron', loops='900')]
+        stats.REGISTRY.reset()
+
+    def _report(self, cache_file):
+        CONF.set_override('cache_file', cache_file, 'report')
+        return _capture(report.print_report, self.facts)
+
+    def test_same_report_as_cardiff(self):
+        expected = self._report(None)
+        self.assertIn('Group 1 : Checking CPU perf', expected)
+        self.assertEqual(expected, self._report(self.path))
+        self.assertEqual(expected, self._report(self.path))
+
+    def test_only_changes_recomputed(self):
+        self._report(self.path)
+        self.assertEqual(3, stats.REGISTRY.counters[
+            'report_cache.host_misses'])
+        stats.REGISTRY.reset()
+
+        self.facts[1] = _host('node1', loops='2000')
+        self._report(self.path)
+        self.assertEqual(1, stats.REGISTRY.counters[
+            'report_cache.host_misses'])
+        self.assertEqual(2, stats.REGISTRY.counters[
+            'report_cache.host_hits'])
+        # Only the group of node0 and node1 changed.
+        self.assertEqual(4, stats.REGISTRY.counters[
+            'report_cache.outliers_misses'])
+        self.assertEqual(4, stats.REGISTRY.counters[
+            'report_cache.outliers_hits'])
+
+    def test_changed_group_computed_from_samples(self):
+        self._report(self.path)
+        self.facts[1] = _host('node1', loops='2000')
+        expected = self._report(None)
+        with mock.patch.object(check, 'cpu_perf') as cpu_perf_mock:
+            self.assertEqual(expected, self._report(self.path))
+        self.assertFalse(cpu_perf_mock.called)
+        self.assertIn('logical_0    : Group performance : UNSTABLE', expected)
+
+    def test_removed_nodes_dropped(self):
+        self._report(self.path)
+        del self.facts[2]
+        self._report(self.path)
+        with open(self.path) as cache_file:
+            data = json.load(cache_file)
+        self.assertEqual(2, len(data['hosts']))
+        self.assertEqual(['node0', 'node1'],
+                         sorted(host['host']
+                                for host in data['hosts'].values()))
+
+    def test_other_unique_id_not_reused(self):
+        self._report(self.path)
+        cache = report_cache.ReportCache(self.path, 'serial')
+        cache.load()
+        self.assertEqual({}, cache.hosts)
+
+    def test_corrupted_cache_ignored(self):
+        with open(self.path, 'w') as cache_file:
+            cache_file.write('{"hosts": ')
+        self.assertEqual(self._report(None), self._report(self.path))
@@ -0,0 +1,154 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pstats
+import shutil
+import tempfile
+
+import mock
+
+from ahc_tools import stats
+from ahc_tools.test import base
+
+
+class TestRegistry(base.BaseTest):
+    def setUp(self):
+        super(TestRegistry, self).setUp()
+        self.registry = stats.Registry()
+
+    def test_percentile(self):
+        values = [float(v) for v in range(1, 101)]
+        self.assertEqual(51.0, stats.percentile(values, 50))
+        self.assertEqual(90.0, stats.percentile(values, 90))
+        self.assertEqual(100.0, stats.percentile(values, 100))
+        self.assertEqual(0.0, stats.percentile([], 50))
+
+    @mock.patch.object(stats, 'clock', autospec=True)
+    def test_timer(self, clock_mock):
+        clock_mock.side_effect = [10.0, 10.5]
+        with self.registry.timer('swift.get_object'):
+            pass
+        self.assertEqual([0.5], self.registry.timings['swift.get_object'])
+
+    def test_timer_records_on_exception(self):
+        def boom():
+            with self.registry.timer('ironic.update'):
+                raise ValueError('boom')
+        self.assertRaises(ValueError, boom)
+        self.assertEqual(1, len(self.registry.timings['ironic.update']))
+
+    def test_as_dict(self):
+        self.registry.incr('nodes.matched')
+        self.registry.incr('nodes.matched', 2)
+        for seconds in (0.1, 0.3, 0.2):
+            self.registry.observe('match.find_match', seconds)
+        data = self.registry.as_dict()
+        self.assertEqual({'nodes.matched': 3}, data['counters'])
+        phase = data['phases']['match.find_match']
+        self.assertEqual(3, phase['count'])
+        self.assertAlmostEqual(0.6, phase['total'])
+        self.assertEqual(0.2, phase['p50'])
+        self.assertEqual(0.3, phase['max'])
+
+    def test_summary(self):
+        self.registry.incr('nodes.listed', 4)
+        self.registry.observe('ironic.list', 0.25)
+        lines = self.registry.summary()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].startswith('ironic.list'))
+        self.assertIn('250.00', lines[1])
+        self.assertTrue(lines[2].startswith('nodes.listed'))
+
+
+@mock.patch.object(stats, 'LOG')
+class TestRun(base.BaseTest):
+    def setUp(self):
+        super(TestRun, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_summary_logged_on_exit(self, log_mock):
+        stats.incr('stale')
+        with stats.run():
+            stats.incr('nodes.matched')
+        self.assertNotIn('stale', stats.REGISTRY.counters)
+        self.assertIn('total', stats.REGISTRY.timings)
+        self.assertTrue(log_mock.info.called)
+
+    def test_summary_logged_on_exit_call(self, log_mock):
+        def run():
+            with stats.run():
+                raise SystemExit()
+        self.assertRaises(SystemExit, run)
+        self.assertTrue(log_mock.info.called)
+
+    def test_profile_out(self, log_mock):
+        profile_out = os.path.join(self.tmpdir, 'ahc.prof')
+        with stats.run(profile_out):
+            sorted(range(10))
+        self.assertTrue(pstats.Stats(profile_out).total_calls > 0)
+
+
+class TestPrometheus(base.BaseTest):
+    def setUp(self):
+        super(TestPrometheus, self).setUp()
+        self.registry = stats.Registry()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_lines(self):
+        self.registry.incr('nodes.patched', 3)
+        self.registry.incr('specs.hits', 3)
+        self.registry.incr('specs.misses', 1)
+        self.registry.observe('total', 12.5)
+        for seconds in (0.004, 0.02, 0.02, 45.0):
+            self.registry.observe('swift.get_object', seconds)
+        lines = stats.prometheus_lines(self.registry, 'ahc_match')
+        self.assertIn('ahc_match_last_run_success 1.0', lines)
+        self.assertIn('ahc_match_run_duration_seconds 12.5', lines)
+        self.assertIn('ahc_match_nodes_patched 3.0', lines)
+        self.assertIn('ahc_match_specs_hit_ratio 0.75', lines)
+        self.assertIn('# TYPE ahc_match_swift_get_object_seconds histogram',
+                      lines)
+        self.assertIn('ahc_match_swift_get_object_seconds_bucket{le="0.005"}'
+                      ' 1', lines)
+        self.assertIn('ahc_match_swift_get_object_seconds_bucket{le="0.025"}'
+                      ' 3', lines)
+        self.assertIn('ahc_match_swift_get_object_seconds_bucket{le="30.0"}'
+                      ' 3', lines)
+        self.assertIn('ahc_match_swift_get_object_seconds_bucket{le="+Inf"}'
+                      ' 4', lines)
+        self.assertIn('ahc_match_swift_get_object_seconds_count 4', lines)
+        self.assertNotIn('ahc_match_total_seconds_count 1', lines)
+
+    def test_write_textfile(self):
+        path = os.path.join(self.tmpdir, 'ahc_match.prom')
+        self.registry.incr('nodes.listed', 2)
+        stats.write_textfile(path, self.registry, 'ahc_match', success=False)
+        with open(path) as prom:
+            content = prom.read()
+        self.assertIn('ahc_match_last_run_success 0.0\n', content)
+        self.assertIn('ahc_match_nodes_listed 2.0\n', content)
+        self.assertEqual(['ahc_match.prom'], os.listdir(self.tmpdir))
+
+    @mock.patch.object(stats, 'LOG')
+    def test_run_writes_metrics_on_failure(self, log_mock):
+        path = os.path.join(self.tmpdir, 'ahc_report.prom')
+
+        def run():
+            with stats.run(metrics_file=path, prefix='ahc_report'):
+                raise SystemExit(1)
+        self.assertRaises(SystemExit, run)
+        with open(path) as prom:
+            self.assertIn('ahc_report_last_run_success 0.0', prom.read())
@@ -14,8 +14,11 @@
 
 # Mostly copied from ironic/tests/test_swift.py
 
+import gzip
+import io
 import json
 import mock
+import zlib
 
 from oslo_config import cfg
 from swiftclient import client as swift_client
@@ -23,6 +26,7 @@ from swiftclient import exceptions as swift_exception
 
 from ahc_tools.common import swift
 from ahc_tools import exc
+from ahc_tools import stats
 from ahc_tools.test import base
 
 
@@ -57,6 +61,13 @@ class SwiftTestCase(base.BaseTest):
                   'auth_version': '2'}
         connection_mock.assert_called_once_with(**params)
 
+    def test___init___session(self, connection_mock):
+        session = mock.Mock()
+        swift.SwiftAPI(session=session)
+        connection_mock.assert_called_once_with(
+            retries=2, session=session,
+            os_options={'endpoint_type': 'internal'})
+
     def test_get_object(self, connection_mock):
         swiftapi = swift.SwiftAPI(user=CONF.swift.username,
                                   tenant_name=CONF.swift.tenant_name,
@@ -67,13 +78,13 @@ class SwiftTestCase(base.BaseTest):
 
         facts = [['this', 'is', 'a', 'fact'],
                  ['this', 'is', 'another', 'fact']]
-        expected_obj = json.dumps(facts)
-        connection_obj_mock.get_object.return_value = ('foo', expected_obj)
+        expected_obj = json.dumps(facts).encode('utf-8')
+        connection_obj_mock.get_object.return_value = ({}, [expected_obj])
 
         swift_obj = swiftapi.get_object('object')
 
         connection_obj_mock.get_object.assert_called_once_with(
-            'ironic-discoverd', 'object')
+            'ironic-discoverd', 'object', resp_chunk_size=swift.CHUNK_SIZE)
         self.assertEqual(expected_obj, swift_obj)
 
     def test_get_object_fails(self, connection_mock):
@@ -87,4 +98,105 @@ class SwiftTestCase(base.BaseTest):
         self.assertRaises(exc.SwiftDownloadError, swiftapi.get_object,
                           'object')
         connection_obj_mock.get_object.assert_called_once_with(
-            'ironic-discoverd', 'object')
+            'ironic-discoverd', 'object', resp_chunk_size=swift.CHUNK_SIZE)
+
+
+def _chunks(data, size=7):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as gzip_file:
+        gzip_file.write(data)
+    return buf.getvalue()
+
+
+@mock.patch.object(swift_client, 'Connection', autospec=True)
+class CompressionTestCase(base.BaseTest):
+
+    def setUp(self):
+        super(CompressionTestCase, self).setUp()
+        self.data = json.dumps([['cpu', 'logical', 'number', '8']] *
+                               50).encode('utf-8')
+
+    def _get_object(self, connection_mock, headers, body):
+        connection_mock.return_value.get_object.return_value = (
+            headers, _chunks(body))
+        return swift.SwiftAPI(session=mock.Mock()).get_object('object')
+
+    def test_gzip_content_encoding(self, connection_mock):
+        self.assertEqual(self.data, self._get_object(
+            connection_mock, {'content-encoding': 'gzip'},
+            _gzip(self.data)))
+
+    def test_gzip_magic(self, connection_mock):
+        self.assertEqual(self.data, self._get_object(
+            connection_mock, {}, _gzip(self.data)))
+
+    def test_zlib_magic(self, connection_mock):
+        self.assertEqual(self.data, self._get_object(
+            connection_mock, {}, zlib.compress(self.data)))
+
+    def test_corrupted(self, connection_mock):
+        self.assertRaises(exc.SwiftDownloadError, self._get_object,
+                          connection_mock, {'content-encoding': 'gzip'},
+                          self.data)
+
+    def test_check_stops_download(self, connection_mock):
+        body = mock.MagicMock()
+        body.__iter__.return_value = iter(_chunks(self.data))
+        check = mock.Mock(side_effect=[None, exc.SwiftDownloadError(
+            'Took too long', 'object')])
+        connection_mock.return_value.get_object.return_value = ({}, body)
+        swiftapi = swift.SwiftAPI(session=mock.Mock())
+        self.assertRaisesRegexp(exc.SwiftDownloadError, 'Took too long',
+                                swiftapi.get_object, 'object', check=check)
+        self.assertEqual(2, check.call_count)
+        body.close.assert_called_once_with()
+
+    def test_compress_object(self, connection_mock):
+        connection_obj_mock = connection_mock.return_value
+        headers = {'content-type': 'application/json',
+                   'content-length': str(len(self.data)),
+                   'x-object-meta-node': 'node0',
+                   'etag': 'etag'}
+        connection_obj_mock.get_object.return_value = (headers, self.data)
+        swiftapi = swift.SwiftAPI(session=mock.Mock())
+
+        before, after = swiftapi.compress_object('object')
+
+        self.assertEqual(len(self.data), before)
+        [call] = connection_obj_mock.put_object.call_args_list
+        container, name, body = call[0]
+        self.assertEqual(('ironic-discoverd', 'object'), (container, name))
+        self.assertEqual(after, len(body))
+        self.assertEqual({'content-type': 'application/json',
+                          'x-object-meta-node': 'node0',
+                          'content-encoding': 'gzip'},
+                         call[1]['headers'])
+
+        connection_obj_mock.get_object.return_value = (
+            {}, [body])
+        self.assertEqual(self.data, swiftapi.get_object('object'))
+
+    def test_compress_object_compressed(self, connection_mock):
+        connection_obj_mock = connection_mock.return_value
+        body = _gzip(self.data)
+        connection_obj_mock.get_object.return_value = ({}, body)
+        swiftapi = swift.SwiftAPI(session=mock.Mock())
+        self.assertEqual((len(body), None),
+                         swiftapi.compress_object('object'))
+        self.assertFalse(connection_obj_mock.put_object.called)
+
+    def test_timeout(self, connection_mock):
+        from requests import exceptions as requests_exceptions
+
+        connection_mock.return_value.get_object.side_effect = (
+            requests_exceptions.ReadTimeout('read timed out'))
+        stats.REGISTRY.reset()
+        swiftapi = swift.SwiftAPI(session=mock.Mock(), idle_timeout=5.0)
+        self.assertRaisesRegexp(exc.SwiftDownloadError, 'Timed out',
+                                swiftapi.get_object, 'object')
+        self.assertEqual(1, stats.REGISTRY.counters['swift.timeouts'])
+        self.assertEqual(5.0, connection_mock.call_args[1]['timeout'])
@@ -11,16 +11,52 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import json
 import mock
+import threading
 
+from ironicclient import client as ironic_client
 from ironicclient.exc import AmbiguousAuthSystem
+from swiftclient import client as swift_client
 
+from ahc_tools import conf
+from ahc_tools import exc
 from ahc_tools.test import base
 from ahc_tools import utils
 
 
+class SlowBody(object):
+    """Body of an object whose chunks arrive at the given clock times."""
+
+    def __init__(self, clock_mock, times):
+        self.clock_mock = clock_mock
+        self.times = times
+        self.received = 0
+        self.closed = False
+
+    def __iter__(self):
+        for now in self.times:
+            self.clock_mock.return_value = now
+            self.received += 1
+            yield b'[]' if self.received == 1 else b' '
+
+    def close(self):
+        self.closed = True
+
+
 class TestGetFacts(base.BaseTest):
+    def setUp(self):
+        super(TestGetFacts, self).setUp()
+        patcher = mock.patch.object(utils, '_SWIFT_APIS',
+                                    collections.defaultdict(list))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(utils.keystone, 'get_session',
+                                    autospec=True)
+        self.session_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
     @mock.patch.object(utils.swift, 'SwiftAPI', autospec=True)
     def test_facts(self, swift_mock):
         swift_conn = swift_mock.return_value
@@ -34,7 +70,129 @@ class TestGetFacts(base.BaseTest):
 
         facts = utils.get_facts(node)
         self.assertEqual(expected, facts)
-        swift_conn.get_object.assert_called_once_with(name)
+        swift_conn.get_object.assert_called_once_with(name,
+                                                      'ironic-discoverd',
+                                                      check=mock.ANY)
+        self.assertIs(self.session_mock.return_value,
+                      swift_mock.call_args[1]['session'])
+
+    @mock.patch.object(utils.swift, 'SwiftAPI', autospec=True)
+    def test_swift_api_reused(self, swift_mock):
+        swift_api = utils.get_swift_api()
+        utils.release_swift_api(swift_api)
+        self.assertIs(swift_api, utils.get_swift_api())
+        self.assertEqual(1, swift_mock.call_count)
+
+    @mock.patch.object(utils.swift, 'SwiftAPI', autospec=True)
+    def test_swift_api_not_shared(self, swift_mock):
+        swift_mock.side_effect = [mock.Mock(), mock.Mock()]
+        self.assertIsNot(utils.get_swift_api(), utils.get_swift_api())
+        self.assertEqual(2, swift_mock.call_count)
+
+    @mock.patch.object(utils.swift, 'SwiftAPI', autospec=True)
+    def test_swift_api_released_on_error(self, swift_mock):
+        swift_mock.return_value.get_object.side_effect = (
+            exc.SwiftDownloadError('boom', 'name', 503))
+        self.assertRaises(exc.SwiftDownloadError,
+                          utils._get_swift_facts, 'name')
+        self.assertEqual([swift_mock.return_value],
+                         utils._SWIFT_APIS['swift'])
+
+    @mock.patch.object(utils.swift, 'SwiftAPI', autospec=True)
+    def test_swift_idle_timeout(self, swift_mock):
+        utils.CONF.set_override('idle_timeout', 5.0, 'swift')
+        utils.get_swift_api()
+        self.assertEqual(5.0, swift_mock.call_args[1]['idle_timeout'])
+
+    @mock.patch.object(utils.swift, 'SwiftAPI', autospec=True)
+    def test_swift_site_options(self, swift_mock):
+        conf.register_site_opts('east')
+        utils.CONF.set_override('max_retries', 7, 'swift_east')
+        utils.CONF.set_override('idle_timeout', 3.0, 'swift_east')
+        utils.get_swift_api('swift_east')
+        self.assertEqual(7, swift_mock.call_args[1]['retries'])
+        self.assertEqual(3.0, swift_mock.call_args[1]['idle_timeout'])
+
+    @mock.patch.object(utils, '_SWIFT_DEADLINES', {})
+    @mock.patch.object(utils.stats, 'clock', autospec=True)
+    @mock.patch.object(utils.swift, 'SwiftAPI', autospec=True)
+    def test_swift_run_budget(self, swift_mock, clock_mock):
+        utils.CONF.set_override('run_budget', 10.0, 'swift')
+        swift_mock.return_value.get_object.return_value = '[]'
+        clock_mock.return_value = 100.0
+        utils._get_swift_facts('name')
+        clock_mock.return_value = 109.0
+        utils._get_swift_facts('name')
+        clock_mock.return_value = 111.0
+        self.assertRaisesRegexp(exc.SwiftDownloadError, 'budget',
+                                utils._get_swift_facts, 'name')
+        self.assertEqual(2, swift_mock.return_value.get_object.call_count)
+
+    def _slow_download(self, connection_mock, clock_mock, times):
+        clock_mock.return_value = times[0]
+        body = SlowBody(clock_mock, times[1:])
+        connection_mock.return_value.get_object.return_value = ({}, body)
+        return body
+
+    @mock.patch.object(utils, '_SWIFT_DEADLINES', {})
+    @mock.patch.object(utils.stats, 'clock', autospec=True)
+    @mock.patch.object(swift_client, 'Connection', autospec=True)
+    def test_swift_request_timeout(self, connection_mock, clock_mock):
+        utils.CONF.set_override('request_timeout', 10.0, 'swift')
+        utils.stats.REGISTRY.reset()
+        body = self._slow_download(connection_mock, clock_mock,
+                                   [100.0, 105.0, 109.0, 111.0, 120.0])
+        self.assertRaisesRegexp(exc.SwiftDownloadError,
+                                'more than 10.0 seconds',
+                                utils._get_swift_facts, 'name')
+        self.assertEqual(3, body.received)
+        self.assertTrue(body.closed)
+        self.assertEqual(1, utils.stats.REGISTRY.counters['swift.timeouts'])
+
+        # The timeout applies to each download.
+        self._slow_download(connection_mock, clock_mock,
+                            [200.0, 205.0, 209.0])
+        self.assertEqual([], utils._get_swift_facts('name'))
+
+    @mock.patch.object(utils, '_SWIFT_DEADLINES', {})
+    @mock.patch.object(utils.stats, 'clock', autospec=True)
+    @mock.patch.object(swift_client, 'Connection', autospec=True)
+    def test_swift_run_budget_while_downloading(self, connection_mock,
+                                                clock_mock):
+        utils.CONF.set_override('run_budget', 10.0, 'swift')
+        body = self._slow_download(connection_mock, clock_mock,
+                                   [100.0, 101.0, 111.0, 112.0])
+        self.assertRaisesRegexp(exc.SwiftDownloadError, 'budget',
+                                utils._get_swift_facts, 'name')
+        self.assertEqual(2, body.received)
+        self.assertTrue(body.closed)
+
+    def test_swift_cancelled(self):
+        cancel = threading.Event()
+        check = utils._swift_check('name', 'swift', utils.stats.clock(),
+                                   cancel)
+        check()
+        cancel.set()
+        self.assertRaisesRegexp(exc.SwiftDownloadError, 'Cancelled', check)
+
+    @mock.patch.object(utils, '_SWIFT_LATENCIES', collections.defaultdict(
+        utils.concurrency.LatencyWindow))
+    @mock.patch.object(utils.concurrency, 'hedged', autospec=True)
+    @mock.patch.object(utils.swift, 'SwiftAPI', autospec=True)
+    def test_swift_hedged(self, swift_mock, hedged_mock):
+        utils.CONF.set_override('hedge_percentile', 90, 'swift')
+        swift_mock.return_value.get_object.return_value = '[]'
+        for _ in range(utils.concurrency.LATENCY_MIN_SAMPLES):
+            utils._get_swift_facts('name')
+        self.assertFalse(hedged_mock.called)
+        hedged_mock.return_value = '[]'
+        utils._get_swift_facts('name')
+        self.assertEqual(1, hedged_mock.call_count)
+        self.assertEqual(utils._SWIFT_LATENCIES['swift'].percentile(90),
+                         hedged_mock.call_args[0][2])
+        # The download left running is cancelled once hedged returns.
+        self.assertIs(hedged_mock.call_args[0][3],
+                      hedged_mock.call_args[0][1].args[2])
 
     def test_no_facts(self):
         node = mock.Mock(extra={})
@@ -44,16 +202,31 @@ class TestGetFacts(base.BaseTest):
                                 utils.get_facts, node)
 
 
-@mock.patch.object(utils.client, 'get_client', autospec=True,
+@mock.patch.object(ironic_client, 'get_client', autospec=True,
                    side_effect=AmbiguousAuthSystem)
 class TestGetIronicClient(base.BaseTest):
-    def test_no_credentials(self, ic_mock):
+    @mock.patch.object(utils.keystone, 'get_session', autospec=True)
+    def test_no_credentials(self, session_mock, ic_mock):
         utils.CONF.config_file = ['ahc-tools.conf']
         err_msg = '.*credentials.*missing.*ironic.*searched.*ahc-tools.conf'
         self.assertRaisesRegexp(SystemExit, err_msg,
                                 utils.get_ironic_client)
         self.assertTrue(ic_mock.called)
 
+    def test_no_keystone_credentials(self, ic_mock):
+        utils.CONF.config_file = ['ahc-tools.conf']
+        err_msg = '.*credentials.*missing.*ironic.*searched.*ahc-tools.conf'
+        self.assertRaisesRegexp(SystemExit, err_msg,
+                                utils.get_ironic_client)
+        self.assertFalse(ic_mock.called)
+
+    @mock.patch.object(utils.keystone, 'get_session', autospec=True)
+    def test_shared_session(self, session_mock, ic_mock):
+        ic_mock.side_effect = None
+        utils.get_ironic_client()
+        ic_mock.assert_called_once_with(1, session=session_mock.return_value,
+                                        interface='internal')
+
 
 class TestGetIronicNodes(base.BaseTest):
     def test_only_matchable_nodes_returned(self):
@@ -67,3 +240,20 @@ class TestGetIronicNodes(base.BaseTest):
         expected = [available_node, manageable_node]
         returned_nodes = utils.get_ironic_nodes(ironic_client)
         self.assertEqual(expected, returned_nodes)
+
+    def test_iter_pages(self):
+        nodes = [mock.Mock(uuid='node%d' % i, provision_state=state)
+                 for i, state in enumerate(['available', 'active',
+                                            'manageable', 'available',
+                                            'active'])]
+        ironic_client = mock.Mock()
+        ironic_client.node.list.side_effect = [nodes[:2], nodes[2:4],
+                                               nodes[4:]]
+        returned_nodes = list(utils.iter_ironic_nodes(ironic_client,
+                                                      page_size=2))
+        self.assertEqual([nodes[0], nodes[2], nodes[3]], returned_nodes)
+        self.assertEqual(
+            [mock.call(detail=True, limit=2, marker=None),
+             mock.call(detail=True, limit=2, marker='node1'),
+             mock.call(detail=True, limit=2, marker='node3')],
+            ironic_client.node.list.call_args_list)
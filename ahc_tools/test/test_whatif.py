@@ -0,0 +1,147 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from ahc_tools import archive
+from ahc_tools.test import base
+from ahc_tools import utils
+from ahc_tools import whatif
+
+CONF = whatif.CONF
+
+STATE = "[('control', 1), ('compute', '*'), ('storage', 0)]\n"
+
+SPECS = {
+    'control': [('cpu', 'logical', 'number', 'ge(16)')],
+    'compute': [('cpu', 'logical', 'number', 'ge(8)')],
+    'storage': [('disk', '$disk', 'size', 'gt(1000)')],
+}
+
+
+def _facts(uuid, cpus, disk_size=None):
+    facts = [('system', 'product', 'uuid', uuid),
+             ('cpu', 'logical', 'number', str(cpus))]
+    if disk_size:
+        facts.append(('disk', 'sda', 'size', str(disk_size)))
+    return facts
+
+
+@mock.patch.object(whatif.sys, 'stdout')
+class TestWhatIf(base.BaseTest):
+    def setUp(self):
+        super(TestWhatIf, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.cfg_dir = os.path.join(self.tmpdir, 'edeploy')
+        os.mkdir(self.cfg_dir)
+        with open(os.path.join(self.cfg_dir, 'state'), 'w') as state_file:
+            state_file.write(STATE)
+        for name, specs in SPECS.items():
+            with open(os.path.join(self.cfg_dir, name + '.specs'),
+                      'w') as specs_file:
+                specs_file.write(repr(specs))
+        with open(os.path.join(self.cfg_dir, 'control.cmdb'),
+                  'w') as cmdb_file:
+            cmdb_file.write('[]')
+        self.archive = os.path.join(self.tmpdir, 'fleet.jsonl.gz')
+        with archive.ArchiveWriter(self.archive) as writer:
+            writer.add('node0', _facts('node0', 32))
+            writer.add('node1', _facts('node1', 8, 4000))
+            writer.add('node2', _facts('node2', 4))
+        self.args = ['--config-file', self._write_config(),
+                     '--facts-archive', self.archive]
+
+    def _write_config(self):
+        conf_file = os.path.join(self.tmpdir, 'ahc-tools.conf')
+        with open(conf_file, 'w') as conf:
+            conf.write('[edeploy]\nconfigdir = %s\nlockname = %s\n' %
+                       (self.cfg_dir, os.path.join(self.tmpdir, 'lock')))
+        return conf_file
+
+    def _output(self, stdout_mock):
+        return ''.join(c[0][0] for c in stdout_mock.write.call_args_list)
+
+    def _files(self):
+        contents = {}
+        for name in sorted(os.listdir(self.cfg_dir)):
+            with open(os.path.join(self.cfg_dir, name)) as cfg_file:
+                contents[name] = cfg_file.read()
+        return contents
+
+    def test_json(self, stdout_mock):
+        before = self._files()
+        whatif.main(self.args + ['--json'])
+        results = json.loads(self._output(stdout_mock))
+        self.assertEqual(['control', 'compute', 'storage'],
+                         results['profiles'])
+        self.assertEqual({'node0': ['control', 'compute'],
+                          'node1': ['compute', 'storage'],
+                          'node2': []}, results['nodes'])
+        self.assertEqual({'control': 1, 'compute': 2, 'storage': 1},
+                         results['counts'])
+        self.assertEqual(['node2'], results['unmatched'])
+        self.assertEqual(['node0', 'node1'], sorted(results['multiple']))
+        # Nothing is allocated, not even the exhausted storage profile.
+        self.assertEqual(before, self._files())
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'lock')))
+
+    def test_text(self, stdout_mock):
+        whatif.main(self.args + ['--profile', 'storage',
+                                 '--profile', 'control'])
+        lines = self._output(stdout_mock).splitlines()
+        self.assertEqual(['Node   storage  control',
+                          'node0     .        X   ',
+                          'node1     X        .   ',
+                          'node2     .        .   ',
+                          '',
+                          'Profile  Nodes',
+                          'storage  1',
+                          'control  1',
+                          '',
+                          'Nodes matching no profile: 1',
+                          '  node2',
+                          'Nodes matching several profiles: 0'], lines)
+
+    def test_missing_state(self, stdout_mock):
+        os.unlink(os.path.join(self.cfg_dir, 'state'))
+        self.assertRaisesRegexp(SystemExit, 'Unable to read the profiles',
+                                whatif.main, self.args)
+
+    @mock.patch.object(whatif, 'LOG')
+    @mock.patch.object(utils, 'get_facts', autospec=True)
+    @mock.patch.object(utils, 'get_ironic_client', autospec=True)
+    def test_ironic(self, client_mock, facts_mock, log_mock, stdout_mock):
+        nodes = [mock.Mock(uuid='node%d' % i, provision_state='manageable',
+                           extra={'hardware_swift_object': 'extra-%d' % i})
+                 for i in range(3)]
+        nodes.append(mock.Mock(uuid='new', provision_state='manageable',
+                               extra={}))
+        client_mock.return_value.node.list.side_effect = [nodes, []]
+
+        def get_facts(node):
+            if node.uuid == 'node1':
+                raise Exception('boom')
+            return _facts(node.uuid, 16)
+        facts_mock.side_effect = get_facts
+
+        self.assertRaisesRegexp(SystemExit, 'following nodes: node1$',
+                                whatif.main, self.args[:2] + ['--json'])
+        results = json.loads(self._output(stdout_mock))
+        self.assertEqual(['node0', 'node2'], sorted(results['nodes']))
+        self.assertEqual(1, log_mock.warning.call_count)
@@ -11,23 +11,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import functools
+import hashlib
 import json
 import logging
 import sys
+import threading
 
-from ironicclient import client
-from ironicclient.exc import AmbiguousAuthSystem
 from oslo_config import cfg
 
+from ahc_tools.common import keystone
 from ahc_tools.common import swift
+from ahc_tools import concurrency
+from ahc_tools import exc
+from ahc_tools import ingest
+from ahc_tools import stats
 
 DEFAULT_CONF_FILES = ['/etc/ahc-tools/ahc-tools.conf']
 MATCHABLE_STATES = ['manageable', 'available']
+# Number of nodes requested per page by iter_ironic_nodes.
+LIST_PAGE_SIZE = 100
 
 CONF = cfg.CONF
 
+# Idle SwiftAPI instances per configuration section, reused by the downloads
+# of a run. A swiftclient Connection must not be used by two threads at
+# once, so each concurrent download checks one out.
+_SWIFT_APIS = collections.defaultdict(list)
 
-def get_facts(node):
+# Latencies of the Swift downloads per configuration section, used to decide
+# when to send a hedged request.
+_SWIFT_LATENCIES = collections.defaultdict(concurrency.LatencyWindow)
+
+# Time at which the Swift run budget of each configuration section is
+# exhausted, counted from its first download.
+_SWIFT_DEADLINES = {}
+
+
+def get_facts(node, swift_group='swift'):
     """Get the facts stored on the Ironic DB"""
     # cardiff expects data in the form of a list of nodes
     # where each node is represented by a list of tuples
@@ -39,44 +61,185 @@ def get_facts(node):
                    "running this tool.\n")
         sys.exit(err_msg)
 
-    return _get_swift_facts(object_name)
+    return _get_swift_facts(object_name, swift_group)
+
+
+def facts_digest(facts):
+    """Return a digest identifying the content of a list of facts."""
+    return hashlib.sha1(json.dumps(facts).encode('utf-8')).hexdigest()
+
+
+def get_swift_api(group='swift'):
+    """Get an idle SwiftAPI instance, creating one if there is none.
+
+    :param group: the configuration section with the Swift credentials
+    """
+    try:
+        return _SWIFT_APIS[group].pop()
+    except IndexError:
+        conf = CONF[group]
+        try:
+            session = keystone.get_session(conf.os_auth_url, conf.username,
+                                           conf.password, conf.tenant_name)
+        except exc.MissingCredentialsError:
+            sys.exit(_missing_credentials_message(group))
+        return swift.SwiftAPI(user=conf.username,
+                              tenant_name=conf.tenant_name,
+                              key=conf.password,
+                              auth_url=conf.os_auth_url,
+                              auth_version=conf.os_auth_version,
+                              session=session,
+                              idle_timeout=conf.idle_timeout,
+                              retries=conf.max_retries)
+
+
+def release_swift_api(swift_api, group='swift'):
+    """Give back a SwiftAPI instance obtained from get_swift_api."""
+    _SWIFT_APIS[group].append(swift_api)
+
+
+def swift_limiter(group='swift'):
+    """Return a concurrency limiter for the Swift downloads."""
+    return concurrency.AIMDLimiter(group, CONF[group].max_concurrency,
+                                   CONF[group].latency_target)
+
+
+def ironic_limiter(group='ironic'):
+    """Return a concurrency limiter for the Ironic requests."""
+    return concurrency.AIMDLimiter(group, CONF[group].max_concurrency,
+                                   CONF[group].latency_target)
+
+
+def reset_swift_budget():
+    """Start the Swift run budgets over, at the next download."""
+    _SWIFT_DEADLINES.clear()
+
 
+def _check_swift_budget(object_name, group):
+    budget = CONF[group].run_budget
+    if not budget:
+        return
+    deadline = _SWIFT_DEADLINES.setdefault(group, stats.clock() + budget)
+    if stats.clock() > deadline:
+        stats.incr('swift.budget_exhausted')
+        raise exc.SwiftDownloadError(
+            'The run budget of %s seconds is exhausted' % budget,
+            object_name)
 
-def _get_swift_facts(object_name):
-    swift_api = swift.SwiftAPI(user=CONF.swift.username,
-                               tenant_name=CONF.swift.tenant_name,
-                               key=CONF.swift.password,
-                               auth_url=CONF.swift.os_auth_url,
-                               auth_version=CONF.swift.os_auth_version)
-    facts_blob = json.loads(swift_api.get_object(object_name))
-    facts = [tuple(fact) for fact in facts_blob]
+
+def _swift_check(object_name, group, start, cancel=None):
+    """Return a function failing a download which must stop.
+
+    A download stops when it was cancelled, when it takes more than the
+    request_timeout or when the run budget is exhausted.
+    """
+    timeout = CONF[group].request_timeout
+
+    def check():
+        if cancel is not None and cancel.is_set():
+            raise exc.SwiftDownloadError('Cancelled', object_name)
+        if timeout and stats.clock() - start > timeout:
+            stats.incr('swift.timeouts')
+            raise exc.SwiftDownloadError(
+                'Took more than %s seconds' % timeout, object_name)
+        _check_swift_budget(object_name, group)
+    return check
+
+
+def _get_swift_object(object_name, group, cancel=None):
+    swift_api = get_swift_api(group)
+    try:
+        start = stats.clock()
+        blob = swift_api.get_object(
+            object_name, CONF[group].container,
+            check=_swift_check(object_name, group, start, cancel))
+        _SWIFT_LATENCIES[group].add(stats.clock() - start)
+        return blob
+    finally:
+        release_swift_api(swift_api, group)
+
+
+def _get_swift_facts(object_name, group='swift'):
+    _check_swift_budget(object_name, group)
+    delay = None
+    if CONF[group].hedge_percentile:
+        delay = _SWIFT_LATENCIES[group].percentile(
+            CONF[group].hedge_percentile)
+    with stats.timer('swift.get_object'):
+        if delay is None:
+            facts_blob = _get_swift_object(object_name, group)
+        else:
+            # The request still running once hedged returns is cancelled.
+            cancel = threading.Event()
+            facts_blob = concurrency.hedged(
+                'swift', functools.partial(_get_swift_object, object_name,
+                                           group, cancel),
+                delay, cancel)
+    with stats.timer('facts.decode'):
+        facts = ingest.decode(facts_blob)
     return facts
 
 
-def get_ironic_client():
-    """Get Ironic client instance."""
-    kwargs = {'os_password': CONF.ironic.os_password,
-              'os_username': CONF.ironic.os_username,
-              'os_tenant_name': CONF.ironic.os_tenant_name,
-              'os_auth_url': CONF.ironic.os_auth_url,
-              'os_endpoint_type': 'internal'}
+def get_ironic_client(group='ironic'):
+    """Get Ironic client instance.
+
+    The client shares its Keystone session with the Swift API when they use
+    the same credentials.
+
+    :param group: the configuration section with the Ironic credentials
+    """
+    from ironicclient import client
+    from ironicclient.exc import AmbiguousAuthSystem
+
+    conf = CONF[group]
     try:
-        ironic = client.get_client(1, **kwargs)
-    except AmbiguousAuthSystem:
-        err_msg = ("Some credentials are missing from the [ironic] section of "
-                   "the configuration. The following configuration files were "
-                   "searched: (%s)." % ', '.join(CONF.config_file))
-        sys.exit(err_msg)
+        session = keystone.get_session(conf.os_auth_url, conf.os_username,
+                                       conf.os_password, conf.os_tenant_name)
+        with stats.timer('ironic.connect'):
+            ironic = client.get_client(1, session=session,
+                                       interface='internal')
+    except (AmbiguousAuthSystem, exc.MissingCredentialsError):
+        sys.exit(_missing_credentials_message(group))
     return ironic
 
 
+def _missing_credentials_message(group):
+    return ("Some credentials are missing from the [%s] section of "
+            "the configuration. The following configuration files were "
+            "searched: (%s)." % (group, ', '.join(CONF.config_file)))
+
+
 def get_ironic_nodes(ironic_client, states=MATCHABLE_STATES):
     """Get the Ironic nodes that have provision_state in states."""
     # FIXME (trown) Currently the Ironic API does not have a filter for
     # provision_state. Once we have that, we should use it instead of iterating
     # over all of the nodes.
-    all_nodes = ironic_client.node.list(detail=True, limit=0)
-    return [node for node in all_nodes if node.provision_state in states]
+    with stats.timer('ironic.list'):
+        all_nodes = ironic_client.node.list(detail=True, limit=0)
+    nodes = [node for node in all_nodes if node.provision_state in states]
+    stats.incr('nodes.listed', len(nodes))
+    return nodes
+
+
+def iter_ironic_nodes(ironic_client, states=MATCHABLE_STATES,
+                      page_size=LIST_PAGE_SIZE):
+    """Yield the Ironic nodes that have provision_state in states.
+
+    Unlike get_ironic_nodes, the nodes are listed one page at a time, so the
+    first nodes can be processed before the last ones are listed.
+    """
+    marker = None
+    while True:
+        with stats.timer('ironic.list'):
+            page = ironic_client.node.list(detail=True, limit=page_size,
+                                           marker=marker)
+        for node in page:
+            if node.provision_state in states:
+                stats.incr('nodes.listed')
+                yield node
+        if len(page) < page_size:
+            return
+        marker = page[-1].uuid
 
 
 def capabilities_to_dict(caps):
@@ -0,0 +1,176 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ast
+import collections
+import json
+import logging
+import os
+import sys
+
+from oslo_config import cfg
+
+from ahc_tools import archive
+from ahc_tools import concurrency
+from ahc_tools import conf  # noqa
+from ahc_tools import match
+from ahc_tools import report
+from ahc_tools import stats
+from ahc_tools import utils
+
+CONF = cfg.CONF
+
+LOG = logging.getLogger('ahc_tools.whatif')
+
+whatif_cli_opts = [
+    report.facts_archive_opt,
+    match.profile_opt,
+    cfg.BoolOpt('json',
+                default=False,
+                help='Print the results as JSON.'),
+]
+
+
+def profile_names():
+    """Return the profiles to evaluate, in the order of the state file."""
+    if CONF.profiles:
+        return list(CONF.profiles)
+    path = os.path.join(CONF.edeploy.configdir, 'state')
+    try:
+        with open(path) as state_file:
+            return [name for name, _ in ast.literal_eval(state_file.read())]
+    except (IOError, OSError, SyntaxError, ValueError) as e:
+        sys.exit('Unable to read the profiles from %s: %s' % (path, e))
+
+
+def get_facts(failed_nodes):
+    """Yield the (uuid, facts) of the nodes to evaluate.
+
+    The uuids of the nodes whose facts could not be downloaded are appended
+    to failed_nodes.
+    """
+    if CONF.facts_archive:
+        try:
+            for uuid, facts in archive.ArchiveReader(CONF.facts_archive):
+                yield uuid, facts
+        except archive.ArchiveError as e:
+            sys.exit(str(e))
+        return
+
+    ironic_client = utils.get_ironic_client()
+    nodes = (node for node in utils.iter_ironic_nodes(ironic_client)
+             if _has_facts(node))
+    for node, facts, error in concurrency.imap(
+            utils.get_facts, nodes, utils.swift_limiter()):
+        if error is not None:
+            LOG.error('Failed to get the facts of node %s: %s' %
+                      (node.uuid, error))
+            failed_nodes.append(node.uuid)
+            continue
+        yield node.uuid, facts
+
+
+def _has_facts(node):
+    if node.extra.get('hardware_swift_object'):
+        return True
+    LOG.warning('Node %s has no introspection data, skipping it.' %
+                node.uuid)
+    return False
+
+
+def evaluate(nodes_facts, names):
+    """Match the facts of each node against every profile.
+
+    The state file is neither locked nor modified, and the counts of the
+    profiles and their CMDB are ignored.
+
+    Returns the names of the profiles matching each node, keyed by uuid.
+    """
+    from hardware import state
+
+    sobj = state.State(cfg_dir=CONF.edeploy.configdir)
+    matrix = collections.OrderedDict()
+    for uuid, facts in nodes_facts:
+        with stats.timer('whatif.evaluate'):
+            matrix[uuid] = match.matching_profiles(sobj, facts, names)
+    stats.incr('nodes.evaluated', len(matrix))
+    return matrix
+
+
+def summarize(matrix, names):
+    """Return the node counts per profile, unmatched and multiple nodes.
+
+    The unmatched nodes match no profile, the multiple ones map to the
+    names of the several profiles they match.
+    """
+    counts = collections.OrderedDict((name, 0) for name in names)
+    unmatched = []
+    multiple = collections.OrderedDict()
+    for uuid, matching in matrix.items():
+        for name in matching:
+            counts[name] += 1
+        if not matching:
+            unmatched.append(uuid)
+        elif len(matching) > 1:
+            multiple[uuid] = matching
+    return counts, unmatched, multiple
+
+
+def print_results(matrix, names):
+    counts, unmatched, multiple = summarize(matrix, names)
+    if CONF.json:
+        json.dump({'profiles': names,
+                   'nodes': matrix,
+                   'counts': counts,
+                   'unmatched': unmatched,
+                   'multiple': multiple}, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+
+    width = max([len('Node')] + [len(uuid) for uuid in matrix])
+    print('  '.join(['Node'.ljust(width)] + names))
+    for uuid, matching in matrix.items():
+        print('  '.join([uuid.ljust(width)] +
+                        [('X' if name in matching else '.').center(len(name))
+                         for name in names]))
+
+    width = max([len('Profile')] + [len(name) for name in names])
+    print('')
+    print('%s  Nodes' % 'Profile'.ljust(width))
+    for name, count in counts.items():
+        print('%s  %d' % (name.ljust(width), count))
+
+    print('')
+    print('Nodes matching no profile: %d' % len(unmatched))
+    for uuid in unmatched:
+        print('  %s' % uuid)
+    print('Nodes matching several profiles: %d' % len(multiple))
+    for uuid, matching in multiple.items():
+        print('  %s: %s' % (uuid, ', '.join(matching)))
+
+
+def main(args=sys.argv[1:]):
+    CONF.register_cli_opts(whatif_cli_opts)
+    CONF.register_cli_opts(stats.stats_cli_opts)
+    CONF(args=args, default_config_files=utils.DEFAULT_CONF_FILES)
+    utils.setup_logging(CONF.whatif.debug)
+
+    with stats.run(CONF.profile_out, prefix='ahc_whatif'):
+        match._check_profiles()
+        names = profile_names()
+        failed_nodes = []
+        matrix = evaluate(get_facts(failed_nodes), names)
+        print_results(matrix, names)
+    if failed_nodes:
+        sys.exit('Unable to get the facts of the following nodes: %s' %
+                 ', '.join(failed_nodes))
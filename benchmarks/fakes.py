@@ -0,0 +1,170 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process stand-ins for the Ironic and Swift endpoints.
+
+The fakes replace the client objects the tools talk to, so the whole
+ahc-match and ahc-report code paths run unchanged. Each call sleeps for
+a configurable latency to model a remote undercloud.
+"""
+
+import collections
+import copy
+import random
+import threading
+import time
+
+
+class Timings(object):
+    """Accumulate wall time and call counts per phase."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.seconds[phase] += seconds
+            self.calls[phase] += 1
+
+    def wrap(self, phase, func):
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(phase, time.time() - start)
+        return wrapper
+
+    def as_dict(self):
+        return dict((phase, {'seconds': round(self.seconds[phase], 6),
+                             'calls': self.calls[phase]})
+                    for phase in self.seconds)
+
+
+class Latency(object):
+    """Latency model: a fixed cost plus a cost per item returned.
+
+    A random slow_fraction of the calls take slow more seconds, as when
+    they hit an overloaded server.
+    """
+
+    def __init__(self, base=0.0, per_item=0.0, slow_fraction=0.0, slow=0.0,
+                 seed=0):
+        self.base = base
+        self.per_item = per_item
+        self.slow_fraction = slow_fraction
+        self.slow = slow
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self, items=0):
+        delay = self.base + self.per_item * items
+        if self.slow_fraction:
+            with self._lock:
+                if self._random.random() < self.slow_fraction:
+                    delay += self.slow
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FakeNode(object):
+    def __init__(self, uuid, object_name, provision_state='manageable'):
+        self.uuid = uuid
+        self.provision_state = provision_state
+        self.properties = {'cpu_arch': 'x86_64',
+                           'capabilities': 'boot_option:local'}
+        self.extra = {'hardware_swift_object': object_name}
+        self.driver = 'pxe_ipmitool'
+        self.maintenance = False
+        self.instance_uuid = None
+
+
+class FakeNodeManager(object):
+    def __init__(self, nodes, list_latency, update_latency, timings):
+        self._nodes = nodes
+        self._list_latency = list_latency
+        self._update_latency = update_latency
+        self._timings = timings
+        self.updates = {}
+
+    def list(self, detail=False, limit=None, marker=None, **kwargs):
+        start = time.time()
+        nodes = self._nodes
+        if marker is not None:
+            uuids = [node.uuid for node in nodes]
+            nodes = nodes[uuids.index(marker) + 1:]
+        if limit:
+            nodes = nodes[:limit]
+        self._list_latency.wait(len(nodes))
+        nodes = [copy.deepcopy(node) for node in nodes]
+        self._timings.add('ironic.list', time.time() - start)
+        return nodes
+
+    def update(self, node_id, patch, **kwargs):
+        start = time.time()
+        self._update_latency.wait()
+        self.updates[node_id] = patch
+        self._timings.add('ironic.update', time.time() - start)
+
+
+class FakeIronicClient(object):
+    """Ironic client exposing the node.list/node.update calls we use."""
+
+    def __init__(self, nodes, timings, list_latency=None,
+                 update_latency=None):
+        self.node = FakeNodeManager(nodes,
+                                    list_latency or Latency(),
+                                    update_latency or Latency(),
+                                    timings)
+
+
+class FakeSwiftStore(object):
+    """Objects served by FakeSwiftConnection, keyed by (container, name)."""
+
+    def __init__(self, latency=None, timings=None):
+        self.objects = {}
+        self.latency = latency or Latency()
+        self.timings = timings or Timings()
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+
+    def put(self, container, name, body, headers=None):
+        self.objects[(container, name)] = (dict(headers or {}), body)
+
+    def connection_factory(self):
+        """Return a callable usable in place of swiftclient's Connection."""
+        store = self
+
+        def factory(*args, **kwargs):
+            return FakeSwiftConnection(store)
+        return factory
+
+
+class FakeSwiftConnection(object):
+    def __init__(self, store):
+        self._store = store
+
+    def get_object(self, container, obj, resp_chunk_size=None, **kwargs):
+        start = time.time()
+        headers, body = self._store.objects[(container, obj)]
+        self._store.latency.wait(len(body) / (1024.0 * 1024))
+        with self._store._lock:
+            self._store.bytes_served += len(body)
+        self._store.timings.add('swift.get_object', time.time() - start)
+        headers = dict(headers, **{'content-length': str(len(body))})
+        if resp_chunk_size:
+            body = [body[i:i + resp_chunk_size]
+                    for i in range(0, len(body), resp_chunk_size)]
+        return headers, body
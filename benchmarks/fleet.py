@@ -0,0 +1,218 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Synthetic fleet generator.
+
+Builds introspection fact blobs shaped like the ones stored in Swift by
+ironic-discoverd, together with the matching edeploy state, .specs and
+.cmdb files.
+"""
+
+import os
+import pprint
+import random
+import uuid
+
+
+# Hardware types making up the fleet, with the share of nodes of each type.
+HARDWARE_TYPES = {
+    'control': {'share': 0.1,
+                'vendor': 'Dell Inc.',
+                'product': 'PowerEdge R630',
+                'cpus': 2,
+                'cores': 12,
+                'memory_gb': 128,
+                'disks': [('sda', 600), ('sdb', 600)],
+                'nics': 4},
+    'compute': {'share': 0.7,
+                'vendor': 'Dell Inc.',
+                'product': 'PowerEdge R730',
+                'cpus': 2,
+                'cores': 18,
+                'memory_gb': 256,
+                'disks': [('sda', 300)],
+                'nics': 2},
+    'storage': {'share': 0.2,
+                'vendor': 'HP',
+                'product': 'ProLiant DL380 Gen9',
+                'cpus': 1,
+                'cores': 8,
+                'memory_gb': 64,
+                'disks': [('sda', 300)] + [
+                    ('sd%s' % chr(ord('b') + i), 4000) for i in range(10)],
+                'nics': 2},
+}
+
+# Profiles in the order they are tried, with the number of nodes each can
+# take ('*' means unlimited).
+PROFILES = [('control', 3), ('storage', '*'), ('compute', '*')]
+
+SPECS = {
+    'control': [
+        ('system', 'product', 'name', 'PowerEdge R630'),
+        ('cpu', 'physical', 'number', 'ge(2)'),
+        ('memory', 'total', 'size', 'ge(100000000000)'),
+        ('disk', '$disk1', 'size', 'gt(500)'),
+        ('disk', '$disk2', 'size', 'gt(500)'),
+        ('network', '$eth', 'serial', '$mac'),
+        ('network', '$eth', 'ipv4', '$ipv4'),
+    ],
+    'storage': [
+        ('system', 'product', 'vendor', 'HP'),
+        ('disk', '$disk1', 'size', 'ge(4000)'),
+        ('disk', '$disk2', 'size', 'ge(4000)'),
+        ('disk', '$disk3', 'size', 'ge(4000)'),
+        ('network', '$eth', 'serial', '$mac'),
+    ],
+    'compute': [
+        ('cpu', 'logical', 'number', 'ge(16)'),
+        ('memory', 'total', 'size', 'ge(200000000000)'),
+        ('disk', '$disk', 'size', 'gt(100)'),
+        ('network', '$eth', 'serial', '$mac'),
+        ('network', '$eth', 'ipv4', '$ipv4'),
+    ],
+}
+
+
+def _mac(rng):
+    return ':'.join('%02x' % rng.randint(0, 255) for _ in range(6))
+
+
+def _jitter(rng, value, percent=3):
+    return value * (1 + rng.uniform(-percent, percent) / 100.0)
+
+
+def generate_node(rng, hw_type, index):
+    """Return (node_uuid, facts) for a single node of the given type."""
+    hw = HARDWARE_TYPES[hw_type]
+    node_uuid = str(uuid.UUID(int=rng.getrandbits(128)))
+    serial = '%s%07d' % (hw_type[:2].upper(), index)
+    facts = [
+        ('system', 'product', 'vendor', hw['vendor']),
+        ('system', 'product', 'name', hw['product']),
+        ('system', 'product', 'serial', serial),
+        ('system', 'product', 'uuid', node_uuid),
+        ('system', 'kernel', 'version', '3.10.0-229.el7.x86_64'),
+        ('system', 'kernel', 'cmdline',
+         'BOOTIF=%s ipa-inspection-callback-url=http://10.0.0.1:5050'
+         % _mac(rng)),
+        ('firmware', 'bios', 'vendor', hw['vendor']),
+        ('firmware', 'bios', 'version', '2.1.5'),
+        ('firmware', 'bios', 'date', '04/22/2015'),
+        ('ipmi', 'lan', 'ip-address', '192.168.%d.%d' % (index // 250 % 250,
+                                                         index % 250 + 1)),
+        ('ipmi', 'lan', 'mac-address', _mac(rng)),
+        ('ipmi', 'Fan1', 'value', '%d RPM' % rng.randint(3000, 6000)),
+        ('ipmi', 'Inlet Temp', 'value', '%d degrees C' % rng.randint(18, 30)),
+        ('ipmi', 'PS1 Status', 'value', 'ok'),
+        ('cpu', 'physical', 'number', str(hw['cpus'])),
+        ('cpu', 'logical', 'number', str(hw['cpus'] * hw['cores'] * 2)),
+        ('memory', 'total', 'size', str(hw['memory_gb'] * 1024 ** 3)),
+        ('memory', 'total', 'banks', str(hw['memory_gb'] // 16)),
+        ('memory', 'DDR', 'type', 'DDR4'),
+        ('memory', 'DDR', 'speed', '2133'),
+    ]
+    for cpu in range(hw['cpus']):
+        facts += [
+            ('cpu', 'physical_%d' % cpu, 'vendor', 'GenuineIntel'),
+            ('cpu', 'physical_%d' % cpu, 'product',
+             'Intel(R) Xeon(R) CPU E5-2680 v3 @ 2.50GHz'),
+            ('cpu', 'physical_%d' % cpu, 'cores', str(hw['cores'])),
+            ('cpu', 'physical_%d' % cpu, 'threads', str(hw['cores'] * 2)),
+            ('cpu', 'physical_%d' % cpu, 'frequency', '2500000000'),
+        ]
+    for logical in range(hw['cpus'] * hw['cores'] * 2):
+        facts += [
+            ('cpu', 'logical_%d' % logical, 'bogomips',
+             '%.2f' % _jitter(rng, 4999.9, 0.5)),
+            ('cpu', 'logical_%d' % logical, 'cache_size', '30720KB'),
+            ('cpu', 'logical_%d' % logical, 'loops_per_sec',
+             str(int(_jitter(rng, 1850)))),
+            ('cpu', 'logical_%d' % logical, 'bandwidth_1M',
+             str(int(_jitter(rng, 11500)))),
+        ]
+    facts += [
+        ('cpu', 'logical', 'loops_per_sec',
+         str(int(_jitter(rng, 1850 * hw['cpus'] * hw['cores'] * 2)))),
+        ('cpu', 'logical', 'bandwidth_1M',
+         str(int(_jitter(rng, 45000)))),
+    ]
+    for disk, size in hw['disks']:
+        facts += [
+            ('disk', disk, 'size', str(size)),
+            ('disk', disk, 'vendor', 'SEAGATE'),
+            ('disk', disk, 'model', 'ST%dNM0023' % size),
+            ('disk', disk, 'rev', 'GS0F'),
+            ('disk', disk, 'id', 'wwn-0x5000c500%08x' % rng.getrandbits(32)),
+            ('disk', disk, 'standalone_read_1M_KBps',
+             str(int(_jitter(rng, 180000)))),
+            ('disk', disk, 'standalone_read_1M_IOps',
+             str(int(_jitter(rng, 175)))),
+            ('disk', disk, 'standalone_randread_4k_KBps',
+             str(int(_jitter(rng, 1400, 8)))),
+            ('disk', disk, 'standalone_randread_4k_IOps',
+             str(int(_jitter(rng, 350, 8)))),
+        ]
+    for nic in range(hw['nics']):
+        eth = 'eth%d' % nic
+        facts += [
+            ('network', eth, 'serial', _mac(rng)),
+            ('network', eth, 'vendor', 'Intel Corporation'),
+            ('network', eth, 'product', 'Ethernet 10G 2P X520 Adapter'),
+            ('network', eth, 'size', '10000000000'),
+            ('network', eth, 'driver', 'ixgbe'),
+            ('network', eth, 'link', 'yes' if nic == 0 else 'no'),
+        ]
+        if nic == 0:
+            facts.append(('network', eth, 'ipv4',
+                          '10.%d.%d.%d' % (index // 62500 % 250,
+                                           index // 250 % 250,
+                                           index % 250 + 1)))
+    facts += [
+        ('network', 'bandwidth', 'eth0', str(int(_jitter(rng, 9400)))),
+        ('network', 'requests_per_sec', 'eth0',
+         str(int(_jitter(rng, 12000, 5)))),
+    ]
+    return node_uuid, facts
+
+
+def generate_fleet(size, seed=0):
+    """Return a list of (node_uuid, facts) for a fleet of the given size."""
+    rng = random.Random(seed)
+    types = []
+    for hw_type in sorted(HARDWARE_TYPES):
+        count = int(round(size * HARDWARE_TYPES[hw_type]['share']))
+        types.extend([hw_type] * count)
+    types = (types + ['compute'] * size)[:size]
+    rng.shuffle(types)
+    return [generate_node(rng, hw_type, index)
+            for index, hw_type in enumerate(types)]
+
+
+def write_edeploy_config(configdir, cmdb_size=0):
+    """Write the state, .specs and .cmdb files used by ahc-match.
+
+    A non-zero cmdb_size attaches a CMDB with that many hostname/IP entries
+    to the compute profile.
+    """
+    with open(os.path.join(configdir, 'state'), 'w') as state_file:
+        pprint.pprint(PROFILES, stream=state_file)
+    for name, specs in SPECS.items():
+        with open(os.path.join(configdir, name + '.specs'), 'w') as specs_file:
+            pprint.pprint(specs, stream=specs_file)
+    if cmdb_size:
+        cmdb = [{'hostname': 'compute%d' % i,
+                 'ip': '172.16.%d.%d' % (i // 250, i % 250 + 1)}
+                for i in range(cmdb_size)]
+        with open(os.path.join(configdir, 'compute.cmdb'), 'w') as cmdb_file:
+            pprint.pprint(cmdb, stream=cmdb_file)
@@ -0,0 +1,265 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""End-to-end benchmark of ahc-match and ahc-report on a synthetic fleet.
+
+Every scenario (tool, fleet size) runs in its own child process so the
+peak RSS reported for it is not polluted by the previous ones. Results are
+written as JSON and can be compared against a previous results file:
+
+    python -m benchmarks.run --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import mock
+
+from benchmarks import fakes
+from benchmarks import fleet
+
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+TOOLS = ['match', 'report']
+CONTAINER = 'ironic-discoverd'
+
+
+def _write_config(workdir, args):
+    configdir = os.path.join(workdir, 'edeploy')
+    os.mkdir(configdir)
+    fleet.write_edeploy_config(configdir)
+    conf_file = os.path.join(workdir, 'ahc-tools.conf')
+    with open(conf_file, 'w') as conf:
+        conf.write('[edeploy]\n'
+                   'configdir = %s\n'
+                   'lockname = %s\n'
+                   '[swift]\n'
+                   'container = %s\n'
+                   'hedge_percentile = %d\n'
+                   % (configdir, os.path.join(workdir, 'edeploy.lock'),
+                      CONTAINER, args.swift_hedge_percentile))
+    return conf_file
+
+
+def run_scenario(tool, size, args):
+    """Run one tool against a fake fleet in this process."""
+    from hardware import state
+    from swiftclient import client as swift_client
+
+    from ahc_tools.common import keystone
+    from ahc_tools import match
+    from ahc_tools import report
+    from ahc_tools import stats
+    from ahc_tools import utils
+
+    timings = fakes.Timings()
+    store = fakes.FakeSwiftStore(
+        latency=fakes.Latency(args.swift_latency / 1000.0,
+                              args.swift_latency_per_mb / 1000.0,
+                              args.swift_slow_fraction,
+                              args.swift_slow_latency / 1000.0,
+                              seed=args.seed),
+        timings=timings)
+    nodes = []
+    for node_uuid, facts in fleet.generate_fleet(size, seed=args.seed):
+        object_name = 'extra_hardware-%s' % node_uuid
+        body = json.dumps(facts).encode('utf-8')
+        headers = {}
+        if args.compressed:
+            compressor = zlib.compressobj(9, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            headers['content-encoding'] = 'gzip'
+        store.put(CONTAINER, object_name, body, headers)
+        nodes.append(fakes.FakeNode(node_uuid, object_name))
+    ironic = fakes.FakeIronicClient(
+        nodes, timings,
+        list_latency=fakes.Latency(args.ironic_latency / 1000.0,
+                                   args.ironic_latency_per_node / 1000.0),
+        update_latency=fakes.Latency(args.ironic_latency / 1000.0))
+
+    workdir = tempfile.mkdtemp(prefix='ahc-bench-')
+    try:
+        conf_file = _write_config(workdir, args)
+        patches = [
+            mock.patch.object(utils, 'get_ironic_client',
+                              lambda *a, **kw: ironic),
+            mock.patch.object(swift_client, 'Connection',
+                              store.connection_factory()),
+            mock.patch.object(keystone, 'get_session',
+                              lambda *a, **kw: None),
+            mock.patch.object(utils, '_get_swift_facts',
+                              timings.wrap('facts.fetch',
+                                           utils._get_swift_facts)),
+            mock.patch.object(state.State, 'load',
+                              timings.wrap('state.load', state.State.load)),
+            mock.patch.object(state.State, 'save',
+                              timings.wrap('state.save', state.State.save)),
+            mock.patch.object(match, '_find_match',
+                              timings.wrap('match.find_match',
+                                           match._find_match)),
+            mock.patch.object(report, 'print_report',
+                              timings.wrap('report.print',
+                                           report.print_report)),
+        ]
+        for patch in patches:
+            patch.start()
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        start = time.time()
+        try:
+            if tool == 'match':
+                match.main(args=['--config-file', conf_file])
+            else:
+                report.main(args=['--config-file', conf_file, '--full'])
+        finally:
+            wall = time.time() - start
+            sys.stdout.close()
+            sys.stdout = stdout
+            for patch in reversed(patches):
+                patch.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {'tool': tool,
+            'nodes': size,
+            'wall_seconds': round(wall, 6),
+            'phases': timings.as_dict(),
+            'instrumentation': stats.REGISTRY.as_dict(),
+            'nodes_updated': len(ironic.node.updates),
+            'swift_bytes': store.bytes_served,
+            'peak_rss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss}
+
+
+def _child_args(args, tool, size, result_file):
+    return [sys.executable, '-m', 'benchmarks.run',
+            '--single', tool, str(size),
+            '--result-file', result_file,
+            '--seed', str(args.seed),
+            '--swift-latency', str(args.swift_latency),
+            '--swift-latency-per-mb', str(args.swift_latency_per_mb),
+            '--swift-slow-fraction', str(args.swift_slow_fraction),
+            '--swift-slow-latency', str(args.swift_slow_latency),
+            '--swift-hedge-percentile', str(args.swift_hedge_percentile),
+            '--ironic-latency', str(args.ironic_latency),
+            '--ironic-latency-per-node', str(args.ironic_latency_per_node)
+            ] + (['--compressed'] if args.compressed else [])
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.STDOUT).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(baseline, results):
+    """Print the wall time change of each scenario against a baseline."""
+    old = dict(((r['tool'], r['nodes']), r) for r in baseline['results'])
+    print('%-8s %7s %12s %12s %8s' % ('tool', 'nodes', 'before (s)',
+                                      'after (s)', 'change'))
+    for result in results['results']:
+        before = old.get((result['tool'], result['nodes']))
+        if not before:
+            continue
+        change = ((result['wall_seconds'] - before['wall_seconds']) /
+                  (before['wall_seconds'] or 1) * 100)
+        print('%-8s %7d %12.3f %12.3f %+7.1f%%' % (
+            result['tool'], result['nodes'], before['wall_seconds'],
+            result['wall_seconds'], change))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tools', default=','.join(TOOLS),
+                        help='Comma separated list of tools to run.')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Comma separated list of fleet sizes.')
+    parser.add_argument('--output', default='bench_results.json',
+                        help='File to write the JSON results to.')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Previous results file to compare against.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--swift-latency', type=float, default=2.0,
+                        help='Milliseconds per Swift GET.')
+    parser.add_argument('--swift-latency-per-mb', type=float, default=10.0,
+                        help='Additional milliseconds per MB downloaded.')
+    parser.add_argument('--swift-slow-fraction', type=float, default=0.0,
+                        help='Fraction of the Swift GETs which are slow.')
+    parser.add_argument('--swift-slow-latency', type=float, default=0.0,
+                        help='Additional milliseconds of the slow Swift '
+                             'GETs.')
+    parser.add_argument('--swift-hedge-percentile', type=int, default=0,
+                        help='[swift] hedge_percentile of the tools.')
+    parser.add_argument('--ironic-latency', type=float, default=5.0,
+                        help='Milliseconds per Ironic API call.')
+    parser.add_argument('--ironic-latency-per-node', type=float, default=0.1,
+                        help='Additional milliseconds per node listed.')
+    parser.add_argument('--compressed', action='store_true',
+                        help='Store the facts objects gzip compressed.')
+    parser.add_argument('--single', nargs=2, metavar=('TOOL', 'SIZE'),
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=sys.argv[1:]):
+    args = parse_args(argv)
+
+    if args.single:
+        tool, size = args.single
+        result = run_scenario(tool, int(size), args)
+        with open(args.result_file, 'w') as result_file:
+            json.dump(result, result_file)
+        return
+
+    results = {'revision': _git_revision(),
+               'python': platform.python_version(),
+               'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'results': []}
+    for tool in args.tools.split(','):
+        for size in [int(s) for s in args.sizes.split(',')]:
+            handle, result_file = tempfile.mkstemp(suffix='.json')
+            os.close(handle)
+            try:
+                subprocess.check_call(
+                    _child_args(args, tool, size, result_file))
+                with open(result_file) as result_fd:
+                    result = json.load(result_fd)
+            finally:
+                os.unlink(result_file)
+            print('%-8s %6d nodes: %8.3fs wall, %7d KB peak RSS' % (
+                tool, size, result['wall_seconds'], result['peak_rss_kb']))
+            results['results'].append(result)
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(json.load(baseline), results)
+
+
+if __name__ == '__main__':
+    main()
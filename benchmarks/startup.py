@@ -0,0 +1,80 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Startup time of the ahc-tools entry points.
+
+Each entry point is started with --help several times in a fresh
+interpreter and the median wall time is compared with a budget. The exit
+status is non-zero when an entry point is over its budget:
+
+    python -m benchmarks.startup --budget-ms 400
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ENTRY_POINTS = {
+    'ahc-facts': 'ahc_tools.facts',
+    'ahc-match': 'ahc_tools.match',
+    'ahc-report': 'ahc_tools.report',
+    'ahc-whatif': 'ahc_tools.whatif',
+}
+
+DEFAULT_BUDGET_MS = 400
+
+
+def time_entry_point(module, repeat):
+    """Return the sorted wall times, in ms, of `module --help` runs."""
+    code = ('import sys; from %s import main\n'
+            'try:\n'
+            '    main(["--help"])\n'
+            'except SystemExit:\n'
+            '    pass\n' % module)
+    timings = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call([sys.executable, '-c', code],
+                                  stdout=devnull, stderr=devnull)
+            timings.append((time.time() - start) * 1000)
+    return sorted(timings)
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of runs per entry point.')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='Maximum median startup time per entry point.')
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    for name, module in sorted(ENTRY_POINTS.items()):
+        timings = time_entry_point(module, args.repeat)
+        median = timings[len(timings) // 2]
+        print('%-12s median %7.1f ms, min %7.1f ms, max %7.1f ms' % (
+            name, median, timings[0], timings[-1]))
+        if median > args.budget_ms:
+            over_budget.append(name)
+
+    if over_budget:
+        print('Over the %.0f ms budget: %s' % (args.budget_ms,
+                                               ', '.join(over_budget)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()